@@ -0,0 +1,73 @@
+"""
+Benchmark of the yaml configuration loading layer.
+
+Compares, across all config.yaml files of a personalities zoo:
+    - cold   : pure python yaml.SafeLoader (what yaml.safe_load does)
+    - warm   : libyaml C loader when available, no cache
+    - cached : a fresh ConfigCache reading its persisted file (what a restarted server sees)
+
+Usage:
+    python benchmarks/bench_config_loading.py --zoo personalities_zoo --repeat 5
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import yaml
+
+from pyaipersonality.config_cache import ConfigCache, has_libyaml, parse_yaml
+
+
+def bench(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--zoo', '-z', default="personalities_zoo", help='Path to the personalities zoo')
+    parser.add_argument('--repeat', '-r', type=int, default=5, help='Number of runs per scenario (the best one is kept)')
+    args = parser.parse_args()
+
+    files = sorted(Path(args.zoo).glob("*/*/*/config.yaml"))
+    print(f"{len(files)} configuration files (libyaml available: {has_libyaml()})")
+
+    def cold():
+        for file in files:
+            with open(file, "r", encoding="utf-8") as f:
+                yaml.load(f, Loader=yaml.SafeLoader)
+
+    def warm():
+        for file in files:
+            with open(file, "r", encoding="utf-8") as f:
+                parse_yaml(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_path = Path(tmp) / "configs.pkl"
+        cache = ConfigCache(cache_path)
+        for file in files:
+            cache.load(file)
+        cache.flush()
+
+        def cached():
+            restarted_cache = ConfigCache(cache_path)
+            for file in files:
+                restarted_cache.load(file)
+
+        results = {
+            "cold": bench(cold, args.repeat),
+            "warm": bench(warm, args.repeat),
+            "cached": bench(cached, args.repeat),
+        }
+
+    for name, duration in results.items():
+        print(f"{name:<8}{duration*1000:10.2f} ms  {duration*1e6/max(len(files),1):10.1f} us/file  x{results['cold']/duration:6.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Startup time benchmark.
+
+Measures with `python -X importtime` the cost of importing the pyaipersonality package and
+the server entry point, and checks that constructing a default AIPersonality does not pull
+heavy modules (PIL, pkg_resources, yaml).
+
+Usage:
+    python benchmarks/bench_startup.py --budget-ms 30
+The script exits with a non zero code if the package import exceeds the budget or if a
+forbidden module gets imported.
+"""
+import argparse
+import subprocess
+import sys
+
+FORBIDDEN_MODULES = ["PIL", "pkg_resources", "distutils", "yaml"]
+
+
+def import_times(statement):
+    """
+    Runs a statement in a fresh interpreter with -X importtime.
+
+    Returns:
+        dict: module name -> (self time us, cumulative time us)
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def loaded_modules(statement):
+    """
+    Returns the list of top level modules loaded after running a statement in a fresh interpreter.
+    """
+    code = statement + "\nimport sys\nprint('\\n'.join(sorted({m.split('.')[0] for m in sys.modules})))"
+    completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return completed.stdout.split()
+
+
+def report(title, statement, module, top):
+    """
+    Prints the cumulative import time of a module and its most expensive dependencies.
+
+    Returns:
+        int: The cumulative import time of the module in microseconds.
+    """
+    # Keep the best of a few runs to reduce the noise
+    runs = [import_times(statement) for _ in range(3)]
+    times = min(runs, key=lambda t: t[module][1])
+    total = times[module][1]
+    print(f"{title}: {total/1000:.1f} ms")
+    for name, (self_us, cumulative_us) in sorted(times.items(), key=lambda kv: -kv[1][0])[:top]:
+        print(f"    {self_us/1000:8.2f} ms self {cumulative_us/1000:8.2f} ms cumulative  {name}")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--budget-ms', '-b', type=float, default=None, help='Maximum allowed import time of the package in milliseconds')
+    parser.add_argument('--top', '-t', type=int, default=10, help='Number of most expensive modules to show')
+    parser.add_argument('--skip-server', action='store_true', help='Do not measure the server entry point')
+    args = parser.parse_args()
+
+    failed = False
+    package_total = report("import pyaipersonality", "import pyaipersonality", "pyaipersonality", args.top)
+    if args.budget_ms is not None and package_total/1000 > args.budget_ms:
+        print(f"Package import takes {package_total/1000:.1f} ms which exceeds the budget of {args.budget_ms} ms")
+        failed = True
+
+    modules = loaded_modules("from pyaipersonality import AIPersonality\nAIPersonality()")
+    pulled = [m for m in FORBIDDEN_MODULES if m in modules]
+    if pulled:
+        print(f"Constructing a default AIPersonality imports: {', '.join(pulled)}")
+        failed = True
+    else:
+        print("Constructing a default AIPersonality does not import " + ", ".join(FORBIDDEN_MODULES))
+
+    if not args.skip_server:
+        report("import pyaipersonality.server", "import pyaipersonality.server", "pyaipersonality.server", args.top)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
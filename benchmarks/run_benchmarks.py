@@ -0,0 +1,224 @@
+"""
+Microbenchmarks of the per request and per token hot paths.
+
+Benchmarks:
+    - personality_zoo_lazy / personality_zoo_eager : AIPersonality construction for every package of the zoo
+    - replace_keys                                 : AIPersonality.replace_keys on a conditioning text
+    - personality_conditioning                     : rendering of the conditioning property
+    - detect_antiprompt_stream                     : detect_antiprompt called after each token of a growing output
+    - discussion_assembly                          : server prompt assembly (Discussion + ContextBuilder.build) for a multi turn discussion
+    - discussion_assembly_strings                  : reference string concatenation assembly of the same discussion
+    - binding_config_load / binding_config_access  : BindingConfig loading and attribute access
+
+Results are written as JSON and can be compared against a stored baseline:
+    python benchmarks/run_benchmarks.py --output baseline.json
+    python benchmarks/run_benchmarks.py --compare baseline.json --threshold 0.15
+
+The comparison exits with code 1 if any benchmark is slower than the baseline by more than the threshold.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from pyaipersonality import AIPersonality
+from pyaipersonality.binding import BindingConfig, DEFAULT_CONFIG, LLMBinding
+from pyaipersonality.context import ContextBuilder
+from pyaipersonality.discussion import Discussion
+
+# Each measured run lasts at least this long (the number of loops is calibrated accordingly)
+MIN_RUN_TIME = 0.05
+
+
+def measure(fn, repeat):
+    """
+    Measures a function. Returns the timings of one call in seconds for each run.
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        duration = time.perf_counter() - start
+        if duration >= MIN_RUN_TIME or loops >= 1 << 20:
+            break
+        loops *= 2 if duration == 0 else max(2, int(MIN_RUN_TIME / duration) + 1)
+    timings = [duration / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        timings.append((time.perf_counter() - start) / loops)
+    return timings, loops
+
+
+class WordsBinding(LLMBinding):
+    """
+    A binding without model whose tokenizer maps each word to an integer id, to benchmark the token path of discussions.
+    """
+    supports_tokens = True
+
+    def __init__(self) -> None:
+        super().__init__(None, False)
+        self.vocabulary = {}
+
+    def tokenize(self, prompt):
+        return [self.vocabulary.setdefault(word, len(self.vocabulary)) for word in prompt.split(" ")]
+
+
+def build_benchmarks(zoo: Path, tmp: Path):
+    """
+    Builds the benchmarks as name -> (description, function).
+    """
+    benchmarks = {}
+    packages = sorted(config.parent for config in zoo.glob("*/*/*/config.yaml"))
+    reference = AIPersonality(zoo / "english" / "generic" / "gpt4all", lazy=True, run_scripts=False) if (zoo / "english" / "generic" / "gpt4all").exists() else AIPersonality()
+
+    def personality_zoo_lazy():
+        for package in packages:
+            AIPersonality(package, lazy=True, run_scripts=False)
+    benchmarks["personality_zoo_lazy"] = (f"construct {len(packages)} personalities (lazy)", personality_zoo_lazy)
+
+    def personality_zoo_eager():
+        for package in packages:
+            AIPersonality(package, run_scripts=False)
+    benchmarks["personality_zoo_eager"] = (f"construct {len(packages)} personalities (eager, no scripts)", personality_zoo_eager)
+
+    conditioning = reference._personality_conditioning
+    replacements = {"date": "Sunday, May 28, 2023", "time": "12:00:00", "date_time": "Sunday, May 28, 2023 12:00:00 PM"}
+    benchmarks["replace_keys"] = ("replace_keys on the gpt4all conditioning", lambda: AIPersonality.replace_keys(conditioning, replacements))
+    benchmarks["personality_conditioning"] = ("personality_conditioning property access", lambda: reference.personality_conditioning)
+
+    tokens = [f" word{i % 50}" for i in range(512)]
+
+    def detect_antiprompt_stream():
+        output = ""
+        for token in tokens:
+            output += token
+            reference.detect_antiprompt(output)
+    benchmarks["detect_antiprompt_stream"] = ("detect_antiprompt after each of 512 tokens", detect_antiprompt_stream)
+
+    messages = [("Tell me about the topic number %d, with a few details please." % i, "Here are some details about the topic number %d. " % i * 8) for i in range(20)]
+
+    builder = ContextBuilder.from_config(DEFAULT_CONFIG, "last_n")
+    binding = WordsBinding()
+
+    def discussion_assembly():
+        discussion = Discussion(binding, reference.personality_conditioning)
+        for prompt, answer in messages:
+            discussion.add_message("user", reference.user_message_prefix + prompt + reference.link_text)
+            context = builder.build(discussion, reference.ai_message_prefix)
+            tokens = discussion.tokens(reference.ai_message_prefix, context)
+            discussion.add_message("ai", reference.ai_message_prefix + answer)
+        return tokens
+    benchmarks["discussion_assembly"] = ("assemble the prompts of a 20 turns discussion with Discussion and ContextBuilder", discussion_assembly)
+
+    def discussion_assembly_strings():
+        blocks = []
+        for prompt, answer in messages:
+            blocks.append(reference.user_message_prefix)
+            blocks.append(prompt)
+            blocks.append(reference.link_text)
+            blocks.append(reference.ai_message_prefix)
+            full_discussion = reference.personality_conditioning + "".join(blocks)
+            blocks.append(answer)
+        return full_discussion
+    benchmarks["discussion_assembly_strings"] = ("assemble the prompts of a 20 turns discussion by string concatenation (reference)", discussion_assembly_strings)
+
+    import yaml
+    config_path = tmp / "binding_config.yaml"
+    with open(config_path, "w") as f:
+        yaml.dump(dict(DEFAULT_CONFIG), f)
+    benchmarks["binding_config_load"] = ("BindingConfig load from a yaml file", lambda: BindingConfig(config_path))
+    config = BindingConfig(config_path)
+
+    def binding_config_access():
+        return (config.binding, config.model, config["n_predict"], config.temperature, config.top_k, config.top_p)
+    benchmarks["binding_config_access"] = ("6 BindingConfig attribute accesses", binding_config_access)
+    return benchmarks
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """
+    Prints the comparison with a baseline. Returns True if no benchmark regressed beyond the threshold.
+    """
+    ok = True
+    print(f"\nComparison with baseline (revision {baseline['meta'].get('revision')}, threshold {threshold:.0%})")
+    for name, result in results.items():
+        reference = baseline["results"].get(name)
+        if reference is None:
+            print(f"{name:<28}{'new':>12}")
+            continue
+        ratio = result["min_us"] / reference["min_us"] if reference["min_us"] > 0 else 1.0
+        status = "ok"
+        if ratio > 1 + threshold:
+            status = "REGRESSION"
+            ok = False
+        elif ratio < 1 - threshold:
+            status = "faster"
+        print(f"{name:<28}{reference['min_us']:12.2f}{result['min_us']:12.2f} us  x{ratio:5.2f}  {status}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--zoo', '-z', default="personalities_zoo", help='Path to the personalities zoo')
+    parser.add_argument('--repeat', '-r', type=int, default=5, help='Number of runs per benchmark')
+    parser.add_argument('--filter', '-f', default=None, help='Only run the benchmarks whose name contains this text')
+    parser.add_argument('--output', '-o', default=None, help='Write the results to this json file')
+    parser.add_argument('--compare', '-c', default=None, help='Compare the results with a baseline json file')
+    parser.add_argument('--threshold', '-t', type=float, default=0.15, help='Relative slowdown considered a regression')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        benchmarks = build_benchmarks(Path(args.zoo), Path(tmp))
+        results = {}
+        for name, (description, fn) in benchmarks.items():
+            if args.filter and args.filter not in name:
+                continue
+            timings, loops = measure(fn, args.repeat)
+            results[name] = {
+                "description": description,
+                "min_us": min(timings) * 1e6,
+                "median_us": statistics.median(timings) * 1e6,
+                "mean_us": statistics.mean(timings) * 1e6,
+                "loops": loops,
+                "runs": len(timings),
+            }
+            print(f"{name:<28}{results[name]['min_us']:14.2f} us  (median {results[name]['median_us']:.2f} us, {loops} loops)  {description}")
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -27,6 +27,7 @@ binding_name = "CTRansformers"
 
 class CTRansformers(LLMBinding):
     file_extension='*.bin'
+    supports_tokens = True
     def __init__(self, config:dict) -> None:
         """Builds a LLAMACPP binding
 
@@ -72,7 +73,7 @@ class CTRansformers(LLMBinding):
         Returns:
             list: A list of tokens representing the tokenized prompt.
         """
-        return self.model.tokenize(prompt.encode())
+        return self.model.tokenize(prompt)
 
     def detokenize(self, tokens_list):
         """
@@ -108,6 +109,25 @@ class CTRansformers(LLMBinding):
         Returns:
             str: The generated text based on the prompt
         """
+        return self._generate_tokens(self.model.tokenize(prompt), n_predict, callback, gpt_params)
+
+    def generate_from_tokens(self,
+                 tokens,
+                 n_predict: int = 128,
+                 callback: Callable[[str], None] = bool,
+                 verbose: bool = False,
+                 **gpt_params ):
+        """Generates text out of an already tokenized prompt (see generate for the parameters)
+
+        Args:
+            tokens (list or array): The token ids of the prompt
+
+        Returns:
+            str: The generated text based on the prompt
+        """
+        return self._generate_tokens(list(tokens), n_predict, callback, gpt_params)
+
+    def _generate_tokens(self, tokens, n_predict, callback, gpt_params):
         default_params = {
             'temperature': 0.7,
             'top_k': 50,
@@ -117,10 +137,9 @@ class CTRansformers(LLMBinding):
             "n_threads":8
         }
         gpt_params = {**default_params, **gpt_params}
+        output = ""
         try:
-            output = ""
             self.model.reset()
-            tokens = self.model.tokenize(prompt)
             count = 0
             for tok in self.model.generate(
                                             tokens,
@@ -147,7 +166,7 @@ class CTRansformers(LLMBinding):
                 
         except Exception as ex:
             print(ex)
-        return output            
+        return output
             
     @staticmethod
     def get_available_models():
@@ -11,13 +11,16 @@
 # Follow him on his github project : https://github.com/abetlen/llama-cpp-python
 
 ######
+from array import array
+from collections import deque
 from pathlib import Path
 from typing import Callable
-from llama_cpp import Llama
+from llama_cpp import Llama, LlamaState
+import ctypes
+import pickle
 from pyaipersonality.binding import LLMBinding, BindingConfig
 from pyaipersonality  import MSG_TYPE
 import yaml
-import random
 
 __author__ = "parisneo"
 __github__ = "https://github.com/ParisNeo/gpt4all-ui"
@@ -29,6 +32,8 @@ binding_folder_name = "llama_cpp_official"
 
 class LLAMACPP(LLMBinding):
     file_extension='*.bin'
+    supports_tokens = True
+    supports_state = True
     def __init__(self, config:BindingConfig) -> None:
         """Builds a LLAMACPP binding
 
@@ -42,7 +47,13 @@ class LLAMACPP(LLMBinding):
             
         if not "n_gpu_layers" in self.config:
             self.config["n_gpu_layers"] = 20
+        if not "ctx_shift_discard" in self.config:
+            self.config["ctx_shift_discard"] = 0
         self.model = Llama(model_path=f"./models/{binding_folder_name}/{self.config['model']}", n_ctx=self.config["ctx_size"], n_gpu_layers=self.config["n_gpu_layers"], seed=seed)
+        # Prompt tokens reused from the model state by the last request and over all requests
+        self.last_prefix_hit = 0
+        self.last_prompt_size = 0
+        self.prefix_stats = {"requests": 0, "reused_tokens": 0, "evaluated_tokens": 0, "context_shifts": 0}
 
 
     def tokenize(self, prompt):
@@ -87,10 +98,196 @@ class LLAMACPP(LLMBinding):
                 top_k (int, optional): Controls the diversity of the generated text by limiting the number of possible next tokens to consider. Defaults to 0 (no limit) if not provided.
                 top_p (float, optional): Controls the diversity of the generated text by truncating the least likely tokens whose cumulative probability exceeds `top_p`. Defaults to 0.0 (no truncation) if not provided.
                 repeat_penalty (float, optional): Adjusts the penalty for repeating tokens in the generated text. Higher values (e.g., 2.0) make the model less likely to repeat tokens. Defaults to 1.0 if not provided.
+                n_keep (int, optional): Number of tokens at the start of the prompt that are kept when the context is full and shifted. Defaults to 0.
 
         Returns:
             str: The generated text based on the prompt
         """
+        return self._generate_tokens(list(self.model.tokenize(prompt.encode())), n_predict, callback, gpt_params)
+
+    def tokenize_continuation(self, text):
+        """
+        Tokenizes a text that continues an already tokenized prompt (no beginning of sequence token is added).
+
+        Args:
+            text (str): The text to be tokenized.
+
+        Returns:
+            list: A list of tokens.
+        """
+        return self.model.tokenize(text.encode(), add_bos=False)
+
+    def generate_from_tokens(self,
+                 tokens,
+                 n_predict: int = 128,
+                 callback: Callable[[str], None] = bool,
+                 verbose: bool = False,
+                 **gpt_params ):
+        """Generates text out of an already tokenized prompt (see generate for the parameters)
+
+        Args:
+            tokens (list or array): The token ids of the prompt
+
+        Returns:
+            str: The generated text based on the prompt
+        """
+        return self._generate_tokens(list(tokens), n_predict, callback, gpt_params)
+
+    def prefix_length(self, tokens):
+        """
+        Returns the number of leading tokens of a prompt that are already evaluated in the model state.
+
+        Args:
+            tokens (list or array): The token ids of the prompt.
+
+        Returns:
+            int: The number of already evaluated tokens.
+        """
+        prefix = 0
+        for evaluated_token, token in zip(self.model.eval_tokens, tokens):
+            if evaluated_token != token:
+                break
+            prefix += 1
+        return prefix
+
+    def _keep_prefix(self, tokens):
+        # At least one token is evaluated to get the logits of the next one
+        prefix = min(self.prefix_length(tokens), len(tokens) - 1)
+        if prefix <= 0:
+            self.model.reset()
+            return 0
+        evaluated = self.model.eval_tokens
+        for _ in range(len(evaluated) - prefix):
+            evaluated.pop()
+            if len(self.model.eval_logits) > 0:
+                self.model.eval_logits.pop()
+        return prefix
+
+    def reuse_prefix(self, tokens):
+        """
+        Keeps the longest common prefix of the evaluated tokens and of a new prompt in the model state and drops the
+        rest, so only the end of the prompt has to be evaluated. The model is reset if nothing can be reused.
+
+        Args:
+            tokens (list): The token ids of the new prompt.
+
+        Returns:
+            int: The number of prompt tokens that are already evaluated.
+        """
+        prefix = self._keep_prefix(tokens)
+        self.last_prefix_hit = prefix
+        self.last_prompt_size = len(tokens)
+        self.prefix_stats["requests"] += 1
+        self.prefix_stats["reused_tokens"] += prefix
+        self.prefix_stats["evaluated_tokens"] += len(tokens) - prefix
+        return prefix
+
+    def evaluate_prompt(self, tokens):
+        """
+        Evaluates a prompt without generating, so that the model state holds it.
+
+        Args:
+            tokens (list or array): The token ids of the prompt.
+        """
+        tokens = list(tokens)
+        prefix = self._keep_prefix(tokens)
+        self.model.eval(tokens[prefix:])
+
+    def save_state(self):
+        """
+        Saves the model state (the evaluated tokens, the last logits and the llama context memory).
+
+        Returns:
+            bytes: The serialized state.
+        """
+        state = self.model.save_state()
+        return pickle.dumps({
+            "eval_tokens": array("i", state.eval_tokens),
+            "eval_logits": [array("f", logits) for logits in state.eval_logits],
+            "llama_state": bytes(state.llama_state),
+            "llama_state_size": state.llama_state_size,
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load_state(self, state):
+        """
+        Restores a state returned by save_state.
+
+        Args:
+            state (bytes): The serialized state.
+
+        Returns:
+            bool: True if the state was restored.
+        """
+        try:
+            state = pickle.loads(state)
+            llama_state = (ctypes.c_uint8 * state["llama_state_size"]).from_buffer_copy(state["llama_state"])
+            self.model.load_state(LlamaState(
+                eval_tokens=deque(state["eval_tokens"], maxlen=self.model.eval_tokens.maxlen),
+                eval_logits=deque([logits.tolist() for logits in state["eval_logits"]], maxlen=self.model.eval_logits.maxlen),
+                llama_state=llama_state,
+                llama_state_size=state["llama_state_size"],
+            ))
+            return True
+        except Exception as ex:
+            print(f"Couldn't restore the model state: {ex}")
+            self.model.reset()
+            return False
+
+    def shift_context(self, tokens, n_keep):
+        """
+        Makes room in a full context: the first n_keep evaluated tokens (the conditioning) are kept, the oldest tokens
+        after them are discarded (ctx_shift_discard tokens, half of the others if 0) and the remaining ones are
+        evaluated again after the kept ones, followed by the pending tokens.
+
+        Args:
+            tokens (list): The pending tokens that did not fit.
+            n_keep (int): The number of tokens at the start of the context that are never discarded.
+
+        Returns:
+            list: The tokens to evaluate.
+        """
+        n_ctx = self.config["ctx_size"]
+        evaluated = self.model.eval_tokens
+        n_keep = min(n_keep, len(evaluated), n_ctx // 2)
+        n_left = len(evaluated) - n_keep
+        n_discard = self.config["ctx_shift_discard"] if self.config["ctx_shift_discard"] > 0 else n_left // 2
+        n_discard = min(max(n_discard, 1), n_left)
+        tail = list(evaluated)[n_keep + n_discard:] + list(tokens)
+        # Keeps room for at least one generated token
+        room = n_ctx - n_keep - 1
+        if len(tail) > room:
+            tail = tail[len(tail) - room:]
+        if n_keep == 0:
+            self.model.reset()
+        else:
+            for _ in range(len(evaluated) - n_keep):
+                evaluated.pop()
+                if len(self.model.eval_logits) > 0:
+                    self.model.eval_logits.pop()
+        self.prefix_stats["context_shifts"] += 1
+        self.prefix_stats["evaluated_tokens"] += len(tail) - len(tokens)
+        return tail
+
+    def _decode(self, tokens, n_keep, gpt_params):
+        """
+        Evaluates the tokens then samples and evaluates the next ones (like Llama.generate), shifting the context
+        when it is full instead of failing.
+        """
+        n_ctx = self.config["ctx_size"]
+        while True:
+            if len(self.model.eval_tokens) + len(tokens) > n_ctx:
+                tokens = self.shift_context(tokens, n_keep)
+            self.model.eval(tokens)
+            token = self.model.sample(
+                                top_k=gpt_params['top_k'],
+                                top_p=gpt_params['top_p'],
+                                temp=gpt_params["temperature"],
+                                repeat_penalty=gpt_params['repeat_penalty'],
+                            )
+            yield token
+            tokens = [token]
+
+    def _generate_tokens(self, tokens, n_predict, callback, gpt_params):
         default_params = {
             'temperature': 0.7,
             'top_k': 50,
@@ -98,17 +295,12 @@ class LLAMACPP(LLMBinding):
             'repeat_penalty': 1.3
         }
         gpt_params = {**default_params, **gpt_params}
+        output = ""
         try:
-            self.model.reset()
-            output = ""
-            tokens = self.model.tokenize(prompt.encode())
+            # Only the tokens following the part of the prompt that is already evaluated are fed to the model
+            prefix = self.reuse_prefix(tokens)
             count = 0
-            for tok in self.model.generate(tokens, 
-                                            temp=gpt_params["temperature"],
-                                            top_k=gpt_params['top_k'],
-                                            top_p=gpt_params['top_p'],
-                                            repeat_penalty=gpt_params['repeat_penalty'],
-                                           ):
+            for tok in self._decode(tokens[prefix:], gpt_params.get("n_keep", 0), gpt_params):
                 if count >= n_predict or (tok == self.model.token_eos()):
                     break
                 try:
@@ -122,7 +314,8 @@ class LLAMACPP(LLMBinding):
                 count += 1
         except Exception as ex:
             print(ex)
-        return output           
+        return output
+
     @staticmethod
     def get_available_models():
         # Create the file path relative to the child class's directory
@@ -1,22 +1,24 @@
-import multiprocessing as mp
 import time
 from pyGpt4All.config import load_config, save_config
 import importlib
 from pathlib import Path
 import sys 
 from pyaipersonality import AIPersonality
+from pyaipersonality.zygote import get_zygote_context
 
 class ModelProcess:
     def __init__(self, config=None):
         self.config = config
-        self.generate_queue = mp.Queue()
-        self.generation_queue = mp.Queue()
-        self.cancel_queue = mp.Queue(maxsize=1)
-        self.clear_queue_queue = mp.Queue(maxsize=1)
-        self.set_config_queue = mp.Queue(maxsize=1)
-        self.started_queue = mp.Queue()
+        # The process is forked from the zygote that already imported the heavy dependencies
+        self.context = get_zygote_context()
+        self.generate_queue = self.context.Queue()
+        self.generation_queue = self.context.Queue()
+        self.cancel_queue = self.context.Queue(maxsize=1)
+        self.clear_queue_queue = self.context.Queue(maxsize=1)
+        self.set_config_queue = self.context.Queue(maxsize=1)
+        self.started_queue = self.context.Queue()
         self.process = None
-        self.is_generating  = mp.Value('i', 0)
+        self.is_generating  = self.context.Value('i', 0)
             
     def load_backend(self, backend_path):
 
@@ -34,7 +36,7 @@ class ModelProcess:
 
     def start(self):
         if self.process is None:
-            self.process = mp.Process(target=self._run)
+            self.process = self.context.Process(target=self._run)
             self.process.start()
 
     def stop(self):
@@ -9,8 +9,11 @@ class Install:
         # Get the current directory
         current_dir = Path(__file__).resolve().parent.parent
         sd_folder = current_dir / "sd"
+        model_file = current_dir / "models" / "DreamShaper_5_beta2_noVae_half_pruned.ckpt"
+        # The install ledger runs the install again if one of them is missing
+        self.artifacts = [sd_folder, model_file]
 
-        if not sd_folder.exists():
+        if not sd_folder.exists() or not model_file.exists():
             print("-------------- GPT4ALL backend -------------------------------")
             print("This is the first time you are using this backend.")
             print("Installing ...")
@@ -27,7 +30,8 @@ class Install:
                 self.reinstall_pytorch_with_cuda()
 
             # Step 1: Clone repository
-            subprocess.run(["git", "clone", "https://github.com/CompVis/stable-diffusion.git", str(sd_folder)])
+            if not sd_folder.exists():
+                subprocess.run(["git", "clone", "https://github.com/CompVis/stable-diffusion.git", str(sd_folder)])
 
             # Step 5: Install the Python package inside sd folder
             subprocess.run(["pip", "install", str(sd_folder)])
@@ -6,6 +6,7 @@ sd_folder = Path(__file__).resolve().parent.parent / "sd"
 sys.path.append(str(sd_folder))
 from scripts.txt2img import *
 from pyaipersonality import PAPScript, AIPersonality, MSG_TYPE
+from pyaipersonality.resources import model_key
 import urllib.parse
 import urllib.request
 import json
@@ -20,7 +21,7 @@ import yaml
 
 
 class SD:
-    def __init__(self, config):
+    def __init__(self, config, owner: PAPScript = None):
         # Get the current directory
         current_dir = Path(__file__).resolve().parent
 
@@ -176,10 +177,13 @@ class SD:
             opt.ckpt = current_dir.parent / "models"/ config["model_name"]
 
         config = OmegaConf.load(f"{self.sd_folder / opt.config}")
-        self.model = load_model_from_config(config, f"{opt.ckpt}")
-
         device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
-        self.model = self.model.to(device)
+
+        # The model is shared with the other personalities using the same checkpoint
+        def load_model():
+            return load_model_from_config(config, f"{opt.ckpt}").to(device)
+        model_id = model_key("stable_diffusion", opt.ckpt, config=(self.sd_folder / opt.config).resolve(), device=device)
+        self.model = owner.acquire_resource(model_id, load_model) if owner is not None else load_model()
 
         """
         if opt.dpm_solver:
@@ -307,7 +311,7 @@ class Processor(PAPScript):
         super().__init__()
         self.personality = personality
         self.config = self.load_config_file()
-        self.sd = SD(self.config)
+        self.sd = SD(self.config, owner=self)
 
     def load_config_file(self):
         """
@@ -6,6 +6,7 @@ sd_folder = Path(".") / "shared/sd"
 sys.path.append(str(sd_folder))
 from scripts.txt2img import *
 from pyaipersonality import PAPScript, AIPersonality, MSG_TYPE
+from pyaipersonality.resources import model_key
 import time
 
 import sys
@@ -14,7 +15,7 @@ import re
 import argparse
 
 class SD:
-    def __init__(self, gpt4art_config):
+    def __init__(self, gpt4art_config, owner: PAPScript = None):
         # Get the current directory
         root_dir = Path(".")
         current_dir = Path(__file__).resolve().parent
@@ -184,10 +185,13 @@ class SD:
 
         
         config = OmegaConf.load(f"{self.sd_folder / opt.config}")
-        self.model = load_model_from_config(config, f"{opt.ckpt}")
-
         device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
-        self.model = self.model.to(device)
+
+        # The model is shared with the other personalities using the same checkpoint
+        def load_model():
+            return load_model_from_config(config, f"{opt.ckpt}").to(device)
+        model_id = model_key("stable_diffusion", opt.ckpt, config=(self.sd_folder / opt.config).resolve(), device=device)
+        self.model = owner.acquire_resource(model_id, load_model) if owner is not None else load_model()
 
         if gpt4art_config["sampler_name"].lower()=="dpms":
             self.sampler = DPMSolverSampler(self.model)
@@ -314,7 +318,7 @@ class Processor(PAPScript):
         self.word_callback = None
         self.generate_fn = None
         self.config = self.load_config_file()
-        self.sd = SD(self.config)
+        self.sd = SD(self.config, owner=self)
 
     def load_config_file(self):
         """
@@ -14,8 +14,11 @@ class Install:
         shared_folder = root_dir/"shared"
         sd_folder = shared_folder / "sd"
         install_file = current_dir / ".installed"
+        model_file = shared_folder / "sd_models" / "DreamShaper_5_beta2_noVae_half_pruned.ckpt"
+        # The install ledger runs the install again if one of them is missing
+        self.artifacts = [sd_folder, model_file]
 
-        if not install_file.exists():
+        if not install_file.exists() or not sd_folder.exists() or not model_file.exists():
             print("-------------- GPT4ALL backend -------------------------------")
             print("This is the first time you are using this backend.")
             print("Installing ...")
@@ -1,4 +1,5 @@
 from pyaipersonality import PAPScript, AIPersonality
+from pyaipersonality.resources import model_key
 import urllib.parse
 import urllib.request
 import json
@@ -40,7 +41,12 @@ class Processor(PAPScript):
         )
         self.chunks = self.text_splitter.split_text(text)
         print("Vectorizing document")
-        self.emb = LlamaCppEmbeddings(model_path="models/llama_cpp_official/Wizard-Vicuna-7B-Uncensored.ggmlv2.q4_0.bin", n_ctx=2048)
+        model_path = "models/llama_cpp_official/Wizard-Vicuna-7B-Uncensored.ggmlv2.q4_0.bin"
+        # The embeddings model is shared with the other processors using the same weights
+        self.emb = self.acquire_resource(
+                                    model_key("llamacpp_embeddings", model_path, n_ctx=2048),
+                                    lambda: LlamaCppEmbeddings(model_path=model_path, n_ctx=2048)
+                                )
         
         self.vector_store = FAISS.from_texts(self.chunks, embedding=self.emb)
         print("Vectorization done successfully")
@@ -66,7 +72,10 @@ class Processor(PAPScript):
         """
         output =""
         docs = self.vector_store.similarity_search(prompt, k=3)
-        chain = load_qa_chain(llm=LlamaCpp(model_path="models/llama_cpp_official/Wizard-Vicuna-7B-Uncensored.ggmlv2.q4_0.bin"), chain_type="stuff")
+        model_path = "models/llama_cpp_official/Wizard-Vicuna-7B-Uncensored.ggmlv2.q4_0.bin"
+        # The model is built once and shared instead of being loaded at every request
+        llm = self.acquire_resource(model_key("llamacpp_llm", model_path), lambda: LlamaCpp(model_path=model_path))
+        chain = load_qa_chain(llm=llm, chain_type="stuff")
         response = chain.run(input_documents=docs, question=prompt)
         print(f"response: {response}")
 
@@ -5,21 +5,23 @@ __github__ = "https://github.com/ParisNeo/PyAIPersonality"
 __copyright__ = "Copyright 2023, "
 __license__ = "Apache 2.0"
 
-import yaml
 from pathlib import Path
-from PIL import Image
-from typing import Optional, List
-import pkg_resources
-from distutils.version import StrictVersion
-import re
-from datetime import datetime
-import importlib
-
-import subprocess
-import pkg_resources
+from typing import Optional, List, TYPE_CHECKING
+import os
+import copy
+import hashlib
+import importlib.util
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 from enum import Enum
 
 from pyaipersonality.binding import BindingConfig, LLMBinding
+from pyaipersonality.templates import compile_template, get_default_providers
+
+if TYPE_CHECKING:
+    # Pillow is only imported when a logo is actually opened
+    from PIL import Image
 
 class MSG_TYPE(Enum):
     MSG_TYPE_CHUNK=0
@@ -29,11 +31,24 @@ class MSG_TYPE(Enum):
     MSG_TYPE_CODE=4
     MSG_TYPE_UI=5
 
+@lru_cache(maxsize=None)
+def get_version(package_name="pyaipersonality"):
+    """
+    Returns the installed version of a package (computed once per process).
+    """
+    from importlib import metadata
+    try:
+        return metadata.version(package_name)
+    except metadata.PackageNotFoundError:
+        return "0.0.0"
+
+
 def is_package_installed(package_name):
+    from importlib import metadata
     try:
-        dist = pkg_resources.get_distribution(package_name)
+        metadata.distribution(package_name)
         return True
-    except pkg_resources.DistributionNotFound:
+    except metadata.PackageNotFoundError:
         return False
     
 
@@ -46,6 +61,7 @@ def install_package(package_name):
         print(f"{package_name} is not installed. Installing...")
         
         # Install the package using pip
+        import subprocess
         subprocess.check_call(["pip", "install", package_name])
         
         print(f"{package_name} has been successfully installed.")
@@ -154,23 +170,56 @@ class PAPScript:
         """
         return None
 
+    def acquire_resource(self, key, factory):
+        """
+        Gets a heavyweight resource shared with the other processors (see pyaipersonality.resources).
+        The reference is held by this processor until release is called.
+
+        Args:
+            key (Hashable): The resource key (see pyaipersonality.resources.model_key).
+            factory (Callable[[], Any]): Builds the resource if no other processor holds it.
+
+        Returns:
+            The resource.
+        """
+        from pyaipersonality.resources import get_resource_registry
+        return get_resource_registry().acquire(key, factory, owner=self)
+
+    def release(self):
+        """
+        Releases the shared resources held by this processor.
+        Called when the personality is unloaded (for example when it is evicted from a PersonalityRegistry).
+        Processors holding other resources can override it (and call the base implementation).
+        """
+        from pyaipersonality.resources import get_resource_registry
+        get_resource_registry().release_owner(self)
+
 
 
 class AIPersonality:
 
     # Extra 
-    Conditionning_commands={
-        "date_time": datetime.now().strftime("%A, %B %d, %Y %I:%M:%S %p"), # Replaces {{date}} with actual date
-        "date": datetime.now().strftime("%A, %B %d, %Y"), # Replaces {{date}} with actual date
-        "time": datetime.now().strftime("%H:%M:%S"), # Replaces {{time}} with actual time
-    }
-    
-    def __init__(self, personality_package_path: str|Path = None, model:LLMBinding=None, run_scripts=True):
+    # Values of the {{date_time}}, {{date}} and {{time}} variables, evaluated when the text is rendered.
+    # Other variables can be added with Conditionning_commands.register(name, function, ttl) or Conditionning_commands[name] = value
+    Conditionning_commands = get_default_providers()
+
+    # Configuration entries that can be reloaded in place (see reload)
+    CONFIG_FIELDS = [
+        "version", "author", "name", "user_name", "language", "category",
+        "personality_description", "personality_conditioning", "welcome_message", "include_welcome_message_in_disucssion",
+        "user_message_prefix", "link_text", "ai_message_prefix", "anti_prompts", "dependencies", "disclaimer",
+        "model_temperature", "model_n_predicts", "model_top_k", "model_top_p", "model_repeat_penalty", "model_repeat_last_n",
+        "processor_cfg",
+    ]
+
+    def __init__(self, personality_package_path: str|Path = None, model:LLMBinding=None, run_scripts=True, lazy=False):
         """
         Initialize an AIPersonality instance.
 
         Parameters:
         personality_package_path (str or Path): The path to the folder containing the personality package.
+        lazy (bool): If True, only the configuration is loaded. The logo, the assets list, the install step
+                     and the processor are materialized the first time they are accessed.
 
         Raises:
         ValueError: If the provided path is not a folder or does not contain a config.yaml file.
@@ -179,9 +228,10 @@ class AIPersonality:
 
         # First setup a default personality
         # Version
-        self._version = pkg_resources.get_distribution('pyaipersonality').version
+        self._version = get_version()
 
         self.run_scripts = run_scripts
+        self.lazy = lazy
 
         #General information
         self._author: str = "ParisNeo"
@@ -226,10 +276,30 @@ Date: {{date}}
         
         self._processor_cfg: dict = {}
 
-        self._logo: Optional[Image.Image] = None
+        # Default values of the configuration entries, restored by reload when an entry is removed from config.yaml
+        self._defaults = {key: copy.deepcopy(self.__dict__[f"_{key}"]) for key in self.CONFIG_FIELDS}
+
+        self._logo: Optional["Image.Image"] = None
+        # (signature of the logo source, content hash of the logo), see get_logo_hash
+        self._logo_hash = None
         self._processor = None
 
+        # Processors replaced by reload are released once the requests using them are over (see use_processor)
+        self._processor_lock = threading.Lock()
+        self._processor_users = {}
+        self._retired_processors = []
+
+        # Personality archive holding the package if any
+        self._archive = None
+        self._archive_package = None
 
+        # Modification times of the scripts the processor was built from
+        self._scripts_signature = {}
+
+        # Lazy materialization state
+        self._logo_loaded = True
+        self._assets_loaded = True
+        self._scripts_loaded = True
 
         if personality_package_path is None:
             self.config = {}
@@ -239,13 +309,16 @@ Date: {{date}}
         else:
             self.personality_package_path = Path(personality_package_path)
 
-            # Validate that the path exists
-            if not self.personality_package_path.exists():
-                raise ValueError("The provided path does not exist.")
+            # Personalities can also be loaded from a personality archive (see pyaipersonality.archive)
+            archive, _ = self._open_archive(self.personality_package_path)
+            if archive is None:
+                # Validate that the path exists
+                if not self.personality_package_path.exists():
+                    raise ValueError("The provided path does not exist.")
 
-            # Validate that the path format is OK with at least a config.yaml file present in the folder
-            if not self.personality_package_path.is_dir():
-                raise ValueError("The provided path is not a folder.")
+                # Validate that the path format is OK with at least a config.yaml file present in the folder
+                if not self.personality_package_path.is_dir():
+                    raise ValueError("The provided path is not a folder.")
 
             # Open and store the personality
             self.load_personality(personality_package_path)
@@ -266,20 +339,25 @@ Date: {{date}}
         else:
             package_path = Path(package_path)
 
-        # Verify that there is at least a configuration file
-        config_file = package_path / "config.yaml"
-        if not config_file.exists():
-            raise ValueError(f"The provided folder {package_path} does not exist.")
+        self._archive, self._archive_package = self._open_archive(package_path)
+        if self._archive is not None:
+            # The configuration is read from the archive index
+            config = self._archive.config(self._archive_package)
+            self._secret_cfg = None
+        else:
+            # Verify that there is at least a configuration file
+            config_file = package_path / "config.yaml"
+            if not config_file.exists():
+                raise ValueError(f"The provided folder {package_path} does not exist.")
 
-        with open(config_file, "r") as f:
-            config = yaml.safe_load(f)
+            from pyaipersonality.config_cache import load_yaml
+            config = load_yaml(config_file)
 
-        secret_file = package_path / "secret.yaml"
-        if secret_file.exists():
-            with open(secret_file, "r") as f:
-                self._secret_cfg = yaml.safe_load(f)
-        else:
-            self._secret_cfg = None
+            secret_file = package_path / "secret.yaml"
+            if secret_file.exists():
+                self._secret_cfg = load_yaml(secret_file)
+            else:
+                self._secret_cfg = None
 
 
         # Load parameters from the configuration file
@@ -316,59 +394,344 @@ Date: {{date}}
 
         # Check for a logo file
         self.logo_path = self.personality_package_path / "assets" / "logo.png"
-        if self.logo_path.is_file():
-            self._logo = Image.open(self.logo_path)
-
         # Get the assets folder path
         self.assets_path = self.personality_package_path / "assets"
         # Get the scripts folder path
         self.scripts_path = self.personality_package_path / "scripts"
-        
+
+        self._logo = None
+        self._processor = None
+        self._logo_loaded = False
+        self._assets_loaded = False
+        self._scripts_loaded = False
+
+        if not self.lazy:
+            self._load_logo()
+            self._load_scripts()
+            self._load_assets_list()
+        return config
+
+    @staticmethod
+    def _open_archive(package_path):
+        """
+        Opens the personality archive containing a package path.
+
+        Returns:
+            tuple: (PersonalityArchive, package path inside the archive) or (None, None) if the path is not inside an archive.
+        """
+        from_archive = ".pap" in Path(package_path).as_posix()
+        if not from_archive:
+            return None, None
+        from pyaipersonality.archive import open_archive, split_archive_path
+        archive_path, package = split_archive_path(package_path)
+        if archive_path is None:
+            return None, None
+        return open_archive(archive_path), package
+
+    def _load_logo(self):
+        """
+        Opens the personality logo if the package has one.
+        """
+        self._logo_loaded = True
+        if self._archive is not None:
+            data = self._archive.read(self._archive.member_name(self._archive_package, "assets/logo.png"))
+            if data is not None:
+                import io
+                from PIL import Image
+                self._logo = Image.open(io.BytesIO(data))
+        elif self.logo_path.is_file():
+            from PIL import Image
+            self._logo = Image.open(self.logo_path)
+
+    def get_logo_data(self) -> Optional[bytes]:
+        """
+        Returns the content of the logo file without decoding the image (used to serve thumbnails).
+
+        Returns:
+            bytes: The logo file content or None if the personality has no logo.
+        """
+        if self.personality_package_path is None:
+            return None
+        if self._archive is not None:
+            data = self._archive.read(self._archive.member_name(self._archive_package, "assets/logo.png"))
+            return bytes(data) if data is not None else None
+        if self.logo_path.is_file():
+            return self.logo_path.read_bytes()
+        return None
+
+    def get_logo_hash(self) -> Optional[str]:
+        """
+        Returns the sha1 hash of the logo file content, used as a cache key by the thumbnails.
+        The hash is only computed again when the logo file (or the archive holding it) changes.
+
+        Returns:
+            str: The hash or None if the personality has no logo.
+        """
+        if self.personality_package_path is None:
+            return None
+        if self._archive is not None:
+            signature = self._archive.signature
+        else:
+            try:
+                st = os.stat(self.logo_path)
+            except OSError:
+                return None
+            signature = (st.st_mtime_ns, st.st_size)
+        if self._logo_hash is None or self._logo_hash[0] != signature:
+            data = self.get_logo_data()
+            if data is None:
+                return None
+            self._logo_hash = (signature, hashlib.sha1(data).hexdigest())
+        return self._logo_hash[1]
+
+    def _load_assets_list(self):
+        """
+        Builds the list of files in the assets folder (the folder is recreated if missing).
+        """
+        self._assets_loaded = True
+        if self._archive is not None:
+            assets = self._archive.listdir(self._archive.member_name(self._archive_package, "assets"))
+            self._assets_list = [str(self._archive.archive_path / name) for name in assets]
+            return
         # If not exist recreate
         self.assets_path.mkdir(parents=True, exist_ok=True)
+        # Get a list of all files in the assets folder
+        self._assets_list = [str(file) for file in self.assets_path.iterdir() if file.is_file()]
 
+    def _run_install(self) -> list:
+        """
+        Executes the install script of the package if any and installs the missing dependencies.
+
+        Returns:
+            list: The artifacts declared by the Install class of the script (its artifacts attribute), if any.
+        """
+        #If it has an install script then execute it.
+        if self.install_script_path.exists():
+            module_name = self.install_script_path.stem
+            module_spec = importlib.util.spec_from_file_location(module_name, str(self.install_script_path))
+            module = importlib.util.module_from_spec(module_spec)
+            module_spec.loader.exec_module(module)
+            if hasattr(module, "Install"):
+                self._install = module.Install(self)
+            else:
+                self._install = None
+
+        #Install requirements
+        for entry in self._dependencies:
+            if not is_package_installed(entry):
+                install_package(entry)
+        return list(getattr(self._install, "artifacts", []))
+
+    def _load_scripts(self):
+        """
+        Runs the install step, installs the dependencies and builds the processor if the package has one.
+        """
+        self._scripts_loaded = True
+        package_root = self.personality_package_path
+        if self._archive is not None:
+            if not self.run_scripts:
+                self._processor = None
+                return
+            # Scripts need real files to run, the package is extracted once to the cache folder
+            package_root = self._archive.extract_package(self._archive_package)
+            self.scripts_path = package_root / "scripts"
         # If not exist recreate
         self.scripts_path.mkdir(parents=True, exist_ok=True)
 
-
         if self.run_scripts:
-            #If it has an install script then execute it.
             install_file_name = "install.py"
             self.install_script_path = self.scripts_path / install_file_name        
-            if self.install_script_path.exists():
-                module_name = install_file_name[:-3]  # Remove the ".py" extension
-                module_spec = importlib.util.spec_from_file_location(module_name, str(self.install_script_path))
-                module = importlib.util.module_from_spec(module_spec)
-                module_spec.loader.exec_module(module)
-                if hasattr(module, "Install"):
-                    self._install = module.Install(self)
-                else:
-                    self._install = None
-
-            #Install requirements
-            for entry in self._dependencies:
-                if not is_package_installed(entry):
-                    install_package(entry)
+            self._install = None
+            from pyaipersonality.install_ledger import get_install_ledger
+            # The install step is skipped if it already ran with the same script, dependencies and environment
+            get_install_ledger().run_once(
+                                            package_root,
+                                            [self.install_script_path, package_root / "requirements.txt"],
+                                            self._dependencies,
+                                            self._run_install
+                                        )
 
             # Search for any processor code
             processor_file_name = "processor.py"
             self.processor_script_path = self.scripts_path / processor_file_name
-            if self.processor_script_path.exists():
-                module_name = processor_file_name[:-3]  # Remove the ".py" extension
-                module_spec = importlib.util.spec_from_file_location(module_name, str(self.processor_script_path))
-                module = importlib.util.module_from_spec(module_spec)
-                module_spec.loader.exec_module(module)
-                if hasattr(module, "Processor"):
-                    self._processor = module.Processor(self)
-                else:
-                    self._processor = None
-            else:
-                self._processor = None
-        # Get a list of all files in the assets folder
-        contents = [str(file) for file in self.assets_path.iterdir() if file.is_file()]
+            self._scripts_signature = self._get_scripts_signature()
+            self._processor = self._build_processor()
 
-        self._assets_list = contents
-        return config
+    def _build_processor(self):
+        """
+        Builds a new processor from the processor script of the package.
+
+        Returns:
+            PAPScript: The processor or None if the package has none.
+        """
+        if self.processor_script_path.exists():
+            module_name = self.processor_script_path.stem
+            module_spec = importlib.util.spec_from_file_location(module_name, str(self.processor_script_path))
+            module = importlib.util.module_from_spec(module_spec)
+            module_spec.loader.exec_module(module)
+            if hasattr(module, "Processor"):
+                return module.Processor(self)
+        return None
+
+    @contextmanager
+    def use_processor(self):
+        """
+        Context manager giving the current processor to a request. If reload replaces the processor meanwhile, the
+        request keeps using the one it started with, which is released at the end of the last request using it.
+
+        Usage:
+        ```
+        with personality.use_processor() as processor:
+            if processor is not None:
+                processor.run_workflow(prompt, previous_discussion_text, callback)
+        ```
+        """
+        processor = self.processor
+        if processor is None:
+            yield None
+            return
+        with self._processor_lock:
+            self._processor_users[id(processor)] = self._processor_users.get(id(processor), 0) + 1
+        try:
+            yield processor
+        finally:
+            with self._processor_lock:
+                users = self._processor_users.pop(id(processor)) - 1
+                if users > 0:
+                    self._processor_users[id(processor)] = users
+                retired = users == 0 and any(old is processor for old in self._retired_processors)
+                if retired:
+                    self._retired_processors = [old for old in self._retired_processors if old is not processor]
+            if retired:
+                self._release_processor(processor)
+
+    def _retire_processor(self, processor):
+        """
+        Releases a replaced processor now, or when the last request using it is over.
+        """
+        if processor is None:
+            return
+        with self._processor_lock:
+            if id(processor) in self._processor_users:
+                self._retired_processors.append(processor)
+                return
+        self._release_processor(processor)
+
+    @staticmethod
+    def _release_processor(processor):
+        """
+        Calls the release hook of a processor (processors that don't derive from PAPScript may not have one).
+        """
+        release = getattr(processor, "release", None)
+        if callable(release):
+            try:
+                release()
+            except Exception as ex:
+                print(f"Couldn't release processor resources: {ex}")
+
+    def _get_scripts_signature(self) -> dict:
+        """
+        Returns the modification time and size of each script of the package.
+        """
+        signature = {}
+        if self.scripts_path.is_dir():
+            for entry in os.scandir(self.scripts_path):
+                if entry.is_file() and entry.name.endswith(".py"):
+                    st = entry.stat()
+                    signature[entry.name] = (st.st_mtime_ns, st.st_size)
+        return signature
+
+    def reload(self) -> dict:
+        """
+        Applies the changes made to the personality package since it was loaded.
+
+        Configuration fields (conditioning, prefixes, sampling parameters...) are swapped in at once without touching
+        the processor, and fields removed from config.yaml get their default value back. The processor is rebuilt only
+        when its script changed, and the install step runs again only if the install script or the dependencies
+        changed. A request that is already running (see use_processor) keeps the processor it started with, which is
+        released when the request is over.
+
+        Returns:
+            dict: The names of the changed fields and whether the processor was rebuilt.
+        """
+        report = {"fields": [], "processor_rebuilt": False}
+        if self.personality_package_path is None:
+            return report
+        archive, archive_package = self._open_archive(self.personality_package_path)
+        if archive is not None:
+            config = archive.config(archive_package)
+            secret_cfg = None
+        else:
+            from pyaipersonality.config_cache import load_yaml
+            config = load_yaml(self.personality_package_path / "config.yaml") or {}
+            secret_file = self.personality_package_path / "secret.yaml"
+            secret_cfg = load_yaml(secret_file) if secret_file.exists() else None
+
+        # Build all the new values first then swap them in a single update
+        changes = {}
+        for key in self.CONFIG_FIELDS:
+            # Entries removed from the configuration get their default value back
+            value = config[key] if key in config else copy.deepcopy(self._defaults[key])
+            attribute = f"_{key}"
+            if self.__dict__[attribute] != value:
+                changes[attribute] = value
+                report["fields"].append(key)
+        if secret_cfg != self._secret_cfg:
+            changes["_secret_cfg"] = secret_cfg
+        self.__dict__.update(changes)
+
+        if archive is not None and archive is not self._archive and self._scripts_loaded and self.run_scripts:
+            # The scripts of the new version of the archive are extracted to their own folder
+            self.scripts_path = archive.extract_package(archive_package) / "scripts"
+            self.install_script_path = self.scripts_path / "install.py"
+            self.processor_script_path = self.scripts_path / "processor.py"
+        # Later reads of the logo and assets go to the current version of the archive
+        self._archive, self._archive_package = archive, archive_package
+
+        # Assets are reloaded on next access
+        self._logo = None
+        self._logo_loaded = False
+        self._assets_loaded = False
+
+        if self._scripts_loaded and self.run_scripts:
+            signature = self._get_scripts_signature()
+            old_signature = self._scripts_signature
+            if signature != old_signature or "dependencies" in report["fields"]:
+                from pyaipersonality.install_ledger import get_install_ledger
+                package_root = self.scripts_path.parent
+                get_install_ledger().run_once(
+                                                package_root,
+                                                [self.install_script_path, package_root / "requirements.txt"],
+                                                self._dependencies,
+                                                self._run_install
+                                            )
+            if signature.get("processor.py") != old_signature.get("processor.py"):
+                # The new processor is built before the old one releases its shared resources so that they are reused
+                old_processor = self._processor
+                self._processor = self._build_processor()
+                self._retire_processor(old_processor)
+                report["processor_rebuilt"] = True
+            self._scripts_signature = signature
+        return report
+
+    @property
+    def is_materialized(self) -> bool:
+        """Tells if the processor step (install and processor build) of the personality has been materialized."""
+        return self._scripts_loaded
+
+    def unload(self):
+        """
+        Releases the heavy parts of the personality (processor, logo and assets list).
+        They are materialized again the next time they are accessed.
+        """
+        if self.personality_package_path is None:
+            return
+        self._release_processor(self._processor)
+        self._processor = None
+        self._logo = None
+        self._logo_loaded = False
+        self._assets_loaded = False
+        self._scripts_loaded = False
 
     def save_personality(self, package_path=None):
         """
@@ -382,6 +745,9 @@ Date: {{date}}
         else:
             package_path = Path(package_path)
 
+        if self._open_archive(package_path)[0] is not None:
+            raise ValueError("Personalities can't be saved inside a personality archive, unpack it first.")
+
         # Building output path
         config_file = package_path / "config.yaml"
         assets_folder = package_path / "assets"
@@ -417,6 +783,7 @@ Date: {{date}}
         }
 
         # Save the configuration to the YAML file
+        import yaml
         with open(config_file, "w") as f:
             yaml.dump(config, f)
 
@@ -450,7 +817,7 @@ Date: {{date}}
             "model_top_p": self._model_top_p,
             "model_repeat_penalty": self._model_repeat_penalty,
             "model_repeat_last_n": self._model_repeat_last_n,
-            "assets_list":self._assets_list
+            "assets_list":self.assets_list
         }
 
     # ========================================== Properties ===========================================
@@ -462,6 +829,8 @@ Date: {{date}}
         Returns:
         PIL.Image.Image: The personality logo as a Pillow Image object.
         """
+        if not self._logo_loaded:
+            self._load_logo()
         if hasattr(self, '_logo'):
             return self._logo
         else:
@@ -554,7 +923,7 @@ Date: {{date}}
         Returns:
             str: The personality conditioning of the AI assistant.
         """
-        return self.replace_keys(self._personality_conditioning, self.Conditionning_commands)
+        return compile_template(self._personality_conditioning).render(self.Conditionning_commands)
 
     @personality_conditioning.setter
     def personality_conditioning(self, conditioning: str):
@@ -566,6 +935,17 @@ Date: {{date}}
         """
         self._personality_conditioning = conditioning
 
+    @property
+    def static_conditioning_prefix(self) -> str:
+        """
+        Get the part of the rendered conditioning that comes before its first dynamic variable (like {{time}}).
+        This text is identical for every prompt, so prompt caches can reuse it.
+
+        Returns:
+            str: The static prefix of the personality conditioning.
+        """
+        return compile_template(self._personality_conditioning).static_prefix(self.Conditionning_commands)
+
     @property
     def welcome_message(self) -> str:
         """
@@ -574,7 +954,7 @@ Date: {{date}}
         Returns:
             str: The welcome message of the AI assistant.
         """
-        return self.replace_keys(self._welcome_message, self.Conditionning_commands)
+        return compile_template(self._welcome_message).render(self.Conditionning_commands)
 
     @welcome_message.setter
     def welcome_message(self, message: str):
@@ -810,7 +1190,9 @@ Date: {{date}}
 
     @property
     def assets_list(self) -> list:
-        """Get the number of words to consider for repeat penalty."""
+        """Get the list of files in the assets folder."""
+        if not self._assets_loaded:
+            self._load_assets_list()
         return self._assets_list
 
     @assets_list.setter
@@ -821,10 +1203,13 @@ Date: {{date}}
             value (int): The new number of words value.
         """
         self._assets_list = value
+        self._assets_loaded = True
 
     @property
     def processor(self) -> PAPScript:
-        """Get the number of words to consider for repeat penalty."""
+        """Get the personality processor (the install step and the processor are materialized on first access in lazy mode)."""
+        if not self._scripts_loaded:
+            self._load_scripts()
         return self._processor
 
     @processor.setter
@@ -835,6 +1220,7 @@ Date: {{date}}
             value (int): The new number of words value.
         """
         self._processor = value
+        self._scripts_loaded = True
 
 
     @property
@@ -919,14 +1305,5 @@ Date: {{date}}
             str: The input string with all occurrences of keys replaced by their
                 corresponding values.
         """        
-        pattern = r"\{\{(\w+)\}\}"
-        # The pattern matches "{{key}}" and captures "key" in a group.
-        # The "\w+" matches one or more word characters (letters, digits, or underscore).
-
-        def replace(match):
-            key = match.group(1)
-            return replacements.get(key, match.group(0))
-
-        output_string = re.sub(pattern, replace, input_string)
-        return output_string
+        return compile_template(input_string).render(replacements)
 
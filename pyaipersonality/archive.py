@@ -0,0 +1,357 @@
+######
+# Project       : PyAIPersonality
+# File          : archive.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# Single file personality archives.
+# A personality archive (.pap) is a zip file with uncompressed members holding one
+# personality package or a whole zoo, plus an index of the packages and of their
+# parsed configurations. Archives are memory mapped, so configurations and assets
+# are read without extracting anything. Only the scripts of a package are
+# extracted (once) to the cache folder when its processor is materialized.
+######
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import zipfile
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from pyaipersonality.paths import get_cache_dir
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+ARCHIVE_EXTENSION = ".pap"
+ARCHIVE_INDEX_NAME = ".pap_index.json"
+ARCHIVE_FORMAT_VERSION = 1
+DEFAULT_EXCLUDES = ["__pycache__", "*.pyc", ".git", ".installed", ".install", "secret.yaml"]
+
+# Size of the fixed part of a zip local file header
+_LOCAL_HEADER_SIZE = 30
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+
+def _is_excluded(rel_path: Path, excludes: List[str]) -> bool:
+    return any(fnmatch(part, pattern) for part in rel_path.parts for pattern in excludes)
+
+
+def pack(source: str | Path, archive_path: str | Path, excludes: List[str] = None) -> dict:
+    """
+    Packs a personality package or a whole personalities zoo into a single archive.
+
+    Args:
+        source (str or Path): A personality package folder (containing config.yaml) or a zoo folder.
+        archive_path (str or Path): The archive file to create.
+        excludes (List[str], optional): File or folder name patterns to leave out. Defaults to DEFAULT_EXCLUDES.
+
+    Returns:
+        dict: The archive index.
+    """
+    from pyaipersonality.config_cache import load_yaml
+    source = Path(source)
+    excludes = DEFAULT_EXCLUDES if excludes is None else excludes
+    if (source / "config.yaml").exists():
+        # A single package is stored at the root of the archive
+        package_dirs = [source]
+        root = source
+    else:
+        package_dirs = sorted(config_file.parent for config_file in source.rglob("config.yaml"))
+        root = source
+
+    index = {"version": ARCHIVE_FORMAT_VERSION, "packages": {}}
+    files = []
+    for package_dir in package_dirs:
+        rel_package = package_dir.relative_to(root).as_posix()
+        if _is_excluded(package_dir.relative_to(root), excludes):
+            continue
+        index["packages"][rel_package] = {"config": load_yaml(package_dir / "config.yaml") or {}}
+    for file in sorted(root.rglob("*")):
+        rel_file = file.relative_to(root)
+        if file.is_file() and not _is_excluded(rel_file, excludes):
+            files.append((file, rel_file.as_posix()))
+
+    archive_path = Path(archive_path)
+    archive_path.parent.mkdir(parents=True, exist_ok=True)
+    # Members are stored uncompressed so that they can be read directly from the memory map
+    with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_STORED) as zf:
+        zf.writestr(ARCHIVE_INDEX_NAME, json.dumps(index, separators=(",", ":"), default=str))
+        for file, rel_file in files:
+            zf.write(file, rel_file)
+    return index
+
+
+def _member_destination(destination: Path, name: str) -> Path:
+    """
+    Resolves the path a member is extracted to, and rejects the members that would land outside of the destination
+    folder (absolute names, ".." components or symbolic links).
+    """
+    root = destination.resolve()
+    target = (root / name).resolve()
+    if target != root and root not in target.parents:
+        raise ValueError(f"The archive member {name} would be extracted outside of {destination}")
+    return target
+
+
+def unpack(archive_path: str | Path, destination: str | Path):
+    """
+    Extracts an archive to a folder.
+
+    Args:
+        archive_path (str or Path): The archive to extract.
+        destination (str or Path): The destination folder.
+
+    Raises:
+        ValueError: If a member would be extracted outside of the destination folder.
+    """
+    with zipfile.ZipFile(archive_path, "r") as zf:
+        members = [name for name in zf.namelist() if name != ARCHIVE_INDEX_NAME]
+        for name in members:
+            _member_destination(Path(destination), name)
+        zf.extractall(destination, members)
+
+
+class PersonalityArchive:
+    """
+    A memory mapped personality archive.
+
+    Usage:
+    ```
+    archive = PersonalityArchive("zoo.pap")
+    print(archive.packages())
+    personality = archive.load_personality("english/generic/gpt4all")
+    ```
+    """
+    def __init__(self, archive_path: str | Path) -> None:
+        """
+        Initialize a PersonalityArchive.
+
+        Args:
+            archive_path (str or Path): The archive file.
+        """
+        self.archive_path = Path(archive_path).resolve()
+        self._file = open(self.archive_path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        st = os.fstat(self._file.fileno())
+        self.signature = (st.st_size, st.st_mtime_ns)
+        # name -> (data offset, size) for stored members, or None for compressed ones
+        self._members: Dict[str, Optional[Tuple[int, int]]] = {}
+        self._zipfile = zipfile.ZipFile(self._mm, "r")
+        for info in self._zipfile.infolist():
+            if info.compress_type == zipfile.ZIP_STORED:
+                self._members[info.filename] = (self._data_offset(info), info.file_size)
+            else:
+                self._members[info.filename] = None
+        index_data = self.read(ARCHIVE_INDEX_NAME)
+        self.index = json.loads(bytes(index_data)) if index_data is not None else {"packages": {}}
+        self._extract_lock = threading.Lock()
+
+    def _data_offset(self, info: zipfile.ZipInfo) -> int:
+        header = self._mm[info.header_offset:info.header_offset + _LOCAL_HEADER_SIZE]
+        if header[:4] != _LOCAL_HEADER_SIGNATURE:
+            raise ValueError(f"Corrupted archive {self.archive_path}")
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        return info.header_offset + _LOCAL_HEADER_SIZE + name_length + extra_length
+
+    def close(self):
+        """
+        Closes the archive.
+        """
+        self._zipfile.close()
+        try:
+            self._mm.close()
+        except BufferError:
+            # Views of members are still alive, the map is released with them
+            pass
+        self._file.close()
+
+    def __del__(self):
+        # Replaced versions of an archive are closed once no personality references them anymore
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    # ======================================== Members access ========================================
+    def namelist(self) -> List[str]:
+        """Returns the names of all members of the archive."""
+        return [name for name in self._members if name != ARCHIVE_INDEX_NAME]
+
+    def exists(self, name: str) -> bool:
+        """Tells if a member exists."""
+        return name in self._members
+
+    def read(self, name: str) -> Optional[memoryview]:
+        """
+        Reads a member of the archive.
+        Stored members are returned as a zero copy view of the memory map.
+
+        Args:
+            name (str): The member name.
+
+        Returns:
+            memoryview: The member content or None if it does not exist.
+        """
+        if name not in self._members:
+            return None
+        location = self._members[name]
+        if location is None:
+            return memoryview(self._zipfile.read(name))
+        offset, size = location
+        return memoryview(self._mm)[offset:offset + size]
+
+    def listdir(self, folder: str) -> List[str]:
+        """
+        Lists the files directly inside a folder of the archive.
+
+        Args:
+            folder (str): The folder path inside the archive ("" for the root).
+
+        Returns:
+            List[str]: The full member names of the files.
+        """
+        prefix = folder.rstrip("/") + "/" if folder else ""
+        return [name for name in self.namelist() if name.startswith(prefix) and "/" not in name[len(prefix):]]
+
+    # ======================================== Packages access ========================================
+    def packages(self) -> List[str]:
+        """Returns the paths of the personality packages inside the archive ("." for a single package archive)."""
+        return sorted(self.index["packages"].keys())
+
+    def config(self, package: str = ".") -> dict:
+        """
+        Returns the parsed configuration of a package (read from the archive index, no yaml parsing involved).
+
+        Args:
+            package (str, optional): The package path inside the archive. Defaults to "." (single package archive).
+        """
+        if package not in self.index["packages"]:
+            raise ValueError(f"The archive {self.archive_path} has no personality {package}")
+        return json.loads(json.dumps(self.index["packages"][package]["config"]))
+
+    def member_name(self, package: str, rel_path: str) -> str:
+        """Returns the member name of a file of a package."""
+        return rel_path if package in (".", "") else f"{package}/{rel_path}"
+
+    def extract_package(self, package: str = ".") -> Path:
+        """
+        Extracts a package to the cache folder (only once per archive version) so that its scripts can be executed.
+
+        Args:
+            package (str, optional): The package path inside the archive.
+
+        Returns:
+            Path: The folder of the extracted package.
+
+        Raises:
+            ValueError: If a member would be extracted outside of the cache folder.
+        """
+        archive_id = hashlib.sha1(f"{self.archive_path}:{self.signature}".encode()).hexdigest()[:16]
+        destination = get_cache_dir("archives", f"{self.archive_path.stem}-{archive_id}")
+        package_dir = destination if package in (".", "") else destination / package
+        marker = package_dir / ".pap_extracted"
+        with self._extract_lock:
+            if not marker.exists():
+                prefix = "" if package in (".", "") else package.rstrip("/") + "/"
+                for name in self.namelist():
+                    if prefix and not name.startswith(prefix):
+                        continue
+                    target = _member_destination(destination, name)
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    with open(target, "wb") as f:
+                        f.write(self.read(name))
+                package_dir.mkdir(parents=True, exist_ok=True)
+                marker.write_text("ok")
+        return package_dir
+
+    def load_personality(self, package: str = ".", **kwargs):
+        """
+        Builds an AIPersonality from a package of the archive.
+
+        Args:
+            package (str, optional): The package path inside the archive. Defaults to "." (single package archive).
+            **kwargs: Extra arguments passed to AIPersonality.
+
+        Returns:
+            AIPersonality: The personality.
+        """
+        from pyaipersonality import AIPersonality
+        path = self.archive_path if package in (".", "") else self.archive_path / package
+        return AIPersonality(path, **kwargs)
+
+
+_open_archives: Dict[Path, PersonalityArchive] = {}
+_open_archives_lock = threading.Lock()
+
+
+def open_archive(archive_path: str | Path) -> PersonalityArchive:
+    """
+    Returns an opened archive, reusing the already opened one if the file did not change.
+    """
+    archive_path = Path(archive_path).resolve()
+    st = os.stat(archive_path)
+    with _open_archives_lock:
+        archive = _open_archives.get(archive_path)
+        if archive is None or archive.signature != (st.st_size, st.st_mtime_ns):
+            # The old version is only dropped from the cache: the personalities built from it may still read it,
+            # its map is closed when the last of them releases it
+            archive = PersonalityArchive(archive_path)
+            _open_archives[archive_path] = archive
+        return archive
+
+
+def split_archive_path(path: str | Path) -> Tuple[Optional[Path], str]:
+    """
+    Splits a path pointing inside an archive (e.g. zoo.pap/english/generic/gpt4all) into the archive path and the package path.
+
+    Args:
+        path (str or Path): The path.
+
+    Returns:
+        tuple: (archive path, package path) or (None, "") if the path is not inside an archive.
+    """
+    path = Path(path)
+    for candidate in [path] + list(path.parents):
+        if candidate.suffix == ARCHIVE_EXTENSION and candidate.is_file():
+            package = path.relative_to(candidate).as_posix()
+            return candidate, package
+    return None, ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack, unpack and list personality archives")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    pack_parser = subparsers.add_parser("pack", help="Pack a personality package or a whole zoo")
+    pack_parser.add_argument("source", help="Personality package or zoo folder")
+    pack_parser.add_argument("--output", "-o", default=None, help="Archive file to create")
+    pack_parser.add_argument("--exclude", "-e", nargs="*", default=None, help="File or folder name patterns to leave out")
+    unpack_parser = subparsers.add_parser("unpack", help="Extract an archive")
+    unpack_parser.add_argument("archive", help="Archive file")
+    unpack_parser.add_argument("--output", "-o", default=".", help="Destination folder")
+    list_parser = subparsers.add_parser("list", help="List the personalities of an archive")
+    list_parser.add_argument("archive", help="Archive file")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        output = args.output if args.output else Path(args.source).resolve().name + ARCHIVE_EXTENSION
+        index = pack(args.source, output, args.exclude)
+        print(f"Packed {len(index['packages'])} personalities into {output}")
+    elif args.command == "unpack":
+        unpack(args.archive, args.output)
+        print(f"Extracted {args.archive} to {args.output}")
+    else:
+        archive = PersonalityArchive(args.archive)
+        for package in archive.packages():
+            print(f"{package}: {archive.config(package).get('name', '')}")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,11 +9,7 @@
 ######
 from pathlib import Path
 from typing import Callable
-import inspect
-import yaml
 import sys
-from tqdm import tqdm
-import urllib
 
 __author__ = "parisneo"
 __github__ = "https://github.com/ParisNeo/gpt4all-ui"
@@ -21,13 +17,12 @@ __copyright__ = "Copyright 2023, "
 __license__ = "Apache 2.0"
 
 
-import yaml
-
 DEFAULT_CONFIG = {
     "version": 5,
     "user_name": "user",
     "config": "default",
     "ctx_size": 2048,
+    "ctx_shift_discard": 0,
     "n_gpu_layers": 20,
     "db_path": "databases/database.db",
     "debug": False,
@@ -81,6 +76,8 @@ class BindingConfig:
         if model_full_path.exists():
             print("File already exists in folder")
         else:
+            import urllib.request
+            from tqdm import tqdm
             # Create folder if it doesn't exist
             folder_path.mkdir(parents=True, exist_ok=True)
             progress_bar = tqdm(total=None, unit="B", unit_scale=True, desc=f"Downloading {url.split('/')[-1]}")
@@ -126,12 +123,13 @@ class BindingConfig:
         return item in self.config
 
     def load_config(self, file_path):
-        with open(file_path, 'r', encoding='utf-8') as stream:
-            self.config = yaml.safe_load(stream)
+        from pyaipersonality.config_cache import load_yaml
+        self.config = load_yaml(file_path)
 
     def save_config(self, file_path):
         if self.config is None:
             raise ValueError("No configuration loaded.")
+        import yaml
         with open(file_path, "w") as f:
             yaml.dump(self.config, f)
 
@@ -185,6 +183,84 @@ class LLMBinding:
         """
         pass
 
+    def tokenize_continuation(self, text):
+        """
+        Tokenizes a text that continues an already tokenized prompt (no beginning of sequence token is added).
+        Bindings whose tokenizer adds such a token should override this.
+
+        Args:
+            text (str): The text to be tokenized.
+
+        Returns:
+            list: A list of tokens or None if the binding can't tokenize.
+        """
+        return self.tokenize(text)
+
+    # True if the binding overrides generate_from_tokens and its tokenizer returns integer token ids
+    supports_tokens = False
+
+    def generate_from_tokens(self,
+                 tokens,
+                 n_predict: int = 128,
+                 callback: Callable[[str], None] = None,
+                 verbose: bool = False,
+                 **gpt_params ):
+        """Generates text out of an already tokenized prompt
+        Bindings that can feed tokens to their model should override this, the default detokenizes the prompt and calls generate
+
+        Args:
+            tokens (list or array): The token ids of the prompt
+            n_predict (int, optional): Number of tokens to prodict. Defaults to 128.
+            callback (Callable[[str], None], optional): A callback function that is called everytime a new text element is generated. Defaults to None.
+            verbose (bool, optional): If true, the code will spit many informations about the generation process. Defaults to False.
+        """
+        return self.generate(self.detokenize(list(tokens)), n_predict, callback=callback, verbose=verbose, **gpt_params)
+
+    # True if the binding implements prefix_length, evaluate_prompt, save_state and load_state
+    supports_state = False
+
+    def prefix_length(self, tokens):
+        """
+        Returns the number of leading tokens of a prompt that are already evaluated in the model state.
+
+        Args:
+            tokens (list or array): The token ids of the prompt.
+
+        Returns:
+            int: The number of already evaluated tokens.
+        """
+        return 0
+
+    def evaluate_prompt(self, tokens):
+        """
+        Evaluates a prompt without generating, so that the model state holds it.
+
+        Args:
+            tokens (list or array): The token ids of the prompt.
+        """
+        pass
+
+    def save_state(self):
+        """
+        Saves the model state (the evaluated tokens and the model memory).
+
+        Returns:
+            bytes: The serialized state or None if the binding does not support it.
+        """
+        return None
+
+    def load_state(self, state):
+        """
+        Restores a state returned by save_state.
+
+        Args:
+            state (bytes): The serialized state.
+
+        Returns:
+            bool: True if the state was restored.
+        """
+        return False
+
     @staticmethod
     def list_models(config:dict):
         """Lists the models for this binding
@@ -198,8 +274,6 @@ class LLMBinding:
         binding_path = Path(__file__).parent
         file_path = binding_path/"models.yaml"
 
-        with open(file_path, 'r') as file:
-            yaml_data = yaml.safe_load(file)
-        
-        return yaml_data
+        from pyaipersonality.config_cache import load_yaml
+        return load_yaml(file_path)
 
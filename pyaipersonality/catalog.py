@@ -0,0 +1,388 @@
+######
+# Project       : PyAIPersonality
+# File          : catalog.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# A compact on-disk index of a personalities zoo.
+# The catalog lets tools list and filter the personalities of a zoo without building
+# an AIPersonality per folder. Only the packages whose files changed since the last
+# build are parsed again.
+######
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from pyaipersonality.config_cache import load_yaml
+from pyaipersonality.paths import get_cache_dir
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+CATALOG_FORMAT_VERSION = 2
+
+# Files of a personality package that are tracked to detect changes
+TRACKED_FILES = [
+    "config.yaml",
+    "assets/logo.png",
+    "scripts/install.py",
+    "scripts/processor.py",
+    "requirements.txt",
+]
+
+
+def file_signature(file_path: Path) -> Optional[list]:
+    """
+    Builds a cheap signature of a file out of its modification time and size.
+
+    Args:
+        file_path (Path): The file to stat.
+
+    Returns:
+        list: [mtime_ns, size] or None if the file does not exist.
+    """
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def file_hash(file_path: Path) -> str:
+    """
+    Computes the sha1 hash of a file content.
+
+    Args:
+        file_path (Path): The file to hash.
+
+    Returns:
+        str: The hex digest of the file.
+    """
+    h = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class PersonalityCard:
+    """
+    A lightweight description of a personality built from a catalog entry.
+
+    Cards use __slots__ and only hold the fields needed to browse a zoo, so thousands of them can be kept in memory.
+    The full AIPersonality is only built when `personality()` is called.
+    """
+    __slots__ = (
+        "path",
+        "language",
+        "category",
+        "name",
+        "author",
+        "version",
+        "personality_description",
+        "has_logo",
+        "has_processor",
+        "_personality",
+    )
+
+    def __init__(self, path: Path, entry: dict) -> None:
+        """
+        Initialize a PersonalityCard.
+
+        Args:
+            path (Path): The absolute path of the personality package.
+            entry (dict): The catalog entry of the personality.
+        """
+        self.path = path
+        self.language = entry["language"]
+        self.category = entry["category"]
+        self.name = entry["name"]
+        self.author = entry["author"]
+        self.version = entry["version"]
+        self.personality_description = entry["personality_description"]
+        self.has_logo = entry["has_logo"]
+        self.has_processor = entry["has_processor"]
+        self._personality = None
+
+    def personality(self, **kwargs):
+        """
+        Materializes the personality described by this card.
+        The personality is built in lazy mode (unless lazy=False is given) and is cached by the card.
+
+        Args:
+            **kwargs: Extra arguments passed to AIPersonality.
+
+        Returns:
+            AIPersonality: The personality.
+        """
+        if self._personality is None:
+            from pyaipersonality import AIPersonality
+            kwargs.setdefault("lazy", True)
+            self._personality = AIPersonality(self.path, **kwargs)
+        return self._personality
+
+    @property
+    def logo_path(self) -> Optional[Path]:
+        """Get the path to the personality logo or None if it has no logo."""
+        return self.path / "assets" / "logo.png" if self.has_logo else None
+
+    def __repr__(self):
+        return f"PersonalityCard({self.language}/{self.category}/{self.name})"
+
+
+class PersonalityCatalog:
+    """
+    An index of all personalities available in a personalities zoo.
+
+    The zoo is expected to have the layout used by personalities_zoo:
+    <language>/<category>/<personality>/config.yaml
+
+    Usage:
+    ```
+    catalog = PersonalityCatalog("personalities_zoo")
+    catalog.build()
+    for entry in catalog.list_personalities(language="english", category="art"):
+        print(entry["name"], entry["path"])
+    ```
+    """
+    def __init__(self, zoo_path: str | Path = "personalities_zoo", index_path: str | Path = None) -> None:
+        """
+        Initialize a PersonalityCatalog.
+
+        Args:
+            zoo_path (str or Path): The root folder of the personalities zoo.
+            index_path (str or Path, optional): Where to store the index. Defaults to a file in the pyaipersonality cache folder.
+        """
+        self.zoo_path = Path(zoo_path).resolve()
+        if index_path is None:
+            zoo_id = hashlib.sha1(str(self.zoo_path).encode()).hexdigest()[:16]
+            index_path = get_cache_dir("catalog") / f"{zoo_id}.json"
+        self.index_path = Path(index_path)
+        self.entries: Dict[str, dict] = {}
+        self._search_index = None
+        self.load()
+
+    def load(self) -> bool:
+        """
+        Loads the index from disk.
+
+        Returns:
+            bool: True if an index was found and loaded, False otherwise.
+        """
+        if not self.index_path.exists():
+            return False
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get("version") != CATALOG_FORMAT_VERSION or data.get("zoo_path") != str(self.zoo_path):
+            return False
+        self.entries = data["entries"]
+        return True
+
+    def save(self):
+        """
+        Writes the index to disk.
+        The file is replaced atomically so that concurrent readers never see a partial index.
+        """
+        data = {
+            "version": CATALOG_FORMAT_VERSION,
+            "zoo_path": str(self.zoo_path),
+            "entries": self.entries,
+        }
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, self.index_path)
+
+    def build(self, force: bool = False) -> dict:
+        """
+        Builds or updates the index.
+
+        Packages whose tracked files did not change since the last build are kept as is.
+        The others are parsed again, and the ones that can't be parsed anymore are dropped from the index until they are fixed.
+
+        Args:
+            force (bool, optional): If True, all packages are parsed again. Defaults to False.
+
+        Returns:
+            dict: Statistics about the update with the lists of "added", "updated" and "removed" package paths,
+                  the number of "unchanged" ones and the "failed" ones (package path -> error message).
+        """
+        stats = {"added": [], "updated": [], "removed": [], "unchanged": 0, "failed": {}}
+        found = set()
+        for config_file in self.zoo_path.glob("*/*/*/config.yaml"):
+            package_path = config_file.parent
+            rel_path = package_path.relative_to(self.zoo_path).as_posix()
+            found.add(rel_path)
+            old_entry = self.entries.get(rel_path)
+            files = self._scan_files(package_path, None if force else old_entry)
+            if not force and old_entry is not None and old_entry["files"] == files:
+                stats["unchanged"] += 1
+                continue
+            try:
+                entry = self._build_entry(package_path, rel_path, files)
+            except Exception as ex:
+                print(f"Couldn't index personality {rel_path}: {ex}")
+                stats["failed"][rel_path] = str(ex)
+                # The previous entry describes a configuration that does not exist anymore
+                if self.entries.pop(rel_path, None) is not None:
+                    stats["removed"].append(rel_path)
+                continue
+            self.entries[rel_path] = entry
+            stats["updated" if old_entry is not None else "added"].append(rel_path)
+
+        for rel_path in list(self.entries.keys()):
+            if rel_path not in found:
+                del self.entries[rel_path]
+                stats["removed"].append(rel_path)
+
+        if stats["added"] or stats["updated"] or stats["removed"] or not self.index_path.exists():
+            self.save()
+            if self._search_index is not None:
+                self._search_index.sync(self)
+        return stats
+
+    def _scan_files(self, package_path: Path, old_entry: Optional[dict]) -> dict:
+        """
+        Builds the signatures of the tracked files of a package.
+        Files are only hashed again if their modification time or size changed.
+        """
+        old_files = old_entry["files"] if old_entry is not None else {}
+        files = {}
+        for name in TRACKED_FILES:
+            signature = file_signature(package_path / name)
+            if signature is None:
+                continue
+            old = old_files.get(name)
+            if old is not None and old[:2] == signature:
+                files[name] = old
+            else:
+                files[name] = signature + [file_hash(package_path / name)]
+        return files
+
+    def _build_entry(self, package_path: Path, rel_path: str, files: dict) -> dict:
+        """
+        Parses a package configuration and builds its catalog entry.
+        """
+        config = load_yaml(package_path / "config.yaml") or {}
+        language, category, folder = rel_path.split("/")
+        return {
+            "path": rel_path,
+            "folder": folder,
+            "language": language,
+            "category": category,
+            "name": config.get("name", folder),
+            "author": config.get("author", ""),
+            "version": str(config.get("version", "")),
+            "personality_language": config.get("language", ""),
+            "personality_category": config.get("category", ""),
+            "personality_description": config.get("personality_description", ""),
+            "personality_conditioning": config.get("personality_conditioning", ""),
+            "user_message_prefix": config.get("user_message_prefix", ""),
+            "ai_message_prefix": config.get("ai_message_prefix", ""),
+            "anti_prompts": config.get("anti_prompts", []),
+            "dependencies": config.get("dependencies", []),
+            "has_logo": "assets/logo.png" in files,
+            "has_processor": "scripts/processor.py" in files,
+            "files": files,
+        }
+
+    def get(self, rel_path: str) -> Optional[dict]:
+        """
+        Returns the entry of a package.
+
+        Args:
+            rel_path (str): The package path relative to the zoo root (language/category/personality).
+
+        Returns:
+            dict: The catalog entry or None if the package is unknown.
+        """
+        return self.entries.get(rel_path)
+
+    def full_path(self, entry: dict) -> Path:
+        """
+        Returns the absolute path of a catalog entry package.
+        """
+        return self.zoo_path / entry["path"]
+
+    def languages(self) -> List[str]:
+        """Returns the sorted list of languages of the zoo."""
+        return sorted({e["language"] for e in self.entries.values()})
+
+    def categories(self, language: str = None) -> List[str]:
+        """Returns the sorted list of categories of the zoo, optionally restricted to a language."""
+        return sorted({e["category"] for e in self.entries.values() if language is None or e["language"] == language})
+
+    def list_personalities(self, language: str = None, category: str = None, name: str = None, has_processor: bool = None) -> List[dict]:
+        """
+        Lists the personalities matching the given filters.
+
+        Args:
+            language (str, optional): Keep only personalities of this language folder.
+            category (str, optional): Keep only personalities of this category folder.
+            name (str, optional): Keep only personalities whose name or folder contains this text (ignoring case).
+            has_processor (bool, optional): Keep only personalities with (True) or without (False) a processor script.
+
+        Returns:
+            List[dict]: The matching entries sorted by path.
+        """
+        if name is not None:
+            name = name.lower()
+        result = []
+        for rel_path in sorted(self.entries.keys()):
+            entry = self.entries[rel_path]
+            if language is not None and entry["language"] != language:
+                continue
+            if category is not None and entry["category"] != category:
+                continue
+            if name is not None and name not in entry["name"].lower() and name not in entry["folder"].lower():
+                continue
+            if has_processor is not None and entry["has_processor"] != has_processor:
+                continue
+            result.append(entry)
+        return result
+
+    def search(self, query: str, limit: int = 10, language: str = None, category: str = None) -> List[dict]:
+        """
+        Searches the personalities by keywords in their name, category, description and conditioning.
+        The search index is persisted next to the catalog index and updated with the entries that changed.
+
+        Args:
+            query (str): The search text.
+            limit (int, optional): The maximum number of results. Defaults to 10.
+            language (str, optional): Keep only personalities of this language folder.
+            category (str, optional): Keep only personalities of this category folder.
+
+        Returns:
+            List[dict]: The best matches sorted by decreasing score (see SearchIndex.search).
+        """
+        if self._search_index is None:
+            from pyaipersonality.search import SearchIndex
+            self._search_index = SearchIndex(self.index_path.with_suffix(".search.pkl"))
+            self._search_index.sync(self)
+        return self._search_index.search(query, limit, language, category)
+
+    def cards(self, **filters) -> List[PersonalityCard]:
+        """
+        Lists the personalities matching the given filters as PersonalityCard objects.
+
+        Args:
+            **filters: The filters accepted by list_personalities.
+
+        Returns:
+            List[PersonalityCard]: The matching cards sorted by path.
+        """
+        return [PersonalityCard(self.full_path(entry), entry) for entry in self.list_personalities(**filters)]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, rel_path):
+        return rel_path in self.entries
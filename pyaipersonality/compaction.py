@@ -0,0 +1,270 @@
+######
+# Project       : PyAIPersonality
+# File          : compaction.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# Background compaction of long discussions.
+# When a discussion grows beyond a token threshold, its oldest messages are
+# summarized by the model into a single memory message that replaces them in
+# the following prompts. Summaries are generated by a background thread while
+# the server is idle, between the turns of the users, and are abandoned as soon
+# as a request needs the model.
+######
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, List
+
+from pyaipersonality import MSG_TYPE
+from pyaipersonality.binding import LLMBinding
+from pyaipersonality.context import message_tokens
+from pyaipersonality.discussion import Discussion, Message, MEMORY_SENDER
+from pyaipersonality.sessions import SessionStateManager
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+DEFAULT_SUMMARY_PROMPT = (
+    "Summarize the following conversation in a few sentences. "
+    "Keep the facts, names, numbers and decisions that may be needed later.\n"
+    "{discussion}\n"
+    "Summary:"
+)
+DEFAULT_MEMORY_TEMPLATE = "[Summary of the earlier discussion: {summary}]\n"
+
+
+class DiscussionCompactor:
+    """
+    Summarizes the oldest messages of long discussions in the background.
+
+    Usage:
+    ```
+    compactor = DiscussionCompactor(model, sessions, threshold_tokens=1024)
+    compactor.start()
+    # When a request arrives (stops any running summary)
+    compactor.touch()
+    # After an answer
+    compactor.schedule(client_id, discussion)
+    ```
+    """
+    def __init__(
+                    self,
+                    binding: LLMBinding,
+                    sessions: SessionStateManager = None,
+                    threshold_tokens: int = 1024,
+                    keep_messages: int = 4,
+                    summary_n_predict: int = 256,
+                    idle_seconds: float = 2.0,
+                    eval_batch_size: int = 64,
+                    summary_prompt: str = DEFAULT_SUMMARY_PROMPT,
+                    memory_template: str = DEFAULT_MEMORY_TEMPLATE
+                ) -> None:
+        """
+        Initialize a DiscussionCompactor.
+
+        Args:
+            binding (LLMBinding): The model used to summarize.
+            sessions (SessionStateManager, optional): The manager of the binding, so that summarizing does not lose the
+                state of the discussions nor run during a generation. Defaults to a manager without state support.
+            threshold_tokens (int, optional): Discussions with more tokens are compacted. Defaults to 1024.
+            keep_messages (int, optional): The most recent messages that are never summarized. Defaults to 4.
+            summary_n_predict (int, optional): The maximum length of a summary in tokens. Defaults to 256.
+            idle_seconds (float, optional): How long the server must have been idle before summarizing. Defaults to 2.
+            eval_batch_size (int, optional): The summary prompt is evaluated by batches of this many tokens, so that a
+                request stops the summary between two batches. Defaults to 64.
+            summary_prompt (str, optional): The summarization prompt, with a {discussion} placeholder.
+            memory_template (str, optional): The text of the memory message, with a {summary} placeholder.
+        """
+        self.binding = binding
+        self.sessions = sessions if sessions is not None else SessionStateManager(binding, ram_budget_mb=0)
+        self.threshold_tokens = threshold_tokens
+        self.keep_messages = keep_messages
+        self.summary_n_predict = summary_n_predict
+        self.idle_seconds = idle_seconds
+        self.eval_batch_size = eval_batch_size
+        self.summary_prompt = summary_prompt
+        self.memory_template = memory_template
+        # session id -> discussion waiting for a compaction
+        self._pending: OrderedDict[Hashable, Discussion] = OrderedDict()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._interrupt = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_activity = time.monotonic()
+        self.stats = {"compactions": 0, "messages_compacted": 0, "tokens_saved": 0, "interrupted": 0}
+
+    @staticmethod
+    def discussion_tokens(discussion: Discussion) -> int:
+        """
+        Returns the number of tokens of the messages of a discussion (estimated if the binding can't tokenize).
+        """
+        return sum(message_tokens(message) for message in discussion.messages)
+
+    def select_messages(self, discussion: Discussion) -> List[Message]:
+        """
+        Returns the oldest consecutive messages to summarize (including the previous memory), or an empty list.
+        The welcome message, pinned messages and the most recent messages are never summarized.
+        """
+        messages = discussion.messages
+        end = len(messages) - self.keep_messages
+        start = 0
+        while start < end and messages[start].sender == "welcome":
+            start += 1
+        selected = []
+        for message in messages[start:end]:
+            if message.pinned and message.sender != MEMORY_SENDER:
+                break
+            selected.append(message)
+        # A memory alone or a single message is not worth a summary
+        if len([message for message in selected if message.sender != MEMORY_SENDER]) < 2:
+            return []
+        return selected
+
+    def needs_compaction(self, discussion: Discussion) -> bool:
+        """
+        Tells if a discussion is beyond the token threshold and has messages to summarize.
+        """
+        return self.discussion_tokens(discussion) > self.threshold_tokens and len(self.select_messages(discussion)) > 0
+
+    def schedule(self, session_id: Hashable, discussion: Discussion):
+        """
+        Queues a discussion for a compaction if it needs one. Call it after each answer.
+
+        Args:
+            session_id (Hashable): The session of the discussion.
+            discussion (Discussion): The discussion.
+        """
+        if not self.needs_compaction(discussion):
+            return
+        with self._lock:
+            self._pending[session_id] = discussion
+            self._pending.move_to_end(session_id)
+        self._wake.set()
+
+    def forget(self, session_id: Hashable):
+        """
+        Removes a discussion from the queue (when its client disconnects).
+        """
+        with self._lock:
+            self._pending.pop(session_id, None)
+
+    def touch(self):
+        """
+        Records an activity of the server and stops the running summary. Call it when a request arrives.
+        """
+        self.last_activity = time.monotonic()
+        self._interrupt.set()
+
+    def _summarize(self, prompt: str) -> str:
+        """
+        Generates the summary, or returns None as soon as a request arrives.
+        Bindings that can evaluate token prompts get the prompt by small batches, the others evaluate it at once.
+        """
+        def callback(chunk, message_type=MSG_TYPE.MSG_TYPE_CHUNK):
+            return not self._interrupt.is_set()
+        if self.binding.supports_state and self.binding.supports_tokens:
+            tokens = self.binding.tokenize(prompt)
+            for end in range(self.eval_batch_size, len(tokens), self.eval_batch_size):
+                if self._interrupt.is_set():
+                    return None
+                self.binding.evaluate_prompt(tokens[:end])
+            if self._interrupt.is_set():
+                return None
+            summary = self.binding.generate_from_tokens(tokens, n_predict=self.summary_n_predict, callback=callback)
+        else:
+            summary = self.binding.generate(prompt, n_predict=self.summary_n_predict, callback=callback)
+        return None if self._interrupt.is_set() else summary
+
+    def compact(self, discussion: Discussion) -> int:
+        """
+        Summarizes the oldest messages of a discussion and replaces them by a memory message.
+        The summary is abandoned if touch is called or if the server was not idle when the model became available.
+
+        Args:
+            discussion (Discussion): The discussion.
+
+        Returns:
+            int: The number of tokens saved (0 if the compaction was interrupted or not worth it).
+        """
+        messages = self.select_messages(discussion)
+        if len(messages) == 0:
+            return 0
+        text = "".join(message.text for message in messages)
+        try:
+            with self.sessions.session(("compaction",)):
+                # A request may have used the model while this thread was waiting for it
+                if self._interrupt.is_set() or time.monotonic() - self.last_activity < self.idle_seconds:
+                    self.stats["interrupted"] += 1
+                    return 0
+                summary = self._summarize(self.summary_prompt.format(discussion=text))
+                if summary is None or summary.strip() == "":
+                    self.stats["interrupted"] += 1
+                    return 0
+                # Messages are only appended to discussions, so the summarized ones are still in place unless the discussion was reset
+                before = sum(message_tokens(message) for message in messages)
+                memory = discussion.replace_messages(messages, MEMORY_SENDER, self.memory_template.format(summary=summary.strip()), pinned=True)
+        finally:
+            # The summary state is useless to the discussions
+            self.sessions.drop(("compaction",))
+        if memory is None:
+            return 0
+        saved = before - message_tokens(memory)
+        self.stats["compactions"] += 1
+        self.stats["messages_compacted"] += len(messages)
+        self.stats["tokens_saved"] += saved
+        return saved
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.idle_seconds)
+            self._wake.clear()
+            while not self._stop.is_set():
+                # Cleared before the idle check: a request arriving after the check interrupts the summary
+                self._interrupt.clear()
+                idle = time.monotonic() - self.last_activity
+                if idle < self.idle_seconds:
+                    self._stop.wait(self.idle_seconds - idle)
+                    continue
+                with self._lock:
+                    if len(self._pending) == 0:
+                        break
+                    session_id, discussion = self._pending.popitem(last=False)
+                try:
+                    saved = self.compact(discussion)
+                    if saved > 0:
+                        print(f"Discussion {session_id} compacted: {saved} tokens saved")
+                    elif self.needs_compaction(discussion) and time.monotonic() - self.last_activity < self.idle_seconds:
+                        # Interrupted by a request, retried at the next idle time
+                        self.schedule(session_id, discussion)
+                except Exception as ex:
+                    print(f"Couldn't compact discussion {session_id}: {ex}")
+
+    def start(self):
+        """
+        Starts the background thread.
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._interrupt.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+
+    def status(self) -> dict:
+        """
+        Returns the compaction counters and the number of queued discussions.
+        """
+        return {"pending": len(self._pending), **self.stats}
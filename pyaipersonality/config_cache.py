@@ -0,0 +1,192 @@
+######
+# Project       : PyAIPersonality
+# File          : config_cache.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# Yaml configuration loading layer.
+# Configurations are parsed with the libyaml C loader when it is available and the
+# parsed result is kept in a persistent binary cache keyed by path, size and
+# modification time, so restarting a server does not parse the same files again.
+######
+import atexit
+import os
+import pickle
+import threading
+from pathlib import Path
+
+from pyaipersonality.paths import get_cache_dir
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+CONFIG_CACHE_FORMAT_VERSION = 1
+
+
+_safe_loader = None
+
+
+def get_safe_loader():
+    """
+    Returns the fastest safe yaml loader available (the libyaml C loader if pyyaml was built with it).
+    yaml is imported on first use only.
+    """
+    global _safe_loader
+    if _safe_loader is None:
+        import yaml
+        _safe_loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    return _safe_loader
+
+
+def has_libyaml() -> bool:
+    """
+    Returns True if the libyaml C loader is available.
+    """
+    return get_safe_loader().__name__ == "CSafeLoader"
+
+
+def parse_yaml(stream):
+    """
+    Parses a yaml document using the fastest safe loader available.
+
+    Args:
+        stream (str or file): The yaml text or an opened file.
+
+    Returns:
+        The parsed document.
+    """
+    import yaml
+    return yaml.load(stream, Loader=get_safe_loader())
+
+
+class ConfigCache:
+    """
+    A persistent cache of parsed yaml configuration files.
+
+    Entries are keyed by the absolute path of the file and validated using its size and modification time.
+    Parsed documents are stored pickled, so every load returns a fresh object that the caller can modify freely.
+
+    Usage:
+    ```
+    cache = ConfigCache()
+    config = cache.load("personalities_zoo/english/generic/gpt4all/config.yaml")
+    cache.flush()
+    ```
+    """
+    def __init__(self, cache_path: str | Path = None) -> None:
+        """
+        Initialize a ConfigCache.
+
+        Args:
+            cache_path (str or Path, optional): The file where the cache is persisted. Defaults to a file in the pyaipersonality cache folder.
+        """
+        if cache_path is None:
+            cache_path = get_cache_dir() / "configs.pkl"
+        self.cache_path = Path(cache_path)
+        self.entries = {}
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._read()
+
+    def _read(self):
+        """
+        Reads the persisted cache if any.
+        """
+        try:
+            with open(self.cache_path, "rb") as f:
+                data = pickle.load(f)
+        except Exception:
+            return
+        if isinstance(data, dict) and data.get("version") == CONFIG_CACHE_FORMAT_VERSION:
+            self.entries = data["entries"]
+
+    def load(self, file_path: str | Path):
+        """
+        Loads a yaml file, using the cached parse result if the file did not change.
+
+        Args:
+            file_path (str or Path): The yaml file to load.
+
+        Returns:
+            The parsed document.
+        """
+        key = os.path.abspath(file_path)
+        st = os.stat(key)
+        with self._lock:
+            entry = self.entries.get(key)
+        if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            self.hits += 1
+            return pickle.loads(entry[2])
+
+        self.misses += 1
+        with open(key, "r", encoding="utf-8") as f:
+            data = parse_yaml(f)
+        with self._lock:
+            self.entries[key] = (st.st_size, st.st_mtime_ns, pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+            self.dirty = True
+        return data
+
+    def flush(self):
+        """
+        Persists the cache to disk if it changed since the last flush.
+        """
+        with self._lock:
+            if not self.dirty:
+                return
+            data = {"version": CONFIG_CACHE_FORMAT_VERSION, "entries": dict(self.entries)}
+            self.dirty = False
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as ex:
+            print(f"Couldn't save the configuration cache: {ex}")
+
+    def clear(self):
+        """
+        Empties the cache.
+        """
+        with self._lock:
+            self.entries = {}
+            self.dirty = True
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_config_cache() -> ConfigCache:
+    """
+    Returns the process wide configuration cache (it is flushed to disk at exit).
+    """
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = ConfigCache()
+                atexit.register(_default_cache.flush)
+    return _default_cache
+
+
+def load_yaml(file_path: str | Path, use_cache: bool = True):
+    """
+    Loads a yaml configuration file.
+
+    Args:
+        file_path (str or Path): The yaml file to load.
+        use_cache (bool, optional): If True, the persistent configuration cache is used. Defaults to True.
+            The cache can also be disabled globally by setting the PYAIPERSONALITY_NO_CONFIG_CACHE environment variable.
+
+    Returns:
+        The parsed document.
+    """
+    if use_cache and not os.environ.get("PYAIPERSONALITY_NO_CONFIG_CACHE"):
+        return get_config_cache().load(file_path)
+    with open(file_path, "r", encoding="utf-8") as f:
+        return parse_yaml(f)
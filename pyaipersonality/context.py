@@ -0,0 +1,246 @@
+######
+# Project       : PyAIPersonality
+# File          : context.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# Context window assembly.
+# The prompt sent to the model always starts with the personality conditioning,
+# followed by as many messages of the discussion as the context window can hold
+# next to the generated tokens. Which messages are kept is decided by a policy
+# (last N messages, fill the budget, keep pinned messages). Policies work on the
+# cached token counts of the messages, so assembling a context never tokenizes.
+######
+from typing import Dict, List, Type
+
+from pyaipersonality.discussion import Discussion, Message, MEMORY_SENDER
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+# Rough number of characters per token, used for messages that are not tokenized
+CHARS_PER_TOKEN = 4
+
+
+def message_tokens(message: Message) -> int:
+    """
+    Returns the token count of a message, estimated from its length if the binding can't tokenize.
+    """
+    if message.tokens is not None:
+        return len(message.tokens)
+    return len(message.text) // CHARS_PER_TOKEN + 1
+
+
+class ContextPolicy:
+    """
+    Chooses the messages of a discussion that are put in the prompt.
+    Policies must keep the messages in the discussion order and stay within the token budget.
+    """
+    def select(self, messages: List[Message], budget: int) -> List[Message]:
+        """
+        Selects messages.
+        This should be implemented by child classes, the default keeps all the messages.
+
+        Args:
+            messages (List[Message]): The messages of the discussion, oldest first.
+            budget (int): The number of tokens available for the messages.
+
+        Returns:
+            List[Message]: The selected messages, oldest first.
+        """
+        return messages
+
+    @staticmethod
+    def fill_from_end(messages: List[Message], budget: int, max_messages: int = None) -> List[Message]:
+        """
+        Keeps the most recent messages that fit in the budget. The selection stops at the first message that does not
+        fit, so the kept messages are contiguous.
+        """
+        selected = []
+        for message in reversed(messages):
+            if max_messages is not None and len(selected) >= max_messages:
+                break
+            count = message_tokens(message)
+            if count > budget:
+                break
+            budget -= count
+            selected.append(message)
+        selected.reverse()
+        return selected
+
+
+class BudgetFillPolicy(ContextPolicy):
+    """
+    Keeps as many recent messages as the token budget allows.
+    """
+    def select(self, messages: List[Message], budget: int) -> List[Message]:
+        return self.fill_from_end(messages, budget)
+
+
+class LastNPolicy(ContextPolicy):
+    """
+    Keeps the N most recent messages (fewer if they don't fit in the token budget).
+    """
+    def __init__(self, nb_messages: int) -> None:
+        """
+        Initialize a LastNPolicy.
+
+        Args:
+            nb_messages (int): The maximum number of messages to keep.
+        """
+        self.nb_messages = nb_messages
+
+    def select(self, messages: List[Message], budget: int) -> List[Message]:
+        return self.fill_from_end(messages, budget, self.nb_messages)
+
+
+class PinnedPolicy(ContextPolicy):
+    """
+    Keeps the pinned messages (oldest pinned messages are dropped first if they don't all fit), then lets another
+    policy fill the remaining budget with the other messages.
+    """
+    def __init__(self, policy: ContextPolicy = None) -> None:
+        """
+        Initialize a PinnedPolicy.
+
+        Args:
+            policy (ContextPolicy, optional): The policy choosing the unpinned messages. Defaults to BudgetFillPolicy.
+        """
+        self.policy = policy if policy is not None else BudgetFillPolicy()
+
+    def select(self, messages: List[Message], budget: int) -> List[Message]:
+        pinned = []
+        for message in reversed(messages):
+            if message.pinned:
+                count = message_tokens(message)
+                if count <= budget:
+                    budget -= count
+                    pinned.append(message)
+        if len(pinned) == 0:
+            return self.policy.select(messages, budget)
+        kept = set(map(id, pinned))
+        others = self.policy.select([message for message in messages if not message.pinned], budget)
+        kept.update(map(id, others))
+        return [message for message in messages if id(message) in kept]
+
+
+# Policy name -> class, as accepted by get_context_policy
+CONTEXT_POLICIES: Dict[str, Type[ContextPolicy]] = {
+    "last_n": LastNPolicy,
+    "budget_fill": BudgetFillPolicy,
+    "pinned": PinnedPolicy,
+}
+
+
+def get_context_policy(name: str, nb_messages_to_remember: int = None) -> ContextPolicy:
+    """
+    Builds a policy by name.
+
+    Args:
+        name (str): One of "last_n", "budget_fill" or "pinned" (pinned messages plus the last N messages).
+        nb_messages_to_remember (int, optional): N for the "last_n" and "pinned" policies. None means no limit.
+
+    Returns:
+        ContextPolicy: The policy.
+    """
+    if name not in CONTEXT_POLICIES:
+        raise ValueError(f"Unknown context policy {name} (available: {', '.join(CONTEXT_POLICIES)})")
+    if name == "budget_fill" or nb_messages_to_remember is None:
+        inner = BudgetFillPolicy()
+    else:
+        inner = LastNPolicy(nb_messages_to_remember)
+    return PinnedPolicy(inner) if name == "pinned" else inner
+
+
+class ContextBuilder:
+    """
+    Assembles the messages sent to the model within the context window.
+
+    Usage:
+    ```
+    builder = ContextBuilder.from_config(config, "pinned")
+    messages = builder.build(discussion, suffix=personality.ai_message_prefix, n_predict=personality.model_n_predicts)
+    discussion.generate(n_predict, callback, suffix=personality.ai_message_prefix, messages=messages)
+    ```
+    """
+    def __init__(self, policy: ContextPolicy, ctx_size: int = 2048, n_predict: int = 1024) -> None:
+        """
+        Initialize a ContextBuilder.
+
+        Args:
+            policy (ContextPolicy): The policy choosing the messages.
+            ctx_size (int, optional): The context window size of the model in tokens. Defaults to 2048.
+            n_predict (int, optional): The default number of tokens reserved for the generation. Defaults to 1024.
+        """
+        self.policy = policy
+        self.ctx_size = ctx_size
+        self.n_predict = n_predict
+        # Number of messages left out of the last built context
+        self.last_dropped = 0
+
+    @staticmethod
+    def from_config(config, policy: str = "last_n") -> "ContextBuilder":
+        """
+        Builds a ContextBuilder out of a binding configuration (ctx_size, n_predict and nb_messages_to_remember).
+
+        Args:
+            config (BindingConfig or dict): The binding configuration.
+            policy (str, optional): The policy name (see get_context_policy). Defaults to "last_n".
+
+        Returns:
+            ContextBuilder: The builder.
+        """
+        return ContextBuilder(
+                    get_context_policy(policy, config["nb_messages_to_remember"]),
+                    config["ctx_size"],
+                    config["n_predict"]
+                )
+
+    def budget(self, discussion: Discussion, suffix: str = "", n_predict: int = None) -> int:
+        """
+        Returns the number of tokens available for the messages: the context size minus the generated tokens (at most
+        half of the context), the conditioning and the suffix.
+        """
+        n_predict = self.n_predict if n_predict is None else n_predict
+        if discussion.has_tokens:
+            fixed = len(discussion.conditioning_tokens) + (len(discussion.suffix_tokens(suffix)) if suffix else 0)
+        else:
+            fixed = (len(discussion.conditioning) + len(suffix)) // CHARS_PER_TOKEN + 1
+        return self.ctx_size - min(n_predict, self.ctx_size // 2) - fixed
+
+    def build(self, discussion: Discussion, suffix: str = "", n_predict: int = None) -> List[Message]:
+        """
+        Selects the messages of the next prompt. The last message (the one being answered) and the memory of the
+        compacted messages are always kept.
+
+        Args:
+            discussion (Discussion): The discussion.
+            suffix (str, optional): The text appended after the messages (for example the ai message prefix).
+            n_predict (int, optional): The number of tokens that will be generated. Defaults to the builder n_predict.
+
+        Returns:
+            List[Message]: The messages to put in the prompt, oldest first.
+        """
+        messages = discussion.messages
+        if len(messages) == 0:
+            self.last_dropped = 0
+            return []
+        budget = self.budget(discussion, suffix, n_predict)
+        last = messages[-1]
+        last_count = message_tokens(last)
+        if last_count > budget:
+            print(f"Warning: the last message ({last_count} tokens) does not fit in the context ({budget} tokens available)")
+        budget -= last_count
+        others = messages[:-1]
+        memory = [message for message in others if message.sender == MEMORY_SENDER]
+        if len(memory) == 0:
+            selected = self.policy.select(others, budget) + [last]
+        else:
+            budget -= sum(message_tokens(message) for message in memory)
+            kept = set(map(id, memory))
+            kept.update(map(id, self.policy.select([message for message in others if message.sender != MEMORY_SENDER], budget)))
+            selected = [message for message in others if id(message) in kept] + [last]
+        self.last_dropped = len(messages) - len(selected)
+        return selected
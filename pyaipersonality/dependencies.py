@@ -0,0 +1,267 @@
+######
+# Project       : PyAIPersonality
+# File          : dependencies.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# Batched dependencies installation for personalities and bindings.
+# The resolver gathers the requirements of everything that is about to be
+# loaded, checks them against the installed distributions and installs the
+# missing ones in a single pip invocation, optionally from a local wheelhouse
+# for hosts without internet access.
+######
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+from importlib import metadata
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from pyaipersonality.install_ledger import environment_fingerprint
+from pyaipersonality.paths import get_cache_dir
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+_name_pattern = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)")
+_egg_pattern = re.compile(r"#egg=([A-Za-z0-9][A-Za-z0-9._-]*)")
+
+
+def requirement_name(requirement: str) -> Optional[str]:
+    """
+    Extracts the distribution name of a requirement line.
+
+    Args:
+        requirement (str): A requirement as found in a requirements file (e.g. "numpy>=1.20" or "-e git+https://...#egg=clip").
+
+    Returns:
+        str: The distribution name or None if it can't be inferred.
+    """
+    match = _egg_pattern.search(requirement)
+    if match:
+        return match.group(1)
+    if requirement.startswith("-") or "://" in requirement:
+        return None
+    match = _name_pattern.match(requirement)
+    return match.group(1) if match else None
+
+
+def is_requirement_satisfied(requirement: str) -> bool:
+    """
+    Checks if a requirement is satisfied by the installed distributions.
+    Version specifiers and environment markers are checked when the packaging module is available,
+    otherwise only the presence of the distribution is checked.
+
+    Args:
+        requirement (str): The requirement line.
+
+    Returns:
+        bool: True if the requirement is satisfied.
+    """
+    name = requirement_name(requirement)
+    if name is None:
+        return False
+    try:
+        version = metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return False
+    try:
+        from packaging.requirements import Requirement, InvalidRequirement
+    except ImportError:
+        return True
+    try:
+        req = Requirement(requirement)
+    except InvalidRequirement:
+        return True
+    if req.marker is not None and not req.marker.evaluate():
+        return True
+    return req.specifier.contains(version, prereleases=True)
+
+
+def read_requirements_file(file_path: str | Path) -> List[str]:
+    """
+    Reads the requirements of a requirements file, ignoring comments and empty lines.
+    """
+    requirements = []
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.split(" #")[0].strip()
+            if line and not line.startswith("#"):
+                requirements.append(line)
+    return requirements
+
+
+class DependencyResolver:
+    """
+    Gathers the requirements of several personalities and bindings and installs the missing ones at once.
+
+    Usage:
+    ```
+    resolver = DependencyResolver(wheelhouse="wheels")
+    resolver.add_binding("bindings_zoo/llama_cpp_official")
+    for path in personalities_paths:
+        resolver.add_personality(path)
+    resolver.install()
+    ```
+    """
+    def __init__(self, wheelhouse: str | Path = None, cache_path: str | Path = None, pip_args: List[str] = None) -> None:
+        """
+        Initialize a DependencyResolver.
+
+        Args:
+            wheelhouse (str or Path, optional): A local folder of wheels. If set, pip installs from this folder only (no index access).
+                Defaults to the PYAIPERSONALITY_WHEELHOUSE environment variable if set.
+            cache_path (str or Path, optional): The json file where resolution results are cached. Defaults to a file in the pyaipersonality cache folder.
+            pip_args (List[str], optional): Extra arguments passed to pip install.
+        """
+        if wheelhouse is None:
+            wheelhouse = os.environ.get("PYAIPERSONALITY_WHEELHOUSE")
+        self.wheelhouse = Path(wheelhouse) if wheelhouse else None
+        if cache_path is None:
+            cache_path = get_cache_dir() / "resolutions.json"
+        self.cache_path = Path(cache_path)
+        self.pip_args = pip_args if pip_args is not None else []
+        # requirement -> list of the sources that need it
+        self.requirements: Dict[str, List[str]] = {}
+
+    def add_requirements(self, requirements: List[str], source: str = ""):
+        """
+        Adds requirements to resolve.
+
+        Args:
+            requirements (List[str]): The requirements lines.
+            source (str, optional): What needs these requirements (used for reporting).
+        """
+        for requirement in requirements:
+            requirement = requirement.strip()
+            if requirement:
+                self.requirements.setdefault(requirement, []).append(source)
+
+    def add_requirements_file(self, file_path: str | Path, source: str = None):
+        """
+        Adds the requirements of a requirements file if it exists.
+        """
+        file_path = Path(file_path)
+        if file_path.is_file():
+            self.add_requirements(read_requirements_file(file_path), source or str(file_path.parent))
+
+    def add_personality(self, package_path: str | Path):
+        """
+        Adds the dependencies of a personality package (its config dependencies and its requirements.txt).
+        """
+        package_path = Path(package_path)
+        config_file = package_path / "config.yaml"
+        if config_file.is_file():
+            from pyaipersonality.config_cache import load_yaml
+            config = load_yaml(config_file) or {}
+            self.add_requirements(config.get("dependencies", []), str(package_path))
+        self.add_requirements_file(package_path / "requirements.txt", str(package_path))
+
+    def add_binding(self, binding_path: str | Path):
+        """
+        Adds the requirements of a binding (its requirements.txt).
+        """
+        binding_path = Path(binding_path)
+        self.add_requirements_file(binding_path / "requirements.txt", str(binding_path))
+
+    def _resolution_key(self) -> str:
+        h = hashlib.sha1()
+        for requirement in sorted(self.requirements.keys()):
+            h.update(requirement.encode())
+            h.update(b"\n")
+        h.update(environment_fingerprint().encode())
+        return h.hexdigest()
+
+    def _read_cache(self) -> dict:
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self, cache: dict):
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(cache, f, indent=1)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as ex:
+            print(f"Couldn't save the dependencies resolution cache: {ex}")
+
+    def missing(self) -> List[str]:
+        """
+        Lists the requirements that are not satisfied by the current environment.
+        If the same set of requirements was already fully satisfied in the same environment, the check is skipped.
+
+        Returns:
+            List[str]: The missing requirements.
+        """
+        if len(self.requirements) == 0:
+            return []
+        if self._read_cache().get(self._resolution_key()) == "satisfied":
+            return []
+        return [requirement for requirement in self.requirements if not is_requirement_satisfied(requirement)]
+
+    def pip_command(self, requirements: List[str], download_dir: str | Path = None) -> List[str]:
+        """
+        Builds the pip command installing (or downloading) the given requirements.
+        """
+        if download_dir is not None:
+            command = [sys.executable, "-m", "pip", "download", "-d", str(download_dir)]
+        else:
+            command = [sys.executable, "-m", "pip", "install"]
+            if self.wheelhouse is not None:
+                command += ["--no-index", "--find-links", str(self.wheelhouse)]
+        command += self.pip_args
+        for requirement in requirements:
+            # Options like "-e git+https://..." must be passed as two arguments
+            command += requirement.split(None, 1) if requirement.startswith("-") else [requirement]
+        return command
+
+    def install(self, dry_run: bool = False) -> List[str]:
+        """
+        Installs all missing requirements in a single pip invocation.
+
+        Args:
+            dry_run (bool, optional): If True, only prints the command. Defaults to False.
+
+        Returns:
+            List[str]: The requirements that were installed.
+
+        Raises:
+            subprocess.CalledProcessError: If pip fails.
+        """
+        missing = self.missing()
+        if len(missing) > 0:
+            command = self.pip_command(missing)
+            print(f"Installing {len(missing)} missing requirements: {' '.join(missing)}")
+            if dry_run:
+                print(" ".join(command))
+                return missing
+            subprocess.check_call(command)
+
+        cache = self._read_cache()
+        # Keep only the latest resolutions to bound the cache size
+        cache = dict(list(cache.items())[-63:])
+        cache[self._resolution_key()] = "satisfied"
+        self._write_cache(cache)
+        return missing
+
+    def download(self, wheelhouse: str | Path = None):
+        """
+        Downloads all requirements to a wheelhouse folder, to prepare an installation on a host without internet access.
+
+        Args:
+            wheelhouse (str or Path, optional): The destination folder. Defaults to the resolver wheelhouse.
+        """
+        wheelhouse = Path(wheelhouse) if wheelhouse is not None else self.wheelhouse
+        if wheelhouse is None:
+            raise ValueError("No wheelhouse folder provided.")
+        wheelhouse.mkdir(parents=True, exist_ok=True)
+        subprocess.check_call(self.pip_command(list(self.requirements.keys()), download_dir=wheelhouse))
@@ -0,0 +1,268 @@
+######
+# Project       : PyAIPersonality
+# File          : discussion.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# Incremental discussion representation.
+# A discussion keeps its messages with their token ids, stored in compact
+# integer arrays. Each message is tokenized once when it is added, so the prompt
+# of a new turn is handed to the binding as token ids without tokenizing the
+# whole history again.
+######
+import copy
+from array import array
+from typing import Callable, List, Optional
+
+from pyaipersonality.binding import LLMBinding
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+# Type code of the token arrays (signed 32 bits integers)
+TOKEN_TYPECODE = "i"
+
+# Sender of the messages summarizing older messages of the discussion
+MEMORY_SENDER = "memory"
+
+
+class Message:
+    """
+    A message of a discussion with its cached token ids.
+    """
+    __slots__ = ("sender", "text", "tokens", "pinned")
+
+    def __init__(self, sender: str, text: str, tokens: Optional[array] = None, pinned: bool = False) -> None:
+        """
+        Initialize a Message.
+
+        Args:
+            sender (str): Who sent the message ("user", "ai" or any other label).
+            text (str): The message text, including its prefixes.
+            tokens (array, optional): The token ids of the text, None if the binding can't tokenize.
+            pinned (bool, optional): Pinned messages are kept in the context as long as possible. Defaults to False.
+        """
+        self.sender = sender
+        self.text = text
+        self.tokens = tokens
+        self.pinned = pinned
+
+    @property
+    def token_count(self) -> int:
+        """Get the number of tokens of the message (0 if it is not tokenized)."""
+        return len(self.tokens) if self.tokens is not None else 0
+
+    def __repr__(self):
+        return f"Message({self.sender}, {self.token_count} tokens)"
+
+
+class Discussion:
+    """
+    A discussion made of a conditioning text and a list of messages, with their token ids.
+
+    Usage:
+    ```
+    discussion = Discussion(model, personality.personality_conditioning)
+    discussion.add_message("user", personality.user_message_prefix + prompt + personality.link_text)
+    answer = discussion.generate(n_predict=128, suffix=personality.ai_message_prefix)
+    discussion.add_message("ai", personality.ai_message_prefix + answer)
+    ```
+    """
+    def __init__(self, model: LLMBinding = None, conditioning: str = "") -> None:
+        """
+        Initialize a Discussion.
+
+        Args:
+            model (LLMBinding, optional): The binding used to tokenize and generate. Without a model (or if the binding
+                can't generate from integer token ids), only the text of the discussion is kept.
+            conditioning (str, optional): The text placed before the messages.
+        """
+        self.model = model
+        self.messages: List[Message] = []
+        self.conditioning = ""
+        self.conditioning_tokens: Optional[array] = None
+        # Short texts that are appended to prompts (like the ai message prefix) and their tokens
+        self._suffix_tokens = {}
+        self.has_tokens = model is not None and getattr(model, "supports_tokens", False)
+        # Discussions are trees: a branch shares the messages of its parent up to its fork point
+        self.parent: Optional["Discussion"] = None
+        self.fork_point = 0
+        self.branches: List["Discussion"] = []
+        self.set_conditioning(conditioning)
+
+    def _tokenize(self, text: str, first: bool = False) -> Optional[array]:
+        """
+        Tokenizes a text. The beginning of sequence token is only added to the first text of the discussion.
+        """
+        if not self.has_tokens:
+            return None
+        tokens = self.model.tokenize(text) if first else self.model.tokenize_continuation(text)
+        try:
+            # array only accepts integers, token strings raise a TypeError
+            return array(TOKEN_TYPECODE, tokens)
+        except TypeError:
+            # The binding can't give token ids, fall back to text prompts
+            self.has_tokens = False
+            return None
+
+    def set_conditioning(self, conditioning: str) -> bool:
+        """
+        Sets the conditioning text (it is only tokenized again if it changed).
+
+        Args:
+            conditioning (str): The conditioning text.
+
+        Returns:
+            bool: True if the conditioning changed.
+        """
+        if conditioning == self.conditioning and (self.conditioning_tokens is not None or not self.has_tokens):
+            return False
+        self.conditioning = conditioning
+        self.conditioning_tokens = self._tokenize(conditioning, first=True)
+        return True
+
+    def add_message(self, sender: str, text: str, pinned: bool = False) -> Message:
+        """
+        Appends a message to the discussion. Only this message is tokenized.
+
+        Args:
+            sender (str): Who sent the message.
+            text (str): The message text, including its prefixes.
+            pinned (bool, optional): Keep the message in the context as long as possible. Defaults to False.
+
+        Returns:
+            Message: The new message.
+        """
+        message = Message(sender, text, self._tokenize(text), pinned)
+        self.messages.append(message)
+        return message
+
+    def replace_messages(self, messages: List[Message], sender: str, text: str, pinned: bool = False) -> Optional[Message]:
+        """
+        Replaces consecutive messages by a single message (for example old messages by their summary).
+
+        Args:
+            messages (List[Message]): The consecutive messages to replace.
+            sender (str): The sender of the new message.
+            text (str): The text of the new message.
+            pinned (bool, optional): Pin the new message. Defaults to False.
+
+        Returns:
+            Message: The new message, or None if the messages are not consecutive messages of the discussion anymore.
+        """
+        start = next((i for i, message in enumerate(self.messages) if message is messages[0]), None)
+        if start is None or len(self.messages) < start + len(messages):
+            return None
+        if any(a is not b for a, b in zip(self.messages[start:start + len(messages)], messages)):
+            return None
+        message = Message(sender, text, self._tokenize(text), pinned)
+        self.messages[start:start + len(messages)] = [message]
+        return message
+
+    def suffix_tokens(self, suffix: str) -> Optional[array]:
+        """
+        Returns the tokens of a text appended to prompts (they are cached for the few distinct suffixes in use).
+        """
+        tokens = self._suffix_tokens.get(suffix)
+        if tokens is None:
+            tokens = self._tokenize(suffix)
+            if len(self._suffix_tokens) < 16:
+                self._suffix_tokens[suffix] = tokens
+        return tokens
+
+    def text(self, suffix: str = "", messages: List[Message] = None) -> str:
+        """
+        Builds the full text of the discussion.
+
+        Args:
+            suffix (str, optional): A text appended after the messages (for example the ai message prefix).
+            messages (List[Message], optional): The messages to use. Defaults to all the messages.
+
+        Returns:
+            str: The text.
+        """
+        messages = self.messages if messages is None else messages
+        return self.conditioning + "".join([message.text for message in messages]) + suffix
+
+    def tokens(self, suffix: str = "", messages: List[Message] = None) -> Optional[array]:
+        """
+        Builds the token ids of the discussion out of the cached tokens of its parts.
+
+        Args:
+            suffix (str, optional): A text appended after the messages (for example the ai message prefix).
+            messages (List[Message], optional): The messages to use. Defaults to all the messages.
+
+        Returns:
+            array: The token ids or None if the binding can't tokenize.
+        """
+        if not self.has_tokens:
+            return None
+        messages = self.messages if messages is None else messages
+        tokens = array(TOKEN_TYPECODE, self.conditioning_tokens)
+        for message in messages:
+            tokens.extend(message.tokens)
+        if suffix:
+            tokens.extend(self.suffix_tokens(suffix))
+        return tokens
+
+    @property
+    def token_count(self) -> int:
+        """Get the number of tokens of the conditioning and of all messages."""
+        if not self.has_tokens:
+            return 0
+        return len(self.conditioning_tokens) + sum(message.token_count for message in self.messages)
+
+    def generate(self, n_predict: int = 128, callback: Callable = None, suffix: str = "", messages: List[Message] = None, **gpt_params) -> str:
+        """
+        Generates the next message of the discussion.
+        The binding receives the cached token ids if it can tokenize, the text otherwise.
+
+        Args:
+            n_predict (int, optional): Number of tokens to predict. Defaults to 128.
+            callback (Callable, optional): Called with every generated text chunk.
+            suffix (str, optional): A text appended to the prompt (for example the ai message prefix).
+            messages (List[Message], optional): The messages to put in the prompt. Defaults to all the messages.
+            **gpt_params: Generation parameters passed to the binding.
+
+        Returns:
+            str: The generated text.
+        """
+        if self.has_tokens:
+            # The conditioning is kept if the binding has to shift a full context
+            gpt_params.setdefault("n_keep", len(self.conditioning_tokens))
+            return self.model.generate_from_tokens(self.tokens(suffix, messages), n_predict, callback=callback, **gpt_params)
+        return self.model.generate(self.text(suffix, messages), n_predict, callback=callback, **gpt_params)
+
+    def fork(self, index: int = None) -> "Discussion":
+        """
+        Creates a branch of the discussion (to regenerate an answer or edit a message).
+        The branch shares the first messages of the discussion with their texts and tokens, nothing is copied or
+        tokenized again. Messages added to (or replaced in) one of them are not seen by the other.
+
+        Args:
+            index (int, optional): The number of messages kept in the branch. Defaults to all the messages.
+
+        Returns:
+            Discussion: The branch.
+        """
+        index = len(self.messages) if index is None else index
+        if index < 0 or index > len(self.messages):
+            raise ValueError(f"Can't fork a discussion of {len(self.messages)} messages at {index}")
+        branch = copy.copy(self)
+        branch.messages = self.messages[:index]
+        branch.parent = self
+        branch.fork_point = index
+        branch.branches = []
+        self.branches.append(branch)
+        return branch
+
+    def clear(self):
+        """
+        Removes all the messages (the conditioning is kept).
+        """
+        self.messages = []
+
+    def __len__(self):
+        return len(self.messages)
@@ -0,0 +1,202 @@
+######
+# Project       : PyAIPersonality
+# File          : install_ledger.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# A persistent record of the install steps that already ran.
+# Personalities and bindings run their install.py script and check their
+# dependencies every time they are built. The ledger stores a stamp made of the
+# hash of the install script, of the dependencies list and of the python
+# environment, so that these steps are skipped when nothing changed. An entry
+# can also list the artifacts created by the install step (cloned repositories,
+# downloaded weights), and the step runs again if one of them goes missing.
+######
+import hashlib
+import json
+import os
+import platform
+import sys
+import sysconfig
+import threading
+from pathlib import Path
+from typing import Iterable
+
+from pyaipersonality.paths import get_cache_dir
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+def environment_fingerprint() -> str:
+    """
+    Builds a fingerprint of the current python environment.
+
+    The fingerprint changes when the interpreter changes or when packages are installed or removed
+    from the site-packages folders.
+
+    Returns:
+        str: The fingerprint as an hex digest.
+    """
+    h = hashlib.sha1()
+    h.update(sys.executable.encode())
+    h.update(sys.version.encode())
+    h.update(platform.platform().encode())
+    for name in ("purelib", "platlib"):
+        site_packages = sysconfig.get_paths().get(name)
+        if site_packages is None:
+            continue
+        try:
+            h.update(f"{site_packages}:{os.stat(site_packages).st_mtime_ns}".encode())
+        except OSError:
+            h.update(site_packages.encode())
+    return h.hexdigest()
+
+
+class InstallLedger:
+    """
+    Records the install steps that completed successfully.
+
+    Usage:
+    ```
+    ledger = InstallLedger()
+    ledger.run_once(package_path, [package_path / "scripts" / "install.py"], dependencies, install_fn, artifacts=[package_path / "sd"])
+    ```
+    """
+    def __init__(self, ledger_path: str | Path = None) -> None:
+        """
+        Initialize an InstallLedger.
+
+        Args:
+            ledger_path (str or Path, optional): The json file where the ledger is stored. Defaults to a file in the pyaipersonality cache folder.
+        """
+        if ledger_path is None:
+            ledger_path = get_cache_dir() / "install_ledger.json"
+        self.ledger_path = Path(ledger_path)
+        self.entries = {}
+        self._lock = threading.Lock()
+        try:
+            with open(self.ledger_path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    @staticmethod
+    def stamp(files: Iterable[str | Path] = (), dependencies: Iterable[str] = ()) -> str:
+        """
+        Builds the stamp of an install step.
+
+        Args:
+            files (Iterable[str or Path]): The files driving the install step (install script, requirements file). Missing files are ignored.
+            dependencies (Iterable[str]): The list of dependencies to install.
+
+        Returns:
+            str: The stamp as an hex digest.
+        """
+        h = hashlib.sha1()
+        for file in files:
+            file = Path(file)
+            if file.is_file():
+                h.update(file.name.encode())
+                h.update(file.read_bytes())
+        for dependency in sorted(dependencies):
+            h.update(dependency.encode())
+        h.update(environment_fingerprint().encode())
+        return h.hexdigest()
+
+    @staticmethod
+    def _key(key: str | Path) -> str:
+        return str(Path(key).resolve())
+
+    def is_installed(self, key: str | Path, stamp: str) -> bool:
+        """
+        Checks if an install step already ran with the same stamp and if the artifacts it created still exist.
+
+        Args:
+            key (str or Path): The path of the personality or binding.
+            stamp (str): The current stamp of its install step.
+
+        Returns:
+            bool: True if the install step can be skipped.
+        """
+        entry = self.entries.get(self._key(key))
+        if isinstance(entry, str):
+            # Entry recorded without artifacts
+            return entry == stamp
+        if entry is None or entry.get("stamp") != stamp:
+            return False
+        return all(os.path.exists(artifact) for artifact in entry.get("artifacts", []))
+
+    def record(self, key: str | Path, stamp: str, artifacts: Iterable[str | Path] = ()):
+        """
+        Records that an install step completed.
+        The stamp should be computed after the install so that it takes into account the packages that were just installed.
+
+        Args:
+            key (str or Path): The path of the personality or binding.
+            stamp (str): The stamp of its install step.
+            artifacts (Iterable[str or Path], optional): The files or folders created by the install step. Relative
+                paths are resolved from the current folder.
+        """
+        with self._lock:
+            self.entries[self._key(key)] = {"stamp": stamp, "artifacts": [self._key(artifact) for artifact in artifacts]}
+            self._save()
+
+    def run_once(self, key: str | Path, files: Iterable[str | Path], dependencies: Iterable[str], install_fn, artifacts: Iterable[str | Path] = ()) -> bool:
+        """
+        Runs an install step unless it already ran with the same stamp and its artifacts still exist.
+
+        Args:
+            key (str or Path): The path of the personality or binding.
+            files (Iterable[str or Path]): The files driving the install step.
+            dependencies (Iterable[str]): The list of dependencies to install.
+            install_fn (Callable[[], Iterable]): The function running the install step. If it raises, nothing is
+                recorded. It can return the paths of the artifacts it created.
+            artifacts (Iterable[str or Path], optional): The files or folders the install step must create.
+
+        Returns:
+            bool: True if the install step ran, False if it was skipped.
+        """
+        files = list(files)
+        dependencies = list(dependencies)
+        if self.is_installed(key, self.stamp(files, dependencies)):
+            return False
+        created = install_fn()
+        self.record(key, self.stamp(files, dependencies), list(artifacts) + list(created or []))
+        return True
+
+    def forget(self, key: str | Path):
+        """
+        Removes an entry so that the install step runs again next time.
+
+        Args:
+            key (str or Path): The path of the personality or binding.
+        """
+        with self._lock:
+            if self.entries.pop(self._key(key), None) is not None:
+                self._save()
+
+    def _save(self):
+        try:
+            self.ledger_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.ledger_path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=1)
+            os.replace(tmp_path, self.ledger_path)
+        except OSError as ex:
+            print(f"Couldn't save the install ledger: {ex}")
+
+
+_default_ledger = None
+
+
+def get_install_ledger() -> InstallLedger:
+    """
+    Returns the process wide install ledger.
+    """
+    global _default_ledger
+    if _default_ledger is None:
+        _default_ledger = InstallLedger()
+    return _default_ledger
@@ -0,0 +1,38 @@
+######
+# Project       : PyAIPersonality
+# File          : paths.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# Common locations used by pyaipersonality to store its caches.
+######
+import os
+from pathlib import Path
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+def get_cache_dir(*parts) -> Path:
+    """
+    Returns the pyaipersonality cache folder (or a sub folder of it) and creates it if needed.
+
+    The root folder can be changed using the PYAIPERSONALITY_CACHE_DIR environment variable.
+    It defaults to ~/.cache/pyaipersonality
+
+    Args:
+        *parts (str): Optional sub folders to append to the cache root.
+
+    Returns:
+        Path: The cache folder path.
+    """
+    root = os.environ.get("PYAIPERSONALITY_CACHE_DIR")
+    if root:
+        cache_dir = Path(root)
+    else:
+        cache_dir = Path.home() / ".cache" / "pyaipersonality"
+    cache_dir = cache_dir.joinpath(*parts)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
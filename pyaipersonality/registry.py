@@ -0,0 +1,340 @@
+######
+# Project       : PyAIPersonality
+# File          : registry.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# A registry of mounted personalities with a memory budget.
+# Personalities configurations are always kept, but their processors (which can
+# hold multi gigabyte models) are evicted in least recently used order when the
+# budget is exceeded. An evicted processor is rebuilt transparently the next
+# time the personality is used.
+######
+import gc
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Callable, List
+
+from pyaipersonality import AIPersonality
+from pyaipersonality.resources import ResourceRegistry, current_rss, get_resource_registry, measure_lock
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+class PersonalityRegistry:
+    """
+    A dictionary of personalities (name -> AIPersonality) with a memory budget for their processors.
+
+    Usage:
+    ```
+    registry = PersonalityRegistry(memory_budget_mb=8000)
+    registry.add(AIPersonality("personalities_zoo/english/art/artbot", lazy=True))
+    with registry.use("Artbot") as personality:
+        personality.processor.run_workflow(prompt)
+    print(registry.status())
+    ```
+    """
+    def __init__(self, memory_budget_mb: float = None, resources: ResourceRegistry = None) -> None:
+        """
+        Initialize a PersonalityRegistry.
+
+        Args:
+            memory_budget_mb (float, optional): The memory allowed for materialized personalities and their shared
+                resources in megabytes. None means no limit.
+            resources (ResourceRegistry, optional): The registry of the resources shared by the processors, whose memory
+                is part of the budget. Defaults to the process wide registry.
+        """
+        self.memory_budget_mb = memory_budget_mb
+        self.resources = resources if resources is not None else get_resource_registry()
+        self._personalities = OrderedDict()
+        # name -> estimated memory of the materialized personality in bytes, in least recently used order
+        self._resident = OrderedDict()
+        # name -> number of users currently using the personality
+        self._in_use = {}
+        self._load_locks = {}
+        # names of the personalities waiting to be preloaded
+        self._warming = set()
+        # name -> duration of the last materialization in seconds
+        self.load_times = {}
+        # name -> error message of the last failed preload
+        self.load_errors = {}
+        self.evictions = 0
+        self.loads = 0
+        # Optional UsageTracker recording every use (see pyaipersonality.usage)
+        self.usage = None
+        # Time of the last use (time.time())
+        self.last_use = 0.0
+        self._lock = threading.RLock()
+
+    # ======================================== Dictionary access ========================================
+    def __getitem__(self, name) -> AIPersonality:
+        return self._personalities[name]
+
+    def __setitem__(self, name, personality: AIPersonality):
+        self.add(personality, name)
+
+    def __contains__(self, name):
+        return name in self._personalities
+
+    def __len__(self):
+        return len(self._personalities)
+
+    def __iter__(self):
+        return iter(self._personalities)
+
+    def keys(self):
+        return self._personalities.keys()
+
+    def values(self):
+        return self._personalities.values()
+
+    def items(self):
+        return self._personalities.items()
+
+    def get(self, name, default=None):
+        return self._personalities.get(name, default)
+
+    # ======================================== Residency management ========================================
+    def add(self, personality: AIPersonality, name: str = None, materialize: bool = False):
+        """
+        Adds a personality to the registry.
+
+        Args:
+            personality (AIPersonality): The personality to add.
+            name (str, optional): The name to register the personality with. Defaults to the personality name.
+            materialize (bool, optional): If True, the personality processor is materialized right away (within the budget).
+        """
+        if name is None:
+            name = personality.name
+        with self._lock:
+            old = self._personalities.get(name)
+            if old is not None and old is not personality:
+                self._unload(name)
+            self._personalities[name] = personality
+            if personality.is_materialized and name not in self._resident:
+                # Already materialized outside the registry, we can't measure it
+                self._resident[name] = self._declared_footprint(personality)
+        if materialize:
+            self.materialize(name)
+
+    def remove(self, name: str):
+        """
+        Removes a personality from the registry and releases its processor.
+        """
+        with self._lock:
+            if name in self._personalities:
+                self._unload(name)
+                del self._personalities[name]
+
+    @staticmethod
+    def _declared_footprint(personality: AIPersonality) -> int:
+        """
+        Returns the memory footprint declared by a personality in its processor_cfg (memory_footprint_mb), or 0.
+        """
+        processor_cfg = personality.processor_cfg if personality.processor_cfg is not None else {}
+        return int(float(processor_cfg.get("memory_footprint_mb", 0)) * 1024 * 1024)
+
+    def materialize(self, name: str) -> AIPersonality:
+        """
+        Makes sure a personality processor is materialized and marks the personality as most recently used.
+        Least recently used personalities are evicted if the budget is exceeded.
+
+        Args:
+            name (str): The personality name.
+
+        Returns:
+            AIPersonality: The personality.
+        """
+        with self._lock:
+            personality = self._personalities[name]
+            if name in self._resident:
+                self._resident.move_to_end(name)
+                return personality
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+            declared = self._declared_footprint(personality)
+            if declared > 0:
+                self._make_room(declared, keep=name)
+
+        # Different personalities can be materialized concurrently, but the ones that don't declare their footprint
+        # are measured from the resident memory delta, which needs them to load alone
+        with load_lock, (measure_lock if declared == 0 else nullcontext()):
+            with self._lock:
+                if name in self._resident:
+                    self._resident.move_to_end(name)
+                    return personality
+            rss_before = current_rss()
+            shared_before = self.resources.memory()
+            start = time.perf_counter()
+            # Accessing the processor materializes the install step and the processor
+            personality.processor
+            self.load_times[name] = time.perf_counter() - start
+            if declared > 0:
+                footprint = declared
+            elif rss_before > 0:
+                # The shared resources built by the processor are charged to the resource registry
+                footprint = max(0, current_rss() - rss_before - (self.resources.memory() - shared_before))
+            else:
+                footprint = 0
+                print(f"Warning: couldn't measure the memory of personality {name} (install psutil or declare processor_cfg.memory_footprint_mb), it is not counted in the memory budget")
+
+        with self._lock:
+            self._resident[name] = footprint
+            self.loads += 1
+            self._make_room(0, keep=name)
+        return personality
+
+    def preload(self, names: List[str] = None, max_workers: int = 4, callback: Callable[[str, float, Exception], None] = None) -> ThreadPoolExecutor:
+        """
+        Materializes personalities concurrently in background threads.
+
+        The personalities stay usable while they are warming up: using one that is not ready yet simply waits for its materialization.
+        Processors live in the server process so a thread pool is used (most of the load time is spent in I/O and native code).
+
+        Args:
+            names (List[str], optional): The personalities to preload. Defaults to all registered personalities that are not materialized.
+            max_workers (int, optional): The number of concurrent loads. Defaults to 4.
+            callback (Callable[[str, float, Exception], None], optional): Called with the name, the load duration and the error (or None)
+                when a personality is ready.
+
+        Returns:
+            ThreadPoolExecutor: The executor running the preload (already shut down, use shutdown(wait=True) to wait for the end of the preload).
+        """
+        with self._lock:
+            if names is None:
+                names = [name for name in self._personalities if name not in self._resident]
+            names = [name for name in names if name not in self._warming]
+            self._warming.update(names)
+
+        def load(name):
+            error = None
+            try:
+                self.materialize(name)
+                self.load_errors.pop(name, None)
+            except Exception as ex:
+                error = ex
+                self.load_errors[name] = str(ex)
+            finally:
+                with self._lock:
+                    self._warming.discard(name)
+            duration = self.load_times.get(name, 0)
+            if error is None:
+                print(f"Personality {name} ready in {duration:.2f}s")
+            else:
+                print(f"Couldn't preload personality {name}: {error}")
+            if callback is not None:
+                callback(name, duration, error)
+
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="personality_preload")
+        for name in names:
+            executor.submit(load, name)
+        executor.shutdown(wait=False)
+        return executor
+
+    def is_ready(self, name: str) -> bool:
+        """
+        Tells if a personality is materialized and can be used without waiting.
+        """
+        return name in self._resident
+
+    @contextmanager
+    def use(self, name: str):
+        """
+        Context manager giving access to a materialized personality.
+        A personality in use is never evicted.
+
+        Args:
+            name (str): The personality name.
+        """
+        with self._lock:
+            self._in_use[name] = self._in_use.get(name, 0) + 1
+            hit = name in self._resident
+            self.last_use = time.time()
+        try:
+            personality = self.materialize(name)
+            if self.usage is not None:
+                self.usage.record(name, hit, personality.personality_package_path, self._resident.get(name))
+            yield personality
+        finally:
+            with self._lock:
+                self._in_use[name] -= 1
+                if self._in_use[name] == 0:
+                    del self._in_use[name]
+
+    def resident_memory(self) -> int:
+        """
+        Returns the estimated memory of all materialized personalities in bytes.
+        """
+        return sum(self._resident.values())
+
+    def used_memory(self) -> int:
+        """
+        Returns the memory counted in the budget: the materialized personalities and the shared resources, in bytes.
+        """
+        return self.resident_memory() + self.resources.memory()
+
+    def _make_room(self, needed: int, keep: str = None):
+        """
+        Evicts least recently used personalities until the needed memory fits in the budget.
+        """
+        if self.memory_budget_mb is None:
+            return
+        budget = self.memory_budget_mb * 1024 * 1024
+        for name in list(self._resident.keys()):
+            if self.used_memory() + needed <= budget:
+                break
+            # Evicting personalities without measurable footprint would not free anything
+            if name == keep or name in self._in_use or self._resident[name] == 0:
+                continue
+            self._unload(name)
+            self.evictions += 1
+
+    def _unload(self, name: str):
+        """
+        Releases the materialized parts of a personality.
+        """
+        personality = self._personalities[name]
+        self._resident.pop(name, None)
+        personality.unload()
+        gc.collect()
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def evict(self, name: str):
+        """
+        Evicts a personality processor (it is rebuilt on next use).
+        """
+        with self._lock:
+            if name in self._resident and name not in self._in_use:
+                self._unload(name)
+                self.evictions += 1
+
+    def status(self) -> dict:
+        """
+        Returns the registry state.
+
+        Returns:
+            dict: The registered and resident personalities, the memory usage and the eviction counters.
+        """
+        with self._lock:
+            return {
+                "usage": self.usage.stats() if self.usage is not None else None,
+                "personalities": list(self._personalities.keys()),
+                "resident": {name: round(size / (1024 * 1024), 1) for name, size in self._resident.items()},
+                "in_use": list(self._in_use.keys()),
+                "warming": sorted(self._warming),
+                "load_times": {name: round(duration, 3) for name, duration in self.load_times.items()},
+                "load_errors": dict(self.load_errors),
+                "resident_memory_mb": round(self.resident_memory() / (1024 * 1024), 1),
+                "shared_memory_mb": round(self.resources.memory() / (1024 * 1024), 1),
+                "memory_budget_mb": self.memory_budget_mb,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
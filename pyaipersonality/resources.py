@@ -0,0 +1,245 @@
+######
+# Project       : PyAIPersonality
+# File          : resources.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# Shared heavyweight resources for processors.
+# Processors request resources (stable diffusion models, embedding models...)
+# by key instead of building them. The first request builds the resource, the
+# next ones get the same object, and the resource is freed when the last
+# processor using it is released (for example when its personality is evicted).
+######
+import gc
+import hashlib
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+# Size of the chunks hashed at the start and at the end of a file to fingerprint it
+_FINGERPRINT_CHUNK_SIZE = 1 << 20
+
+# Held while a build is measured from the resident memory delta, so that concurrent builds don't pollute the measure
+# (reentrant because measured personality loads build their shared resources)
+measure_lock = threading.RLock()
+
+
+def current_rss() -> int:
+    """
+    Returns the resident memory of the current process in bytes (0 if it can't be measured).
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return 0
+
+
+def file_fingerprint(file_path: str | Path) -> str:
+    """
+    Builds a cheap content fingerprint of a (potentially multi gigabyte) file out of its size and the hash of its
+    first and last megabytes. Two copies of the same weights file in different personalities get the same fingerprint.
+
+    Args:
+        file_path (str or Path): The file.
+
+    Returns:
+        str: The fingerprint or the absolute path if the file does not exist.
+    """
+    try:
+        size = os.path.getsize(file_path)
+        h = hashlib.sha1(str(size).encode())
+        with open(file_path, "rb") as f:
+            h.update(f.read(_FINGERPRINT_CHUNK_SIZE))
+            if size > 2 * _FINGERPRINT_CHUNK_SIZE:
+                f.seek(-_FINGERPRINT_CHUNK_SIZE, os.SEEK_END)
+                h.update(f.read(_FINGERPRINT_CHUNK_SIZE))
+        return h.hexdigest()
+    except OSError:
+        return os.path.abspath(file_path)
+
+
+def model_key(kind: str, model_path: str | Path, **options) -> tuple:
+    """
+    Builds the key of a resource made out of a weights file.
+
+    Args:
+        kind (str): The kind of resource (for example "stable_diffusion" or "llamacpp_embeddings").
+        model_path (str or Path): The weights file.
+        **options: The options the resource is built with (they are part of the key).
+
+    Returns:
+        tuple: The key.
+    """
+    return (kind, file_fingerprint(model_path)) + tuple(sorted((name, str(value)) for name, value in options.items()))
+
+
+class ResourceRegistry:
+    """
+    A reference counted registry of shared resources.
+
+    Usage:
+    ```
+    resources = get_resource_registry()
+    key = model_key("stable_diffusion", ckpt_path, device="cuda")
+    model = resources.acquire(key, lambda: load_model(ckpt_path), owner=self)
+    ...
+    resources.release_owner(self)
+    ```
+    """
+    def __init__(self) -> None:
+        """
+        Initialize a ResourceRegistry.
+        """
+        # key -> resource
+        self._resources: Dict[Hashable, Any] = {}
+        # key -> {id(owner): number of acquisitions}
+        self._owners: Dict[Hashable, Dict[int, int]] = {}
+        # key -> memory measured when the resource was built, in bytes
+        self._sizes: Dict[Hashable, int] = {}
+        self._lock = threading.RLock()
+        self.builds = 0
+        self.shares = 0
+        self.frees = 0
+
+    def acquire(self, key: Hashable, factory: Callable[[], Any], owner: Any = None) -> Any:
+        """
+        Gets a shared resource, building it if nobody holds it yet.
+
+        Args:
+            key (Hashable): The resource key (see model_key).
+            factory (Callable[[], Any]): Builds the resource. Only called if the resource does not exist.
+            owner (Any, optional): The object holding the reference (a processor). Defaults to an anonymous owner.
+
+        Returns:
+            The resource.
+        """
+        owner_id = id(owner)
+        # Builds run one at a time so that their memory can be measured, and the same resource is built once
+        with measure_lock:
+            with self._lock:
+                if key in self._resources:
+                    self.shares += 1
+                    owners = self._owners[key]
+                    owners[owner_id] = owners.get(owner_id, 0) + 1
+                    return self._resources[key]
+            rss_before = current_rss()
+            resource = factory()
+            size = max(0, current_rss() - rss_before) if rss_before > 0 else 0
+            with self._lock:
+                self._resources[key] = resource
+                self._owners[key] = {owner_id: 1}
+                self._sizes[key] = size
+                self.builds += 1
+            return resource
+
+    def release(self, key: Hashable, owner: Any = None):
+        """
+        Releases one reference to a resource. The resource is freed when its last reference is released.
+
+        Args:
+            key (Hashable): The resource key.
+            owner (Any, optional): The object that acquired the resource.
+        """
+        owner_id = id(owner)
+        with self._lock:
+            owners = self._owners.get(key)
+            if owners is None or owner_id not in owners:
+                return
+            owners[owner_id] -= 1
+            if owners[owner_id] == 0:
+                del owners[owner_id]
+            if len(owners) == 0:
+                self._free(key)
+
+    def release_owner(self, owner: Any):
+        """
+        Releases all the references held by an owner.
+
+        Args:
+            owner (Any): The object that acquired the resources.
+        """
+        owner_id = id(owner)
+        freed = False
+        with self._lock:
+            for key in list(self._owners.keys()):
+                owners = self._owners[key]
+                if owners.pop(owner_id, None) is not None and len(owners) == 0:
+                    self._free(key, collect=False)
+                    freed = True
+        if freed:
+            self._collect()
+
+    def _free(self, key: Hashable, collect: bool = True):
+        resource = self._resources.pop(key, None)
+        self._owners.pop(key, None)
+        self._sizes.pop(key, None)
+        self.frees += 1
+        close = getattr(resource, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception as ex:
+                print(f"Couldn't close resource {key}: {ex}")
+        del resource
+        if collect:
+            self._collect()
+
+    @staticmethod
+    def _collect():
+        gc.collect()
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def __contains__(self, key):
+        return key in self._resources
+
+    def ref_count(self, key: Hashable) -> int:
+        """
+        Returns the number of references held on a resource.
+        """
+        with self._lock:
+            return sum(self._owners.get(key, {}).values())
+
+    def memory(self) -> int:
+        """
+        Returns the measured memory of the held resources in bytes.
+        """
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def status(self) -> dict:
+        """
+        Returns the held resources with their reference counts, their memory and the build, share and free counters.
+        """
+        with self._lock:
+            return {
+                "resources": {str(key): sum(owners.values()) for key, owners in self._owners.items()},
+                "memory_mb": round(sum(self._sizes.values()) / (1024 * 1024), 1),
+                "builds": self.builds,
+                "shares": self.shares,
+                "frees": self.frees,
+            }
+
+
+_default_registry = ResourceRegistry()
+
+
+def get_resource_registry() -> ResourceRegistry:
+    """
+    Returns the process wide resource registry.
+    """
+    return _default_registry
@@ -0,0 +1,247 @@
+######
+# Project       : PyAIPersonality
+# File          : search.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# Full text search over a personalities zoo.
+# An inverted index of the catalog entries (name, category, description and
+# conditioning) ranked with BM25. The index is persisted next to the catalog
+# index and only the personalities whose configuration changed are indexed again.
+######
+import math
+import os
+import pickle
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+SEARCH_INDEX_FORMAT_VERSION = 1
+
+# Indexed catalog entry fields and their weight in the ranking
+FIELD_WEIGHTS = {
+    "name": 3.0,
+    "folder": 3.0,
+    "category": 2.0,
+    "personality_category": 2.0,
+    "personality_description": 1.5,
+    "personality_conditioning": 1.0,
+}
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_token_pattern = re.compile(r"\w+")
+_stop_words = frozenset("a an and are as at be by for from has he in is it its of on or that the to was were will with you your".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits a text into lower case search terms (stop words and single characters are dropped).
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        List[str]: The terms.
+    """
+    return [token for token in _token_pattern.findall(text.lower().replace("_", " ")) if len(token) > 1 and token not in _stop_words]
+
+
+class SearchIndex:
+    """
+    A BM25 ranked inverted index over the entries of a PersonalityCatalog.
+
+    Usage:
+    ```
+    catalog = PersonalityCatalog("personalities_zoo")
+    catalog.build()
+    index = SearchIndex()
+    index.sync(catalog)
+    for result in index.search("python code"):
+        print(result["score"], result["path"])
+    ```
+    """
+    def __init__(self, index_path: str | Path = None) -> None:
+        """
+        Initialize a SearchIndex.
+
+        Args:
+            index_path (str or Path, optional): Where to persist the index. If None, the index is kept in memory only.
+        """
+        self.index_path = Path(index_path) if index_path is not None else None
+        # term -> {document path: weighted term frequency}
+        self.postings: Dict[str, Dict[str, float]] = {}
+        # document path -> (weighted length, configuration signature, terms)
+        self.documents: Dict[str, tuple] = {}
+        self.total_length = 0.0
+        self._entries: Dict[str, dict] = {}
+        self._lock = threading.RLock()
+        self.load()
+
+    def load(self) -> bool:
+        """
+        Loads the persisted index if any.
+
+        Returns:
+            bool: True if an index was loaded.
+        """
+        if self.index_path is None:
+            return False
+        try:
+            with open(self.index_path, "rb") as f:
+                data = pickle.load(f)
+        except Exception:
+            return False
+        if not isinstance(data, dict) or data.get("version") != SEARCH_INDEX_FORMAT_VERSION:
+            return False
+        self.postings = data["postings"]
+        self.documents = data["documents"]
+        self.total_length = sum(document[0] for document in self.documents.values())
+        return True
+
+    def save(self):
+        """
+        Persists the index.
+        """
+        if self.index_path is None:
+            return
+        with self._lock:
+            data = {"version": SEARCH_INDEX_FORMAT_VERSION, "postings": self.postings, "documents": self.documents}
+            try:
+                self.index_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.index_path.with_suffix(f".{os.getpid()}.tmp")
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self.index_path)
+            except OSError as ex:
+                print(f"Couldn't save the search index: {ex}")
+
+    @staticmethod
+    def _signature(entry: dict) -> str:
+        config = entry.get("files", {}).get("config.yaml")
+        return config[2] if config is not None else ""
+
+    def add(self, entry: dict):
+        """
+        Indexes a catalog entry (replacing its previous version if any).
+
+        Args:
+            entry (dict): The catalog entry.
+        """
+        path = entry["path"]
+        with self._lock:
+            self.remove(path)
+            frequencies = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                for term in tokenize(str(entry.get(field) or "")):
+                    frequencies[term] += weight
+            for term, frequency in frequencies.items():
+                self.postings.setdefault(term, {})[path] = frequency
+            length = sum(frequencies.values())
+            self.documents[path] = (length, self._signature(entry), tuple(frequencies.keys()))
+            self.total_length += length
+            self._entries[path] = entry
+
+    def remove(self, path: str):
+        """
+        Removes a document from the index.
+
+        Args:
+            path (str): The catalog path of the personality.
+        """
+        with self._lock:
+            document = self.documents.pop(path, None)
+            self._entries.pop(path, None)
+            if document is None:
+                return
+            self.total_length -= document[0]
+            for term in document[2]:
+                postings = self.postings.get(term)
+                if postings is not None and postings.pop(path, None) is not None and len(postings) == 0:
+                    del self.postings[term]
+
+    def sync(self, catalog) -> dict:
+        """
+        Updates the index from a catalog. Only the entries whose configuration changed are indexed again.
+
+        Args:
+            catalog (PersonalityCatalog): The catalog.
+
+        Returns:
+            dict: The number of "indexed" and "removed" documents.
+        """
+        stats = {"indexed": 0, "removed": 0}
+        with self._lock:
+            for path, entry in catalog.entries.items():
+                document = self.documents.get(path)
+                if document is None or document[1] != self._signature(entry):
+                    self.add(entry)
+                    stats["indexed"] += 1
+                else:
+                    self._entries[path] = entry
+            for path in [path for path in self.documents if path not in catalog.entries]:
+                self.remove(path)
+                stats["removed"] += 1
+            if stats["indexed"] or stats["removed"]:
+                self.save()
+        return stats
+
+    def search(self, query: str, limit: int = 10, language: str = None, category: str = None) -> List[dict]:
+        """
+        Searches the index.
+
+        Args:
+            query (str): The search text.
+            limit (int, optional): The maximum number of results. Defaults to 10.
+            language (str, optional): Keep only personalities of this language folder.
+            category (str, optional): Keep only personalities of this category folder.
+
+        Returns:
+            List[dict]: The best matches, each with the "path", "name", "language", "category",
+                        "personality_description" and "score" of the personality.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            documents_count = len(self.documents)
+            if documents_count == 0 or len(terms) == 0:
+                return []
+            average_length = self.total_length / documents_count
+            scores = Counter()
+            for term in terms:
+                postings = self.postings.get(term)
+                if postings is None:
+                    continue
+                idf = math.log(1 + (documents_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for path, frequency in postings.items():
+                    length = self.documents[path][0]
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                    scores[path] += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+
+            results = []
+            for path, score in scores.most_common():
+                entry = self._entries.get(path, {})
+                language_folder, category_folder = path.split("/")[:2]
+                if language is not None and language_folder != language:
+                    continue
+                if category is not None and category_folder != category:
+                    continue
+                results.append({
+                    "path": path,
+                    "name": entry.get("name", ""),
+                    "language": language_folder,
+                    "category": category_folder,
+                    "personality_description": entry.get("personality_description", ""),
+                    "score": round(score, 4),
+                })
+                if len(results) >= limit:
+                    break
+            return results
@@ -1,8 +1,22 @@
-from flask import Flask, render_template, request
+from flask import Flask, request, send_file, abort
 from flask_socketio import SocketIO, emit
 from flask_cors import CORS
 from pyaipersonality import AIPersonality, MSG_TYPE
 from pyaipersonality.binding import BindingConfig
+from pyaipersonality.catalog import PersonalityCatalog
+from pyaipersonality.compaction import DiscussionCompactor
+from pyaipersonality.context import ContextBuilder, CONTEXT_POLICIES
+from pyaipersonality.discussion import Discussion
+from pyaipersonality.dependencies import DependencyResolver
+from pyaipersonality.install_ledger import get_install_ledger
+from pyaipersonality.registry import PersonalityRegistry
+from pyaipersonality.resources import get_resource_registry
+from pyaipersonality.sessions import SessionStateManager
+from pyaipersonality.state_cache import get_state_cache
+from pyaipersonality.usage import UsageTracker, PredictivePreloader
+from pyaipersonality.thumbnails import get_thumbnail_cache, DEFAULT_THUMBNAIL_SIZE
+from pyaipersonality.watcher import PersonalityWatcher
+import atexit
 import importlib
 from pathlib import Path
 import argparse
@@ -33,7 +47,12 @@ color_bright_white = '\u001b[37;1m'
 # Store connected clients
 clients = {}
 models = []
-personalities = {}
+context_builders = []
+state_caches = []
+sessions = []
+compactors = []
+catalogs = []
+personalities = PersonalityRegistry()
 answer = ['']
 
 def build_model(bindings_path:Path, cfg: BindingConfig):
@@ -41,13 +60,16 @@ def build_model(bindings_path:Path, cfg: BindingConfig):
     # first find out if there is a requirements.txt file
     install_file_name="install.py"
     install_script_path = binding_path / install_file_name        
-    if install_script_path.exists():
-        module_name = install_file_name[:-3]  # Remove the ".py" extension
-        module_spec = importlib.util.spec_from_file_location(module_name, str(install_script_path))
-        module = importlib.util.module_from_spec(module_spec)
-        module_spec.loader.exec_module(module)
-        if hasattr(module, "Install"):
-            module.Install(None)
+    def run_install():
+        if install_script_path.exists():
+            module_name = install_file_name[:-3]  # Remove the ".py" extension
+            module_spec = importlib.util.spec_from_file_location(module_name, str(install_script_path))
+            module = importlib.util.module_from_spec(module_spec)
+            module_spec.loader.exec_module(module)
+            if hasattr(module, "Install"):
+                return getattr(module.Install(None), "artifacts", [])
+    # The install step is skipped if it already ran with the same script, requirements and environment
+    get_install_ledger().run_once(binding_path, [install_script_path, binding_path / "requirements.txt"], [], run_install)
     # define the full absolute path to the module
     absolute_path = binding_path.resolve()            
     # infer the module name from the file path
@@ -73,10 +95,51 @@ socketio_log.setLevel(logging.WARNING)
 socketio_log.addHandler(logging.StreamHandler())
 
 
+def send_thumbnail(source, digest=None):
+    size = request.args.get('size', DEFAULT_THUMBNAIL_SIZE, type=int)
+    if digest is not None:
+        etag = get_thumbnail_cache().etag(digest, size)
+        if request.if_none_match.contains(etag):
+            # The client already has this thumbnail, the logo is not read
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            response.cache_control.max_age = 3600
+            return response
+    thumbnail = get_thumbnail_cache().get(source, size, digest)
+    if thumbnail is None:
+        abort(404)
+    thumbnail_path, etag = thumbnail
+    # Thumbnails are named after the logo content hash, so clients can revalidate them with If-None-Match
+    return send_file(thumbnail_path, mimetype=get_thumbnail_cache().mimetype, etag=etag, conditional=True, max_age=3600)
+
+@app.route('/zoo/logo/<path:rel_path>')
+def zoo_logo(rel_path):
+    """Serves the logo thumbnail of a zoo personality (language/category/personality) or category (language/category)."""
+    if len(catalogs)==0:
+        abort(404)
+    zoo_path = catalogs[0].zoo_path
+    folder = (zoo_path / rel_path).resolve()
+    if zoo_path not in folder.parents:
+        abort(404)
+    logo_path = folder / "assets" / "logo.png" if (folder / "config.yaml").exists() else folder / "logo.png"
+    return send_thumbnail(logo_path)
+
+@app.route('/personalities/<name>/logo')
+def personality_logo(name):
+    """Serves the logo thumbnail of a mounted personality."""
+    personality = personalities.get(name)
+    # The logo hash is cached by the personality, so revalidations don't read nor hash the logo
+    digest = personality.get_logo_hash() if personality is not None else None
+    if digest is None:
+        abort(404)
+    return send_thumbnail(personality.get_logo_data, digest)
+
+
 @socketio.on('connect')
 def handle_connect():
     client_id = request.sid
-    clients[client_id] = {"namespace":request.namespace,"full_discussion_blocks":[]}
+    discussion = Discussion(models[0] if len(models)>0 else None)
+    clients[client_id] = {"namespace":request.namespace,"discussion":discussion,"branches":[discussion]}
     print(f'Client connected with session ID: {client_id}')
 
 @socketio.on('disconnect')
@@ -84,70 +147,202 @@ def handle_disconnect():
     client_id = request.sid
     if client_id in clients:
         del clients[client_id]
+    if len(sessions)>0:
+        sessions[0].drop(client_id)
+    if len(compactors)>0:
+        compactors[0].forget(client_id)
     print(f'Client disconnected with session ID: {client_id}')
 
 @socketio.on('list_personalities')
-def handle_list_personalities():
+def handle_list_personalities(data=None):
     personality_names = list(personalities.keys())
-    emit('personalities_list', {'personalities': personality_names}, room=request.sid)
+    response = {'personalities': personality_names}
+    if len(catalogs)>0:
+        # Zoo personalities are served from the catalog index without parsing any yaml file
+        filters = data if data is not None else {}
+        response['zoo'] = catalogs[0].list_personalities(
+                                    language=filters.get('language'),
+                                    category=filters.get('category'),
+                                    name=filters.get('name')
+                                )
+    emit('personalities_list', response, room=request.sid)
+
+@socketio.on('search_personalities')
+def handle_search_personalities(data):
+    if len(catalogs)==0:
+        emit('personalities_search_results', {'query': data.get('query', ''), 'results': [], 'error': 'No personalities zoo is indexed (use -pz)'}, room=request.sid)
+        return
+    results = catalogs[0].search(
+                                data.get('query', ''),
+                                limit=data.get('limit', 10),
+                                language=data.get('language'),
+                                category=data.get('category')
+                            )
+    emit('personalities_search_results', {'query': data.get('query', ''), 'results': results}, room=request.sid)
 
 @socketio.on('add_personality')
 def handle_add_personality(data):
     personality_path = data['path']
     try:
-        personality = AIPersonality(personality_path)
-        personalities[personality.name] = personality
+        personality = AIPersonality(personality_path, lazy=True)
+        personalities.add(personality, materialize=True)
         emit('personality_added', {'name': personality.name}, room=request.sid)
     except Exception as e:
         error_message = str(e)
         emit('personality_add_failed', {'error': error_message}, room=request.sid)
 
 
+@socketio.on('registry_status')
+def handle_registry_status():
+    status = personalities.status()
+    status['shared_resources'] = get_resource_registry().status()
+    if len(models)>0 and hasattr(models[0], "prefix_stats"):
+        status['prefix_reuse'] = models[0].prefix_stats
+    if len(state_caches)>0:
+        status['prefix_states'] = state_caches[0].status()
+    if len(sessions)>0:
+        status['sessions'] = sessions[0].status()
+    if len(compactors)>0:
+        status['compaction'] = compactors[0].status()
+    emit('registry_status', status, room=request.sid)
+
 @socketio.on('generate_text')
 def handle_generate_text(data):
-    model = models[0]
+    # The personality can't be evicted while it is generating
+    with personalities.use(data['personality']) as personality, personality.use_processor() as processor:
+        generate_text(data, personality, processor)
+
+def get_prefix_tokens(personality:AIPersonality, discussion:Discussion, state_cache):
+    """
+    Returns the tokens of the part of the prompt shared by all the discussions with a personality: the static part of
+    the conditioning, followed by the welcome message if the whole conditioning is static.
+    """
+    static_prefix = personality.static_conditioning_prefix
+    if discussion.has_tokens and static_prefix == discussion.conditioning:
+        welcome = [message for message in discussion.messages[:1] if message.sender=="welcome"]
+        return discussion.tokens(messages=welcome)
+    return state_cache.tokenize(discussion.model, static_prefix)
+
+def add_branch(client_id, branch:Discussion):
+    """
+    Makes a new branch of a client discussion the current one.
+    """
+    branches = clients[client_id]["branches"]
+    branches.append(branch)
+    clients[client_id]["discussion"] = branch
+    parent = next((i for i, discussion in enumerate(branches) if discussion is branch.parent), None)
+    emit('branch_created', {'branch': len(branches)-1, 'parent': parent, 'fork_point': branch.fork_point}, room=client_id)
+
+def user_message_index(discussion:Discussion, number:int):
+    """
+    Returns the index in the discussion of its user message of a given number (0 for the first one), or None.
+    """
+    user_messages = [i for i, message in enumerate(discussion.messages) if message.sender=="user"]
+    return user_messages[number] if -len(user_messages) <= number < len(user_messages) else None
+
+@socketio.on('regenerate')
+def handle_regenerate(data):
+    client_id = request.sid
+    discussion = clients[client_id]["discussion"]
+    index = user_message_index(discussion, -1)
+    if index is None:
+        emit('regenerate_failed', {'error': 'There is no message to answer'}, room=client_id)
+        return
+    # The branch shares the discussion up to the last user message, only the new answer is evaluated
+    branch = discussion.fork(index+1)
+    add_branch(client_id, branch)
+    user_message = branch.messages[-1]
+    with personalities.use(data['personality']) as personality, personality.use_processor() as processor:
+        prompt = user_message.text
+        if prompt.startswith(personality.user_message_prefix) and prompt.endswith(personality.link_text):
+            prompt = prompt[len(personality.user_message_prefix):len(prompt)-len(personality.link_text)]
+        generate_answer(personality, processor, branch, prompt, user_message)
+
+@socketio.on('edit_message')
+def handle_edit_message(data):
+    client_id = request.sid
+    discussion = clients[client_id]["discussion"]
+    index = user_message_index(discussion, data['message'])
+    if index is None:
+        emit('edit_message_failed', {'error': f"There is no user message {data['message']} in the discussion"}, room=client_id)
+        return
+    # The branch shares the discussion up to the edited message
+    add_branch(client_id, discussion.fork(index))
+    with personalities.use(data['personality']) as personality, personality.use_processor() as processor:
+        generate_text(data, personality, processor)
+
+@socketio.on('select_branch')
+def handle_select_branch(data):
+    client_id = request.sid
+    branches = clients[client_id]["branches"]
+    if not 0 <= data['branch'] < len(branches):
+        emit('select_branch_failed', {'error': f"There is no branch {data['branch']}"}, room=client_id)
+        return
+    discussion = branches[data['branch']]
+    clients[client_id]["discussion"] = discussion
+    emit('branch_selected', {'branch': data['branch'], 'messages': [{'sender': message.sender, 'text': message.text} for message in discussion.messages]}, room=client_id)
+
+def generate_text(data, personality:AIPersonality, processor):
     client_id = request.sid
     prompt = data['prompt']
-    personality:AIPersonality = personalities[data['personality']]
+    discussion = clients[client_id]["discussion"]
+    
+    # The processor is the one snapshotted for this request, a reload can't release it meanwhile
+    if processor is not None and personality.processor_cfg["process_model_input"]:
+        preprocessed_prompt = processor.process_model_input(prompt)
+    else:
+        preprocessed_prompt = prompt
+
+    # Only the new message is tokenized, the previous ones keep their tokens
+    if len(discussion)==0 and personality.include_welcome_message_in_disucssion and personality.welcome_message!="":
+        discussion.add_message("welcome", personality.ai_message_prefix + personality.welcome_message + personality.link_text, pinned=True)
+    user_message = discussion.add_message("user", personality.user_message_prefix + preprocessed_prompt + personality.link_text, pinned=data.get('pin', False))
+    generate_answer(personality, processor, discussion, prompt, user_message)
+
+def generate_answer(personality:AIPersonality, processor, discussion:Discussion, prompt:str, user_message):
+    model = models[0]
+    client_id = request.sid
     # Placeholder code for text generation
     # Replace this with your actual text generation logic
     print(f"Text generation requested by client :{client_id}")
+    if len(compactors)>0:
+        # Summaries only run while the server is idle
+        compactors[0].touch()
 
     answer[0]=''
-    full_discussion_blocks = clients[client_id]["full_discussion_blocks"]
     def callback(text, messsage_type:MSG_TYPE):
         if messsage_type==MSG_TYPE.MSG_TYPE_CHUNK:
             answer[0]  = answer[0] + text
             emit('text_chunk', {'chunk': text}, room=client_id)
         return True
-    
-    if personality.processor is not None and personality.processor_cfg["process_model_input"]:
-        preprocessed_prompt = personality.processor.process_model_input(prompt)
-    else:
-        preprocessed_prompt = prompt
-        
-    full_discussion_blocks.append(personality.user_message_prefix)
-    full_discussion_blocks.append(preprocessed_prompt)
-    full_discussion_blocks.append(personality.link_text)
-    full_discussion_blocks.append(personality.ai_message_prefix)
-        
-    full_discussion = personality.personality_conditioning + ''.join(full_discussion_blocks)
+
+    discussion.set_conditioning(personality.personality_conditioning)
+    # The conditioning is always kept, the policy chooses the messages that fit in the context window
+    context = context_builders[0].build(discussion, personality.ai_message_prefix, personality.model_n_predicts)
     
     print(f"---------------- Input prompt -------------------")
-    print(f"{color_green}{full_discussion}")
+    print(f"{color_green}[{len(context)}/{len(discussion)} messages]{user_message.text}{personality.ai_message_prefix}")
     print(f"{color_reset}--------------------------------------------")
-    if personality.processor is not None and personality.processor_cfg["custom_workflow"]:
-        print("processing...",end="",flush=True)
-        generated_text = personality.processor.run_workflow(prompt, full_discussion, callback=callback)
-    else:
-        print("generating...",end="",flush=True)
-        generated_text = model.generate(full_discussion, n_predict=personality.model_n_predicts, callback=callback)
-    full_discussion_blocks.append(generated_text)
+    # The model is shared by all the clients: the state of this discussion is restored while it generates
+    with sessions[0].session(client_id, lambda: get_prefix_tokens(personality, discussion, state_caches[0])) as session_state:
+        if session_state!="unsupported":
+            print(f"session state: {session_state}...",end="",flush=True)
+        if processor is not None and personality.processor_cfg["custom_workflow"]:
+            print("processing...",end="",flush=True)
+            generated_text = processor.run_workflow(prompt, discussion.text(personality.ai_message_prefix, context), callback=callback)
+        else:
+            print("generating...",end="",flush=True)
+            generated_text = discussion.generate(n_predict=personality.model_n_predicts, callback=callback, suffix=personality.ai_message_prefix, messages=context)
+        if hasattr(model, "last_prefix_hit"):
+            print(f" (prompt: {model.last_prefix_hit}/{model.last_prompt_size} tokens reused)",end="",flush=True)
+    discussion.add_message("ai", personality.ai_message_prefix + generated_text)
     print(f"{color_green}ok{color_reset}",end="",flush=True)    
 
     
     # Emit the generated text to the client
     emit('text_generated', {'text': generated_text}, room=client_id)
+    if len(compactors)>0:
+        compactors[0].schedule(client_id, discussion)
 
 def main():
     parser = argparse.ArgumentParser()
@@ -158,6 +353,17 @@ def main():
     parser.add_argument('--binding', '-b', default=None, help='Binding value')
     parser.add_argument('--personalities', '-p', nargs='+', default=[], help='A list of path to the personalites folders')
     parser.add_argument('--model_name', '-m', default="Manticore-13B.ggmlv3.q4_0.bin", help='Model name')
+    parser.add_argument('--personalities_zoo', '-pz', default=None, help='Path to a personalities zoo to index and expose through list_personalities')
+    parser.add_argument('--wheelhouse', '-wh', default=None, help='A local folder of wheels to install the dependencies from (no index access)')
+    parser.add_argument('--memory_budget', '-mb', type=float, default=None, help='Memory budget in MB for the personalities processors (least recently used ones are unloaded beyond it)')
+    parser.add_argument('--preload_workers', '-pw', type=int, default=4, help='Number of personalities loaded concurrently at startup')
+    parser.add_argument('--no_usage_preload', '-nup', action='store_true', help='Disable the usage tracking and the preloading of the most used personalities')
+    parser.add_argument('--context_policy', '-cp', default="last_n", choices=list(CONTEXT_POLICIES.keys()), help='How the discussion messages are fitted in the context window (last_n keeps the nb_messages_to_remember last messages, budget_fill as many as the context allows, pinned keeps the pinned messages first)')
+    parser.add_argument('--no_state_cache', '-nsc', action='store_true', help='Do not store the model state of the personalities prefixes on disk (only for bindings supporting it)')
+    parser.add_argument('--session_ram_budget', '-srb', type=float, default=1024, help='Memory in MB for the model states of the inactive discussions (the least recently used ones are spilled to disk beyond it)')
+    parser.add_argument('--compaction_threshold', '-ct', type=int, default=None, help='Summarize the oldest messages of the discussions longer than this number of tokens while the server is idle (disabled by default)')
+    parser.add_argument('--restore_personalities', '-rp', type=int, default=0, help='Also mount the N most used personalities of the previous runs')
+    parser.add_argument('--watch', '-w', type=float, default=None, help='Reload the personalities when their package changes, polling every WATCH seconds')
     args = parser.parse_args()
     path = Path(args.config)
 
@@ -175,13 +381,58 @@ def main():
 
     if args.model_name:
         cfg.model = args.model_name
+
+    # Install the dependencies of the binding and of all personalities in a single pip run
+    resolver = DependencyResolver(wheelhouse=args.wheelhouse)
+    resolver.add_binding(Path(args.bindings_path)/cfg["binding"])
+    for p in args.personalities:
+        resolver.add_personality(p)
+    resolver.install()
+
     model = build_model(args.bindings_path, cfg)
     models.append(model)
+    context_builders.append(ContextBuilder.from_config(cfg, args.context_policy))
+    if not args.no_state_cache and model.supports_state:
+        state_caches.append(get_state_cache())
+    sessions.append(SessionStateManager(model, state_caches[0] if len(state_caches)>0 else None, ram_budget_mb=args.session_ram_budget))
+    if args.compaction_threshold is not None:
+        compactor = DiscussionCompactor(model, sessions[0], threshold_tokens=args.compaction_threshold)
+        compactor.start()
+        compactors.append(compactor)
+
+    if args.personalities_zoo:
+        catalog = PersonalityCatalog(args.personalities_zoo)
+        stats = catalog.build()
+        print(f"Personalities zoo indexed: {len(catalog)} personalities ({len(stats['added'])+len(stats['updated'])} parsed)")
+        catalogs.append(catalog)
 
+    personalities.memory_budget_mb = args.memory_budget
     personalities["default_personality"]=AIPersonality()
     for p in args.personalities:
-        personality = AIPersonality(p)
-        personalities[personality.name] = personality
+        # Only the configuration is read here, processors are materialized by the preload
+        personality = AIPersonality(p, lazy=True)
+        personalities.add(personality)
+    if not args.no_usage_preload:
+        tracker = UsageTracker()
+        # The counters recorded since the last idle flush are saved when the server stops (Ctrl-C or restart)
+        atexit.register(tracker.flush)
+        mounted = {str(Path(p).resolve()) for p in args.personalities}
+        for name in tracker.most_likely(args.restore_personalities):
+            path = tracker.entries[name]["path"]
+            if name not in personalities and path is not None and Path(path).exists() and str(Path(path).resolve()) not in mounted:
+                personalities.add(AIPersonality(path, lazy=True), name)
+        preloader = PredictivePreloader(personalities, tracker, max_workers=args.preload_workers)
+        # The most used personalities are loaded first. With a memory budget, only the ones that fit are preloaded
+        # so that loading the others does not evict them
+        preloader.preload()
+        preloader.start()
+    # The server starts accepting connections while the personalities are warming up
+    if args.no_usage_preload or args.memory_budget is None:
+        personalities.preload(max_workers=args.preload_workers)
+    if args.watch:
+        def on_reload(name, report):
+            socketio.emit('personality_reloaded', {'name': name, **report})
+        PersonalityWatcher(personalities, interval=args.watch, callback=on_reload).start()
     print("running...")
     socketio.run(app, host=args.host, port=args.port)
 
@@ -0,0 +1,218 @@
+######
+# Project       : PyAIPersonality
+# File          : sessions.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# Model states of the discussions sharing a binding.
+# All the clients of a server share one model, so the model state only holds
+# the discussion that generated last. When another discussion takes the model,
+# the state of the previous one is saved in memory (least recently used states
+# are spilled to disk beyond a memory budget) and the state of the new one is
+# restored, so each turn only evaluates the new messages. New discussions start
+# from the snapshot of their personality prefix.
+######
+import hashlib
+import os
+import shutil
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Hashable, Optional
+
+from pyaipersonality.binding import LLMBinding
+from pyaipersonality.paths import get_cache_dir
+from pyaipersonality.state_cache import StateCache
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+def _pid_exists(pid: int) -> Optional[bool]:
+    """
+    Tells if a process is running, or returns None if it can't be checked.
+    """
+    try:
+        import psutil
+        return psutil.pid_exists(pid)
+    except ImportError:
+        pass
+    if os.name == "nt":
+        # os.kill terminates the process on Windows
+        return None
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError, OverflowError):
+        return True
+
+
+def _remove_stale_spill_dirs(root: Path):
+    """
+    Removes the spilled states of the server processes that are not running anymore (sessions don't survive a restart).
+    """
+    for entry in os.scandir(root):
+        if not entry.is_dir() or not entry.name.isdigit():
+            continue
+        if _pid_exists(int(entry.name)) is False:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+class SessionStateManager:
+    """
+    Switches the state of a binding between sessions (discussions).
+
+    Usage:
+    ```
+    sessions = SessionStateManager(model, get_state_cache(), ram_budget_mb=1024)
+    with sessions.session(client_id, lambda: prefix_tokens):
+        answer = discussion.generate(n_predict, callback, suffix=personality.ai_message_prefix)
+    ...
+    sessions.drop(client_id)
+    ```
+    """
+    def __init__(self, binding: LLMBinding, state_cache: StateCache = None, ram_budget_mb: float = 1024, spill_dir: str | Path = None, compression_level: int = 1) -> None:
+        """
+        Initialize a SessionStateManager.
+
+        Args:
+            binding (LLMBinding): The shared binding.
+            state_cache (StateCache, optional): Used to start new sessions from the snapshot of their prefix. Defaults to None.
+            ram_budget_mb (float, optional): The memory used by the saved states. Least recently used states are
+                spilled to disk beyond it. Defaults to 1024.
+            spill_dir (str or Path, optional): Where spilled states are stored. Defaults to a folder in the pyaipersonality cache folder.
+            compression_level (int, optional): The zlib compression level of the spilled states. Defaults to 1 (fastest).
+        """
+        self.binding = binding
+        self.state_cache = state_cache
+        self.ram_budget_mb = ram_budget_mb
+        if spill_dir is None:
+            _remove_stale_spill_dirs(get_cache_dir("sessions"))
+            spill_dir = get_cache_dir("sessions", str(os.getpid()))
+        self.spill_dir = Path(spill_dir)
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self.compression_level = compression_level
+        # Only one session can use the binding at a time
+        self.lock = threading.RLock()
+        # session id -> saved state, least recently used first
+        self._states: OrderedDict[Hashable, bytes] = OrderedDict()
+        self._ram_size = 0
+        # session id -> spilled state file
+        self._spilled: Dict[Hashable, Path] = {}
+        # The session whose state is in the binding
+        self.current: Optional[Hashable] = None
+        self.stats = {"resident": 0, "restored": 0, "restored_from_disk": 0, "seeded": 0, "spilled": 0}
+
+    def _spill_path(self, session_id: Hashable) -> Path:
+        return self.spill_dir / f"{hashlib.sha1(str(session_id).encode()).hexdigest()}.session"
+
+    def _store(self, session_id: Hashable, state: bytes):
+        self._take(session_id)
+        self._states[session_id] = state
+        self._ram_size += len(state)
+        # Least recently used states go to disk
+        while self._ram_size > self.ram_budget_mb * 1024 * 1024 and len(self._states) > 0:
+            spilled_id, spilled_state = self._states.popitem(last=False)
+            self._ram_size -= len(spilled_state)
+            path = self._spill_path(spilled_id)
+            try:
+                with open(path, "wb") as f:
+                    f.write(zlib.compress(spilled_state, self.compression_level))
+                self._spilled[spilled_id] = path
+                self.stats["spilled"] += 1
+            except OSError as ex:
+                print(f"Couldn't spill the state of session {spilled_id}: {ex}")
+
+    def _take(self, session_id: Hashable):
+        """
+        Removes the saved state of a session and returns it with where it came from ("ram" or "disk").
+        """
+        state = self._states.pop(session_id, None)
+        if state is not None:
+            self._ram_size -= len(state)
+            return state, "ram"
+        path = self._spilled.pop(session_id, None)
+        if path is None:
+            return None, None
+        try:
+            with open(path, "rb") as f:
+                state = zlib.decompress(f.read())
+        except (OSError, zlib.error):
+            state = None
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return state, "disk"
+
+    def activate(self, session_id: Hashable, prefix_tokens: Callable = None) -> str:
+        """
+        Puts the state of a session in the binding. Must be called with the lock held (see session).
+
+        Args:
+            session_id (Hashable): The session.
+            prefix_tokens (Callable, optional): Returns the prefix tokens new sessions are started from.
+
+        Returns:
+            str: "unsupported", "resident" (the binding already holds the session), "restored", "restored_from_disk",
+                "seeded" (started from the prefix) or "new".
+        """
+        if not self.binding.supports_state:
+            return "unsupported"
+        if self.current == session_id:
+            self.stats["resident"] += 1
+            return "resident"
+        if self.current is not None:
+            state = self.binding.save_state()
+            if state is not None:
+                self._store(self.current, state)
+        self.current = session_id
+        state, origin = self._take(session_id)
+        if state is not None and self.binding.load_state(state):
+            status = "restored" if origin == "ram" else "restored_from_disk"
+            self.stats[status] += 1
+            return status
+        if self.state_cache is not None and prefix_tokens is not None:
+            if self.state_cache.prime(self.binding, prefix_tokens()) in ("resident", "restored", "saved"):
+                self.stats["seeded"] += 1
+                return "seeded"
+        return "new"
+
+    @contextmanager
+    def session(self, session_id: Hashable, prefix_tokens: Callable = None):
+        """
+        Holds the binding for a session: waits for the other sessions to finish, restores the session state and
+        yields the activation status.
+
+        Args:
+            session_id (Hashable): The session.
+            prefix_tokens (Callable, optional): Returns the prefix tokens new sessions are started from.
+        """
+        with self.lock:
+            yield self.activate(session_id, prefix_tokens)
+
+    def drop(self, session_id: Hashable):
+        """
+        Forgets the state of a session (when its client disconnects).
+        """
+        with self.lock:
+            self._take(session_id)
+            if self.current == session_id:
+                self.current = None
+
+    def status(self) -> dict:
+        """
+        Returns the number and size of the saved states and the activation counters.
+        """
+        return {
+            "ram_sessions": len(self._states),
+            "ram_mb": self._ram_size / (1024 * 1024),
+            "disk_sessions": len(self._spilled),
+            **self.stats,
+        }
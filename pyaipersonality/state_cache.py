@@ -0,0 +1,219 @@
+######
+# Project       : PyAIPersonality
+# File          : state_cache.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# Model state snapshots of personality prefixes.
+# Evaluating the conditioning of a personality is the longest part of the first
+# answer of a discussion on CPU. Bindings that can save and restore their state
+# evaluate the static prefix of a personality once, then the state is stored
+# compressed in the cache folder and restored by the next discussions (and the
+# next runs of the server). Snapshots are keyed by the model file, the context
+# size and the prefix tokens.
+######
+import hashlib
+import os
+import threading
+import zlib
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from pyaipersonality.binding import LLMBinding
+from pyaipersonality.paths import get_cache_dir
+from pyaipersonality.resources import file_fingerprint
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+# Prefixes shorter than this are evaluated faster than a snapshot is loaded
+MIN_PREFIX_TOKENS = 32
+
+
+def get_model_file(config) -> Path:
+    """
+    Returns the weights file of the model of a binding configuration (models are stored in ./models/<binding>/<model>).
+    """
+    return Path("./models") / config["binding"] / config["model"]
+
+
+class StateCache:
+    """
+    Stores the model states of evaluated prefixes on disk.
+
+    Usage:
+    ```
+    states = get_state_cache()
+    status = states.prime(model, model.tokenize(personality.static_conditioning_prefix))
+    ```
+    """
+    def __init__(self, cache_dir: str | Path = None, compression_level: int = 1, max_size_mb: float = 4096) -> None:
+        """
+        Initialize a StateCache.
+
+        Args:
+            cache_dir (str or Path, optional): Where snapshots are stored. Defaults to a folder in the pyaipersonality cache folder.
+            compression_level (int, optional): The zlib compression level of the snapshots. Defaults to 1 (fastest).
+            max_size_mb (float, optional): The least recently used snapshots are removed beyond this size. Defaults to 4096.
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else get_cache_dir("states")
+        self.compression_level = compression_level
+        self.max_size_mb = max_size_mb
+        # model file -> (mtime_ns, size, fingerprint)
+        self._fingerprints: Dict[str, Tuple[int, int, str]] = {}
+        # prefix text -> tokens
+        self._prefix_tokens: Dict[str, Optional[List[int]]] = {}
+        self._lock = threading.Lock()
+        self.restored = 0
+        self.saved = 0
+
+    def model_fingerprint(self, config) -> str:
+        """
+        Returns the fingerprint of the model file of a binding configuration (recomputed only when the file changes).
+        """
+        model_file = str(get_model_file(config))
+        try:
+            stat = os.stat(model_file)
+        except OSError:
+            return model_file
+        cached = self._fingerprints.get(model_file)
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+        fingerprint = file_fingerprint(model_file)
+        self._fingerprints[model_file] = (stat.st_mtime_ns, stat.st_size, fingerprint)
+        return fingerprint
+
+    def key(self, binding: LLMBinding, tokens) -> str:
+        """
+        Builds the key of the state of a prefix: hash of the model file fingerprint, the context size and the tokens.
+        """
+        h = hashlib.sha1(self.model_fingerprint(binding.config).encode())
+        h.update(str(binding.config["ctx_size"]).encode())
+        h.update(array("i", tokens).tobytes())
+        return h.hexdigest()
+
+    def tokenize(self, binding: LLMBinding, prefix: str) -> Optional[List[int]]:
+        """
+        Tokenizes a prefix text (tokens are cached by text).
+        """
+        tokens = self._prefix_tokens.get(prefix, False)
+        if tokens is False:
+            tokens = binding.tokenize(prefix)
+            tokens = list(tokens) if tokens is not None else None
+            if len(self._prefix_tokens) >= 256:
+                self._prefix_tokens.clear()
+            self._prefix_tokens[prefix] = tokens
+        return tokens
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.state"
+
+    def load(self, key: str) -> Optional[bytes]:
+        """
+        Loads a snapshot.
+
+        Args:
+            key (str): The snapshot key.
+
+        Returns:
+            bytes: The binding state or None if there is no snapshot.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = zlib.decompress(f.read())
+        except (OSError, zlib.error):
+            return None
+        # The modification time tells which snapshots were used last
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def store(self, key: str, state: bytes):
+        """
+        Stores a snapshot.
+
+        Args:
+            key (str): The snapshot key.
+            state (bytes): The binding state.
+        """
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(zlib.compress(state, self.compression_level))
+        os.replace(tmp_path, path)
+        self._cleanup()
+
+    def _cleanup(self):
+        if self.max_size_mb is None:
+            return
+        with self._lock:
+            files = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(".state"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_size_mb * 1024 * 1024:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def prime(self, binding: LLMBinding, tokens) -> str:
+        """
+        Makes the binding state hold a prefix: does nothing if it already does, restores the snapshot of the prefix if
+        there is one, evaluates the prefix and stores its snapshot otherwise.
+
+        Args:
+            binding (LLMBinding): The binding.
+            tokens (list or array): The prefix tokens.
+
+        Returns:
+            str: "unsupported", "skipped" (prefix too short), "resident", "restored" or "saved".
+        """
+        if tokens is None or not binding.supports_state:
+            return "unsupported"
+        if len(tokens) < MIN_PREFIX_TOKENS:
+            return "skipped"
+        if binding.prefix_length(tokens) >= len(tokens) - 1:
+            return "resident"
+        key = self.key(binding, tokens)
+        state = self.load(key)
+        if state is not None and binding.load_state(state):
+            self.restored += 1
+            return "restored"
+        binding.evaluate_prompt(tokens)
+        state = binding.save_state()
+        if state is None:
+            return "unsupported"
+        self.store(key, state)
+        self.saved += 1
+        return "saved"
+
+    def status(self) -> dict:
+        """
+        Returns the restored and saved snapshots counters.
+        """
+        return {"restored": self.restored, "saved": self.saved}
+
+
+_default_state_cache = None
+
+
+def get_state_cache() -> StateCache:
+    """
+    Returns the process wide state cache.
+    """
+    global _default_state_cache
+    if _default_state_cache is None:
+        _default_state_cache = StateCache()
+    return _default_state_cache
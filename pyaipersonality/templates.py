@@ -0,0 +1,231 @@
+######
+# Project       : PyAIPersonality
+# File          : templates.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# Conditioning templates.
+# Templates such as the personality conditioning contain {{key}} variables.
+# Each template is compiled once into literal and variable segments and rendered
+# with a single join. Variable values come from providers that are evaluated
+# lazily and cached for a per provider lifetime, so {{date}} stays current on a
+# long running server without being recomputed for every prompt.
+######
+import re
+import threading
+import time
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+# The pattern matches "{{key}}" and captures "key" in a group
+_variable_pattern = re.compile(r"\{\{(\w+)\}\}")
+
+
+class VariableProviders:
+    """
+    The values available to templates.
+
+    A provider is either a constant value (static) or a function evaluated lazily and cached for `ttl` seconds.
+    Providers can be read like a dictionary, which keeps the old `Conditionning_commands` usage working.
+
+    Usage:
+    ```
+    providers = VariableProviders()
+    providers.register("date", lambda: datetime.now().strftime("%A, %B %d, %Y"), ttl=60)
+    providers["user"] = "ParisNeo"
+    print(providers.get("date"))
+    ```
+    """
+    def __init__(self) -> None:
+        # name -> (function, ttl) for dynamic providers
+        self._functions: Dict[str, Tuple[Callable[[], Any], float]] = {}
+        # name -> value for static providers
+        self._static: Dict[str, str] = {}
+        # name -> (expiry time, value) for dynamic providers
+        self._cache: Dict[str, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, function: Callable[[], Any], ttl: float = 0):
+        """
+        Registers a dynamic provider.
+
+        Args:
+            name (str): The variable name.
+            function (Callable[[], Any]): Returns the value of the variable.
+            ttl (float, optional): How long a value can be reused in seconds. 0 means it is evaluated at every render.
+        """
+        with self._lock:
+            self._static.pop(name, None)
+            self._cache.pop(name, None)
+            self._functions[name] = (function, ttl)
+
+    def __setitem__(self, name: str, value):
+        """Registers a static value."""
+        with self._lock:
+            self._functions.pop(name, None)
+            self._cache.pop(name, None)
+            self._static[name] = str(value)
+
+    def __getitem__(self, name: str) -> str:
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._static or name in self._functions
+
+    def keys(self) -> List[str]:
+        return list(self._static.keys()) + list(self._functions.keys())
+
+    def is_static(self, name: str) -> bool:
+        """
+        Tells if a variable always has the same value (constant providers and unknown variables, which are kept as is).
+        """
+        return name not in self._functions
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """
+        Returns the current value of a variable.
+
+        Args:
+            name (str): The variable name.
+            default (str, optional): Returned if there is no provider for this variable.
+
+        Returns:
+            str: The value.
+        """
+        value = self._static.get(name)
+        if value is not None:
+            return value
+        provider = self._functions.get(name)
+        if provider is None:
+            return default
+        function, ttl = provider
+        now = time.monotonic()
+        cached = self._cache.get(name)
+        if cached is not None and now < cached[0]:
+            return cached[1]
+        value = str(function())
+        if ttl > 0:
+            self._cache[name] = (now + ttl, value)
+        return value
+
+
+def get_default_providers() -> VariableProviders:
+    """
+    Builds the providers of the default conditioning variables: date_time, date and time.
+    """
+    providers = VariableProviders()
+    providers.register("date_time", lambda: datetime.now().strftime("%A, %B %d, %Y %I:%M:%S %p"), ttl=1)
+    providers.register("date", lambda: datetime.now().strftime("%A, %B %d, %Y"), ttl=60)
+    providers.register("time", lambda: datetime.now().strftime("%H:%M:%S"), ttl=1)
+    return providers
+
+
+class CompiledTemplate:
+    """
+    A template split into literal text and variables.
+
+    Usage:
+    ```
+    template = compile_template("Today's date is {{date}}")
+    print(template.render(get_default_providers()))
+    ```
+    """
+    __slots__ = ("source", "segments", "variables")
+
+    def __init__(self, source: str) -> None:
+        """
+        Initialize a CompiledTemplate.
+
+        Args:
+            source (str): The template text.
+        """
+        self.source = source
+        # Literal texts and variable names (as 1-tuples), in order
+        self.segments: List[str | Tuple[str]] = []
+        position = 0
+        for match in _variable_pattern.finditer(source):
+            if match.start() > position:
+                self.segments.append(source[position:match.start()])
+            self.segments.append((match.group(1),))
+            position = match.end()
+        if position < len(source):
+            self.segments.append(source[position:])
+        self.variables = [segment[0] for segment in self.segments if isinstance(segment, tuple)]
+
+    def _render_segment(self, segment, providers) -> str:
+        if isinstance(segment, str):
+            return segment
+        value = providers.get(segment[0])
+        # Unknown variables are left as is
+        return "{{" + segment[0] + "}}" if value is None else value
+
+    def render(self, providers) -> str:
+        """
+        Renders the template.
+
+        Args:
+            providers (VariableProviders or dict): The variable values.
+
+        Returns:
+            str: The rendered text.
+        """
+        if len(self.variables) == 0:
+            return self.source
+        return "".join([self._render_segment(segment, providers) for segment in self.segments])
+
+    def render_parts(self, providers) -> List[Tuple[str, bool]]:
+        """
+        Renders the template as a list of parts telling which ones never change.
+
+        Args:
+            providers (VariableProviders or dict): The variable values.
+
+        Returns:
+            List[Tuple[str, bool]]: (text, is_static) for each segment.
+        """
+        is_static = getattr(providers, "is_static", lambda name: True)
+        return [
+            (self._render_segment(segment, providers), isinstance(segment, str) or is_static(segment[0]))
+            for segment in self.segments
+        ]
+
+    def static_prefix(self, providers) -> str:
+        """
+        Returns the rendered text before the first dynamic variable.
+        This part of the prompt is the same at every render, so prompt caches can reuse it.
+
+        Args:
+            providers (VariableProviders or dict): The variable values.
+
+        Returns:
+            str: The static prefix.
+        """
+        prefix = []
+        for text, is_static in self.render_parts(providers):
+            if not is_static:
+                break
+            prefix.append(text)
+        return "".join(prefix)
+
+
+@lru_cache(maxsize=256)
+def compile_template(source: str) -> CompiledTemplate:
+    """
+    Compiles a template (compiled templates are cached by text).
+
+    Args:
+        source (str): The template text.
+
+    Returns:
+        CompiledTemplate: The compiled template.
+    """
+    return CompiledTemplate(source)
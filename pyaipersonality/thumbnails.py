@@ -0,0 +1,170 @@
+######
+# Project       : PyAIPersonality
+# File          : thumbnails.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# Logo thumbnails cache.
+# Personality and category logos are resized and compressed once per content
+# hash and size, and stored in the cache folder. The content hash doubles as an
+# ETag so that clients browsing a zoo only download each thumbnail once.
+######
+import hashlib
+import io
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+from pyaipersonality.paths import get_cache_dir
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+# Thumbnails are only generated for these sizes, other requested sizes are rounded up
+THUMBNAIL_SIZES = (32, 64, 128, 256, 512)
+DEFAULT_THUMBNAIL_SIZE = 128
+
+_mimetypes = {"webp": "image/webp", "png": "image/png"}
+
+
+def round_size(size: int) -> int:
+    """
+    Rounds a requested size up to the closest supported thumbnail size.
+    """
+    for supported in THUMBNAIL_SIZES:
+        if size <= supported:
+            return supported
+    return THUMBNAIL_SIZES[-1]
+
+
+class ThumbnailCache:
+    """
+    Generates and stores logo thumbnails.
+
+    Usage:
+    ```
+    thumbnails = ThumbnailCache()
+    path, etag = thumbnails.get("personalities_zoo/english/art/artbot/assets/logo.png", size=64)
+    ```
+    """
+    def __init__(self, cache_dir: str | Path = None, image_format: str = None, quality: int = 80) -> None:
+        """
+        Initialize a ThumbnailCache.
+
+        Args:
+            cache_dir (str or Path, optional): Where thumbnails are stored. Defaults to a folder in the pyaipersonality cache folder.
+            image_format (str, optional): "webp" or "png". Defaults to webp if Pillow supports it, png otherwise.
+            quality (int, optional): The compression quality of webp thumbnails. Defaults to 80.
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else get_cache_dir("thumbnails")
+        if image_format is None:
+            from PIL import features
+            image_format = "webp" if features.check("webp") else "png"
+        self.image_format = image_format
+        self.quality = quality
+        # source path -> (mtime_ns, size, content hash), so that unchanged files are not hashed again
+        self._hashes: Dict[str, Tuple[int, int, str]] = {}
+        self._lock = threading.Lock()
+        self.generated = 0
+
+    @property
+    def mimetype(self) -> str:
+        """Get the mime type of the thumbnails."""
+        return _mimetypes[self.image_format]
+
+    def content_hash(self, source: str | Path) -> str:
+        """
+        Returns the sha1 hash of a file content (recomputed only when the file changes).
+        """
+        key = os.path.abspath(source)
+        st = os.stat(key)
+        known = self._hashes.get(key)
+        if known is not None and known[0] == st.st_mtime_ns and known[1] == st.st_size:
+            return known[2]
+        with open(key, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        self._hashes[key] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    @staticmethod
+    def etag(digest: str, size: int = DEFAULT_THUMBNAIL_SIZE) -> str:
+        """
+        Returns the ETag of the thumbnail of an image out of the image content hash (size is rounded up to a supported size).
+        """
+        return f"{digest}-{round_size(size)}"
+
+    def get(self, source: str | Path | bytes | Callable[[], bytes], size: int = DEFAULT_THUMBNAIL_SIZE, digest: str = None) -> Optional[Tuple[Path, str]]:
+        """
+        Returns the thumbnail of an image, generating it if needed.
+
+        Args:
+            source (str, Path, bytes or Callable[[], bytes]): The image file, its content or a function reading its
+                content (a function requires the digest).
+            size (int, optional): The maximum width and height of the thumbnail (rounded up to a supported size).
+            digest (str, optional): The content hash of the image if it is already known. The content is then only read
+                if the thumbnail has to be generated.
+
+        Returns:
+            tuple: (thumbnail path, etag) or None if the source does not exist.
+        """
+        size = round_size(size)
+        data = None
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            data = bytes(source)
+            if digest is None:
+                digest = hashlib.sha1(data).hexdigest()
+        elif digest is None:
+            if not os.path.isfile(source):
+                return None
+            digest = self.content_hash(source)
+        etag = self.etag(digest, size)
+        thumbnail_path = self.cache_dir / digest[:2] / f"{etag}.{self.image_format}"
+        if thumbnail_path.exists():
+            return thumbnail_path, etag
+
+        with self._lock:
+            if not thumbnail_path.exists():
+                if callable(source):
+                    data = source()
+                    if data is None:
+                        return None
+                elif data is None:
+                    with open(source, "rb") as f:
+                        data = f.read()
+                self._generate(data, size, thumbnail_path)
+                self.generated += 1
+        return thumbnail_path, etag
+
+    def _generate(self, data: bytes, size: int, thumbnail_path: Path):
+        """
+        Resizes an image and writes the thumbnail.
+        """
+        from PIL import Image
+        with Image.open(io.BytesIO(data)) as image:
+            # draft lets the decoder skip most of the work for formats that support it (jpeg)
+            image.draft("RGBA", (size, size))
+            image = image.convert("RGBA")
+            image.thumbnail((size, size), Image.LANCZOS)
+            thumbnail_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = thumbnail_path.with_suffix(f".{os.getpid()}.tmp")
+            if self.image_format == "webp":
+                image.save(tmp_path, "WEBP", quality=self.quality, method=4)
+            else:
+                image.save(tmp_path, "PNG", optimize=True)
+        os.replace(tmp_path, thumbnail_path)
+
+
+_default_cache = None
+
+
+def get_thumbnail_cache() -> ThumbnailCache:
+    """
+    Returns the process wide thumbnail cache.
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ThumbnailCache()
+    return _default_cache
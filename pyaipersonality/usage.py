@@ -0,0 +1,251 @@
+######
+# Project       : PyAIPersonality
+# File          : usage.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# Usage driven preloading of personalities.
+# The usage tracker records how often and how recently each personality is used
+# and persists it. At startup and while the server is idle, the most likely
+# personalities are materialized within the registry memory budget, so the
+# first requests after a restart do not pay the load cost.
+######
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from pyaipersonality.paths import get_cache_dir
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+# A use loses half of its weight in the ranking after this many seconds
+DEFAULT_HALF_LIFE = 7 * 24 * 3600
+
+
+class UsageTracker:
+    """
+    Persistent usage statistics of personalities.
+
+    Each personality has a use count, the time of its last use and a score (the use count with an exponential decay)
+    used to rank the personalities by likelihood of being used next.
+
+    Usage:
+    ```
+    tracker = UsageTracker()
+    tracker.record("Artbot", hit=False, path="personalities_zoo/english/art/artbot")
+    print(tracker.most_likely(3))
+    ```
+    """
+    def __init__(self, usage_path: str | Path = None, half_life: float = DEFAULT_HALF_LIFE) -> None:
+        """
+        Initialize a UsageTracker.
+
+        Args:
+            usage_path (str or Path, optional): The json file where the statistics are stored. Defaults to a file in the pyaipersonality cache folder.
+            half_life (float, optional): The half life of a use in seconds. Defaults to one week.
+        """
+        if usage_path is None:
+            usage_path = get_cache_dir() / "usage.json"
+        self.usage_path = Path(usage_path)
+        self.half_life = half_life
+        # name -> {"count", "last_used", "score", "path", "footprint"}
+        self.entries: Dict[str, dict] = {}
+        # hits and misses since the process started
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self._lock = threading.Lock()
+        try:
+            with open(self.usage_path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def _decayed_score(self, entry: dict, now: float) -> float:
+        return entry["score"] * 0.5 ** (max(0.0, now - entry["last_used"]) / self.half_life)
+
+    def record(self, name: str, hit: bool, path: str | Path = None, footprint: int = None):
+        """
+        Records a use of a personality.
+
+        Args:
+            name (str): The personality name.
+            hit (bool): True if the personality was already materialized when it was requested.
+            path (str or Path, optional): The personality package path, used to mount it again at next startup.
+            footprint (int, optional): The last measured memory footprint of the personality in bytes.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self.entries.setdefault(name, {"count": 0, "last_used": now, "score": 0.0, "path": None, "footprint": 0})
+            entry["score"] = self._decayed_score(entry, now) + 1.0
+            entry["count"] += 1
+            entry["last_used"] = now
+            if path is not None:
+                entry["path"] = str(path)
+            if footprint:
+                entry["footprint"] = footprint
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.dirty = True
+
+    def score(self, name: str) -> float:
+        """
+        Returns the current score of a personality (0 if it was never used).
+        """
+        entry = self.entries.get(name)
+        return self._decayed_score(entry, time.time()) if entry is not None else 0.0
+
+    def most_likely(self, limit: int = None, candidates: List[str] = None) -> List[str]:
+        """
+        Ranks personalities by likelihood of being used next.
+
+        Args:
+            limit (int, optional): The maximum number of names to return.
+            candidates (List[str], optional): Restrict the ranking to these names. Defaults to all known personalities.
+
+        Returns:
+            List[str]: The names sorted by decreasing score (never used personalities are left out).
+        """
+        now = time.time()
+        with self._lock:
+            names = [name for name in (candidates if candidates is not None else self.entries) if name in self.entries]
+            names.sort(key=lambda name: self._decayed_score(self.entries[name], now), reverse=True)
+        return names[:limit] if limit is not None else names
+
+    def hit_rate(self) -> float:
+        """
+        Returns the ratio of uses that found the personality already materialized.
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters and the ranking.
+        """
+        now = time.time()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate(), 3),
+            "ranking": [
+                {"name": name, "count": self.entries[name]["count"], "score": round(self._decayed_score(self.entries[name], now), 3)}
+                for name in self.most_likely(10)
+            ],
+        }
+
+    def flush(self):
+        """
+        Persists the statistics if they changed.
+        """
+        with self._lock:
+            if not self.dirty:
+                return
+            data = json.dumps(self.entries, indent=1)
+            self.dirty = False
+        try:
+            self.usage_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.usage_path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, self.usage_path)
+        except OSError as ex:
+            print(f"Couldn't save the usage statistics: {ex}")
+
+
+class PredictivePreloader:
+    """
+    Materializes the most likely personalities of a registry within its memory budget,
+    at startup and whenever the server has been idle for a while.
+
+    Usage:
+    ```
+    preloader = PredictivePreloader(registry, tracker)
+    preloader.preload()
+    preloader.start()
+    ```
+    """
+    def __init__(self, registry, tracker: UsageTracker, idle_seconds: float = 30, interval: float = 10, max_workers: int = 2) -> None:
+        """
+        Initialize a PredictivePreloader.
+
+        Args:
+            registry (PersonalityRegistry): The registry to preload personalities into. Its usage tracker is set to tracker.
+            tracker (UsageTracker): The usage statistics.
+            idle_seconds (float, optional): The time without any use after which idle preloading starts. Defaults to 30.
+            interval (float, optional): The time between two idle checks in seconds (the statistics are also saved at this pace). Defaults to 10.
+            max_workers (int, optional): The number of concurrent loads. Defaults to 2.
+        """
+        self.registry = registry
+        self.tracker = tracker
+        self.idle_seconds = idle_seconds
+        self.interval = interval
+        self.max_workers = max_workers
+        self.preloaded = []
+        registry.usage = tracker
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def candidates(self) -> List[str]:
+        """
+        Lists the registered personalities that should be materialized, by decreasing score, as long as their last
+        known footprint fits in the memory budget left.
+        """
+        registry = self.registry
+        budget = registry.memory_budget_mb * 1024 * 1024 if registry.memory_budget_mb is not None else None
+        available = budget - registry.used_memory() if budget is not None else None
+        names = []
+        for name in self.tracker.most_likely(candidates=list(registry.keys())):
+            if registry.is_ready(name) or name in registry.load_errors:
+                continue
+            footprint = self.tracker.entries[name].get("footprint", 0)
+            if available is not None:
+                if footprint > available:
+                    continue
+                available -= footprint
+            names.append(name)
+        return names
+
+    def preload(self):
+        """
+        Materializes the candidates in background threads.
+        """
+        names = self.candidates()
+        if len(names) > 0:
+            print(f"Preloading most used personalities: {', '.join(names)}")
+            self.preloaded.extend(names)
+            self.registry.preload(names, max_workers=self.max_workers)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.tracker.flush()
+            if time.time() - self.registry.last_use >= self.idle_seconds:
+                self.preload()
+
+    def start(self):
+        """
+        Starts the idle preloading thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="personality_predictive_preload", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the idle preloading thread and saves the statistics.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.tracker.flush()
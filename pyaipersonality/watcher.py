@@ -0,0 +1,149 @@
+######
+# Project       : PyAIPersonality
+# File          : watcher.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# Hot reload of mounted personalities.
+# A background thread polls the files of the mounted personality packages and
+# calls AIPersonality.reload on the ones that changed, so configuration edits
+# are applied without rebuilding the personality and processors are rebuilt
+# only when their script changed.
+######
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Mapping
+
+from pyaipersonality import AIPersonality
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+# Files and folders of a package that are watched
+WATCHED_FILES = ["config.yaml", "secret.yaml", "requirements.txt"]
+WATCHED_FOLDERS = ["scripts", "assets"]
+
+
+def package_signature(package_path: str | Path) -> Dict[str, tuple]:
+    """
+    Returns the modification time and size of the watched files of a personality package.
+
+    Args:
+        package_path (str or Path): The personality package folder.
+
+    Returns:
+        dict: relative file path -> (mtime_ns, size).
+    """
+    package_path = Path(package_path)
+    signature = {}
+    for name in WATCHED_FILES:
+        try:
+            st = os.stat(package_path / name)
+            signature[name] = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            pass
+    for folder in WATCHED_FOLDERS:
+        try:
+            entries = list(os.scandir(package_path / folder))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_file():
+                st = entry.stat()
+                signature[f"{folder}/{entry.name}"] = (st.st_mtime_ns, st.st_size)
+    return signature
+
+
+class PersonalityWatcher:
+    """
+    Watches mounted personalities and reloads them when their package changes.
+
+    Usage:
+    ```
+    watcher = PersonalityWatcher(personalities, interval=1.0)
+    watcher.start()
+    ```
+    """
+    def __init__(self, personalities: Mapping[str, AIPersonality], interval: float = 1.0, callback: Callable[[str, dict], None] = None) -> None:
+        """
+        Initialize a PersonalityWatcher.
+
+        Args:
+            personalities (Mapping[str, AIPersonality]): The mounted personalities (a dictionary or a PersonalityRegistry).
+                Personalities added later are picked up automatically.
+            interval (float, optional): The polling interval in seconds. Defaults to 1.0.
+            callback (Callable[[str, dict], None], optional): Called with the personality name and the reload report after each reload.
+        """
+        self.personalities = personalities
+        self.interval = interval
+        self.callback = callback
+        # name -> (personality, signature)
+        self._signatures = {}
+        self.reloads = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def check(self) -> Dict[str, dict]:
+        """
+        Checks all mounted personalities once and reloads the ones that changed.
+
+        Returns:
+            dict: name -> reload report for the reloaded personalities.
+        """
+        reports = {}
+        for name, personality in list(self.personalities.items()):
+            package_path = personality.personality_package_path
+            # Default personalities and archives have no folder to watch
+            if package_path is None or not Path(package_path).is_dir():
+                continue
+            signature = package_signature(package_path)
+            known = self._signatures.get(name)
+            self._signatures[name] = (personality, signature)
+            if known is None or known[0] is not personality or known[1] == signature:
+                continue
+            try:
+                report = personality.reload()
+            except Exception as ex:
+                # Keep serving the previous state, the reload is retried on the next change
+                print(f"Couldn't reload personality {name}: {ex}")
+                continue
+            self.reloads += 1
+            reports[name] = report
+            print(f"Personality {name} reloaded (fields: {', '.join(report['fields']) or 'none'}, processor rebuilt: {report['processor_rebuilt']})")
+            if self.callback is not None:
+                self.callback(name, report)
+        for name in list(self._signatures.keys()):
+            if name not in self.personalities:
+                del self._signatures[name]
+        return reports
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as ex:
+                print(f"Personality watcher error: {ex}")
+
+    def start(self):
+        """
+        Starts watching in a background thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        # Take the initial snapshot so that only later changes trigger reloads
+        self.check()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="personality_watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops watching.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,252 @@
+######
+# Project       : PyAIPersonality
+# File          : zygote.py
+# Author        : ParisNeo with the help of the community
+# license       : Apache 2.0
+# Description   :
+# Fork server (zygote) for personality workers.
+# Processors import heavy libraries (torch, transformers, langchain, selenium...)
+# which makes starting a fresh worker process take seconds. The zygote is a
+# multiprocessing fork server that imports these libraries and pyaipersonality
+# once. Workers are forked from it and share the imported modules copy on write.
+######
+import importlib.util
+import multiprocessing as mp
+import traceback
+from pathlib import Path
+from typing import Callable, List
+
+from pyaipersonality import MSG_TYPE
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/PyAIPersonality"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+# Modules imported by the zygote (the ones that are not installed are skipped)
+DEFAULT_PRELOAD_MODULES = [
+    "pyaipersonality",
+    "pyaipersonality.binding",
+    "pyaipersonality.config_cache",
+    "yaml",
+    "PIL.Image",
+    "numpy",
+    "torch",
+    "transformers",
+    "langchain",
+    "selenium",
+]
+
+_zygote_context = None
+
+
+def get_zygote_context(preload: List[str] = None):
+    """
+    Returns the multiprocessing context forking workers from the zygote.
+
+    The zygote is started by multiprocessing the first time a process is started from the context, and it imports the
+    preload modules once. Platforms without fork server support (Windows) fall back to the spawn context.
+
+    Args:
+        preload (List[str], optional): The modules to import in the zygote. Defaults to DEFAULT_PRELOAD_MODULES.
+            Only the first call sets the preload list (the zygote is shared by the whole process).
+
+    Returns:
+        multiprocessing.context.BaseContext: The context to create processes, queues and values with.
+    """
+    global _zygote_context
+    if _zygote_context is None:
+        if "forkserver" not in mp.get_all_start_methods():
+            _zygote_context = mp.get_context("spawn")
+        else:
+            context = mp.get_context("forkserver")
+            modules = [name for name in (preload if preload is not None else DEFAULT_PRELOAD_MODULES) if _is_importable(name)]
+            context.set_forkserver_preload(modules)
+            _zygote_context = context
+    return _zygote_context
+
+
+def _is_importable(module_name: str) -> bool:
+    try:
+        return importlib.util.find_spec(module_name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+class _RemoteModel:
+    """
+    Stands for the binding of the parent process inside a worker: generation requests are sent to the parent,
+    which owns the model, and the generated chunks are streamed back.
+    """
+    def __init__(self, request_queue, output_queue) -> None:
+        self.request_queue = request_queue
+        self.output_queue = output_queue
+
+    def generate(self, prompt: str, n_predict: int = 128, callback: Callable[[str, MSG_TYPE], bool] = None, verbose: bool = False, **gpt_params):
+        self.output_queue.put(("generate", prompt, n_predict, gpt_params))
+        while True:
+            command = self.request_queue.get()
+            if command[0] == "chunk":
+                # The parent waits for the answer of the callback to know if the generation must stop
+                keep_going = callback(command[1], MSG_TYPE(command[2])) if callback is not None else True
+                self.output_queue.put(("continue", keep_going is not False))
+            elif command[0] == "generated":
+                return command[1]
+
+
+def _worker_main(personality_package_path, run_scripts, request_queue, output_queue):
+    """
+    Worker process entry point: builds the personality then serves the requests of the parent process.
+    """
+    from pyaipersonality import AIPersonality
+    try:
+        personality = AIPersonality(personality_package_path, model=_RemoteModel(request_queue, output_queue), run_scripts=run_scripts)
+        processor = personality.processor
+    except Exception:
+        output_queue.put(("error", traceback.format_exc()))
+        return
+    output_queue.put(("started", personality.name, processor is not None))
+
+    while True:
+        command = request_queue.get()
+        if command is None:
+            break
+        try:
+            if processor is None:
+                raise ValueError(f"Personality {personality.name} has no processor")
+            if command[0] == "run_workflow":
+                def callback(text, message_type=MSG_TYPE.MSG_TYPE_CHUNK):
+                    output_queue.put(("chunk", text, message_type.value))
+                    return True
+                result = processor.run_workflow(command[1], command[2], callback=callback)
+            elif command[0] == "process_model_input":
+                result = processor.process_model_input(command[1])
+            elif command[0] == "process_model_output":
+                result = processor.process_model_output(command[1])
+            else:
+                raise ValueError(f"Unknown command {command[0]}")
+            output_queue.put(("result", result))
+        except Exception:
+            output_queue.put(("error", traceback.format_exc()))
+    if hasattr(processor, "release"):
+        processor.release()
+
+
+class PersonalityWorker:
+    """
+    Runs the processor of a personality in a worker process forked from the zygote.
+
+    The worker uses the model of the parent process: when the processor generates text, the request is executed by
+    the parent (in the method waiting for the result) and the chunks are streamed back to the worker.
+
+    Usage:
+    ```
+    worker = PersonalityWorker("personalities_zoo/english/art/artbot")
+    worker.start()
+    output = worker.run_workflow(model, prompt, discussion, callback)
+    worker.stop()
+    ```
+    """
+    def __init__(self, personality_package_path: str | Path, run_scripts: bool = True, context=None) -> None:
+        """
+        Initialize a PersonalityWorker.
+
+        Args:
+            personality_package_path (str or Path): The personality package.
+            run_scripts (bool, optional): If True, the install step runs and the processor is built in the worker. Defaults to True.
+            context (multiprocessing context, optional): Defaults to the zygote context.
+        """
+        self.personality_package_path = str(personality_package_path)
+        self.run_scripts = run_scripts
+        self.context = context if context is not None else get_zygote_context()
+        self.request_queue = self.context.Queue()
+        self.output_queue = self.context.Queue()
+        self.process = None
+        self.name = None
+        self.has_processor = False
+
+    def start(self):
+        """
+        Starts the worker and waits for the personality to be built.
+
+        Raises:
+            RuntimeError: If the personality couldn't be built in the worker.
+        """
+        if self.process is not None:
+            return
+        self.process = self.context.Process(
+                                target=_worker_main,
+                                args=(self.personality_package_path, self.run_scripts, self.request_queue, self.output_queue),
+                                daemon=True
+                            )
+        self.process.start()
+        message = self.output_queue.get()
+        if message[0] == "error":
+            self.process.join()
+            self.process = None
+            raise RuntimeError(f"Couldn't start personality worker:\n{message[1]}")
+        self.name, self.has_processor = message[1], message[2]
+
+    def stop(self):
+        """
+        Stops the worker.
+        """
+        if self.process is not None:
+            self.request_queue.put(None)
+            self.process.join()
+            self.process = None
+
+    def _call(self, command, model=None, callback: Callable[[str, MSG_TYPE], bool] = None):
+        if self.process is None:
+            self.start()
+        self.request_queue.put(command)
+        while True:
+            message = self.output_queue.get()
+            if message[0] == "chunk":
+                if callback is not None:
+                    callback(message[1], MSG_TYPE(message[2]))
+            elif message[0] == "generate":
+                if model is None:
+                    self.request_queue.put(("generated", ""))
+                    continue
+                _, prompt, n_predict, gpt_params = message
+                def forward(text, message_type=MSG_TYPE.MSG_TYPE_CHUNK):
+                    self.request_queue.put(("chunk", text, message_type.value))
+                    # The workflow streams chunks to the UI before the worker answers, and the UI can stop the generation
+                    keep_going = True
+                    while True:
+                        reply = self.output_queue.get()
+                        if reply[0] == "continue":
+                            return reply[1] and keep_going
+                        if reply[0] == "chunk" and callback is not None:
+                            keep_going = callback(reply[1], MSG_TYPE(reply[2])) is not False and keep_going
+                        elif reply[0] == "error":
+                            raise RuntimeError(reply[1])
+                self.request_queue.put(("generated", model.generate(prompt, n_predict, callback=forward, **gpt_params)))
+            elif message[0] == "result":
+                return message[1]
+            elif message[0] == "error":
+                raise RuntimeError(message[1])
+
+    def run_workflow(self, model, prompt: str, previous_discussion_text: str = "", callback: Callable[[str, MSG_TYPE], bool] = None):
+        """
+        Runs the processor workflow in the worker.
+
+        Args:
+            model (LLMBinding): The model used when the processor generates text.
+            prompt (str): The input prompt.
+            previous_discussion_text (str, optional): The text of the previous discussion.
+            callback (Callable[[str, MSG_TYPE], bool], optional): Receives the chunks sent by the workflow.
+
+        Returns:
+            The workflow output.
+        """
+        return self._call(("run_workflow", prompt, previous_discussion_text), model, callback)
+
+    def process_model_input(self, text: str):
+        """Runs the processor process_model_input in the worker."""
+        return self._call(("process_model_input", text))
+
+    def process_model_output(self, text: str):
+        """Runs the processor process_model_output in the worker."""
+        return self._call(("process_model_output", text))
@@ -29,6 +29,7 @@ setuptools.setup(
     entry_points={
         'console_scripts': [
             'pyaipersonality-server = pyaipersonality.server:main',
+            'pyaipersonality-archive = pyaipersonality.archive:main',
         ],
     },
     extras_require={"dev": requirements_dev},
@@ -0,0 +1,51 @@
+import os
+import shutil
+from pathlib import Path
+
+from pyaipersonality import AIPersonality
+from pyaipersonality.archive import pack
+
+PACKAGE = Path(__file__).resolve().parent.parent / "personalities_zoo" / "english" / "generic" / "chain_of_thoughts"
+
+
+def test_rewritten_archive_keeps_serving_live_personalities(tmp_path, monkeypatch):
+    monkeypatch.setenv("PYAIPERSONALITY_CACHE_DIR", str(tmp_path / "cache"))
+    zoo = tmp_path / "zoo"
+    shutil.copytree(PACKAGE, zoo / "english" / "generic" / "chain_of_thoughts", ignore=shutil.ignore_patterns("__pycache__"))
+    archive_path = tmp_path / "zoo.pap"
+    pack(zoo, archive_path)
+    first = AIPersonality(archive_path / "english" / "generic" / "chain_of_thoughts", run_scripts=False, lazy=True)
+
+    # Rewrite the archive with another content and signature
+    config_file = zoo / "english" / "generic" / "chain_of_thoughts" / "config.yaml"
+    config_file.write_text(config_file.read_text() + "\n# changed\n")
+    pack(zoo, archive_path)
+    st = os.stat(archive_path)
+    os.utime(archive_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    second = AIPersonality(archive_path / "english" / "generic" / "chain_of_thoughts", run_scripts=False, lazy=True)
+
+    assert second._archive is not first._archive
+    assert first.get_logo_data() == (PACKAGE / "assets" / "logo.png").read_bytes()
+    assert first.logo is not None
+
+
+def test_reload_switches_to_the_rewritten_archive(tmp_path, monkeypatch):
+    monkeypatch.setenv("PYAIPERSONALITY_CACHE_DIR", str(tmp_path / "cache"))
+    zoo = tmp_path / "zoo"
+    package = zoo / "english" / "generic" / "chain_of_thoughts"
+    shutil.copytree(PACKAGE, package, ignore=shutil.ignore_patterns("__pycache__"))
+    archive_path = tmp_path / "zoo.pap"
+    pack(zoo, archive_path)
+    personality = AIPersonality(archive_path / "english" / "generic" / "chain_of_thoughts", run_scripts=False, lazy=True)
+    personality.get_logo_data()
+
+    logo = package / "assets" / "logo.png"
+    logo.write_bytes(logo.read_bytes() + b"new version")
+    pack(zoo, archive_path)
+    st = os.stat(archive_path)
+    os.utime(archive_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    personality.reload()
+
+    assert personality._archive.signature == (os.stat(archive_path).st_size, os.stat(archive_path).st_mtime_ns)
+    assert personality.get_logo_data() == logo.read_bytes()
+    assert personality.logo is not None